@@ -0,0 +1,58 @@
+import os
+import json
+from threading import Lock
+import logging
+
+# Настройка логирования
+logger = logging.getLogger("application_logger")
+
+ACCOUNT_STATE_FILE = os.path.join("temp", "account_state.json")
+
+
+class AccountStateStore:
+    """
+    Долговременное состояние аккаунтов (статистика запусков и т.п.), которое,
+    в отличие от таймеров, не удаляется по истечении расписания.
+    Данные хранятся в JSON-файле; ключи аккаунтов приводятся к строкам.
+    """
+
+    def __init__(self, path=ACCOUNT_STATE_FILE):
+        self.path = path
+        self.lock = Lock()
+        self.data = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load account state '{self.path}': {e}")
+            return {}
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w") as f:
+                json.dump(self.data, f, indent=4)
+        except Exception as e:
+            logger.error(f"Failed to save account state '{self.path}': {e}")
+
+    def get(self, account, field, default=None):
+        """
+        Возвращает значение поля состояния аккаунта.
+        """
+        with self.lock:
+            return self.data.get(str(account), {}).get(field, default)
+
+    def update(self, account, **fields):
+        """
+        Обновляет поля состояния аккаунта и сохраняет файл.
+        """
+        with self.lock:
+            self.data.setdefault(str(account), {}).update(fields)
+            self._save()
+
+
+account_state = AccountStateStore()
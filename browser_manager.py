@@ -1,18 +1,30 @@
 import requests
 import time
+import os
+import json
 from selenium import webdriver
 from requests.exceptions import RequestException
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from selenium.common.exceptions import WebDriverException
 import traceback
-from utils import visible, stop_event
+from threading import Thread, Lock
+from utils import visible, stop_event, get_all_profiles, file_lock
+from tracing import traced
+from metrics import adspower_requests_total
 from colorama import Fore, Style
 import logging
 
 # Настройка логирования
 logger = logging.getLogger("application_logger")
 
+ADSPOWER_API_URL = "http://local.adspower.net:50325/api/v1"
+CLOSE_TIMEOUT = 5  # Общий дедлайн закрытия браузера в секундах
+# Профили, запущенные скриптом и ещё не закрытые (переживает перезапуск)
+LAUNCHED_PROFILES_FILE = os.path.join("temp", "launched_profiles.json")
+launched_profiles_lock = Lock()
+profile_ids_cache = {}  # user_id профиля AdsPower -> serial_number
+
 
 class BrowserManager:
     MAX_RETRIES = 3
@@ -21,6 +33,8 @@ class BrowserManager:
         self.serial_number = serial_number
         self.driver = None
         self.headless_mode = 0 if visible.is_set() else 1
+        self.launch_latency = None  # Время ответа API на запуск профиля, сек
+        self.profiler = None  # Профилировщик команд WebDriver (PROFILE_WEBDRIVER)
 
     def check_browser_status(self):
         """
@@ -29,8 +43,9 @@ class BrowserManager:
         try:
             logger.debug(
                 f"#{self.serial_number}: Checking browser status via API.")
+            adspower_requests_total.inc(endpoint="/browser/active")
             response = requests.get(
-                'http://local.adspower.net:50325/api/v1/browser/active',
+                f'{ADSPOWER_API_URL}/browser/active',
                 params={'serial_number': self.serial_number}
             )
             logger.debug(
@@ -64,6 +79,16 @@ class BrowserManager:
             logger.debug(traceback.format_exc())
             return False
 
+    def is_busy(self):
+        """
+        Проверяет, открыт ли профиль кем-то кроме скрипта.
+        Браузеры, оставшиеся от предыдущих запусков скрипта, занятыми не считаются:
+        start_browser закроет их сам.
+        """
+        if not self.check_browser_status():
+            return False
+        return str(self.serial_number) not in get_launched_profiles()
+
     def wait_browser_close(self):
         """
         Ожидает закрытия браузера, если он активен, с проверкой stop_event.
@@ -103,6 +128,7 @@ class BrowserManager:
             return False
 
 
+    @traced("start_browser")
     def start_browser(self):
         """
         Запускает браузер через AdsPower API и настраивает Selenium WebDriver.
@@ -121,19 +147,23 @@ class BrowserManager:
 
                 # Формирование URL для запуска браузера
                 request_url = (
-                    f'http://local.adspower.net:50325/api/v1/browser/start?'
+                    f'{ADSPOWER_API_URL}/browser/start?'
                     f'serial_number={self.serial_number}&ip_tab=0&headless={self.headless_mode}'
                 )
                 logger.debug(
                     f"#{self.serial_number}: Request URL for starting browser: {request_url}")
 
                 # Выполнение запроса к API
+                request_started = time.monotonic()
+                adspower_requests_total.inc(endpoint="/browser/start")
                 response = requests.get(request_url)
+                self.launch_latency = time.monotonic() - request_started
                 response.raise_for_status()
                 data = response.json()
                 logger.debug(f"#{self.serial_number}: API response: {data}")
 
                 if data['code'] == 0:
+                    mark_profile_launched(self.serial_number)
                     selenium_address = data['data']['ws']['selenium']
                     webdriver_path = data['data']['webdriver']
                     logger.debug(
@@ -159,6 +189,7 @@ class BrowserManager:
                     self.driver = webdriver.Chrome(
                         service=service, options=chrome_options)
                     self.driver.set_window_size(600, 720)
+                    self.browser_closed = False
                     logger.info(
                         f"#{self.serial_number}: Browser started successfully.")
                     return True
@@ -188,9 +219,43 @@ class BrowserManager:
             f"#{self.serial_number}: Failed to start browser after {self.MAX_RETRIES} retries.")
         return False
 
-    def close_browser(self):
+    def stop_browser_via_api(self, timeout=10):
         """
-        Закрывает браузер с использованием WebDriver как основного способа и API как резервного.
+        Останавливает браузер через API AdsPower.
+        """
+        try:
+            logger.debug(
+                f"#{self.serial_number}: Attempting to stop browser via API.")
+            adspower_requests_total.inc(endpoint="/browser/stop")
+            response = requests.get(
+                f'{ADSPOWER_API_URL}/browser/stop',
+                params={'serial_number': self.serial_number},
+                timeout=timeout
+            )
+            response.raise_for_status()
+            data = response.json()
+            logger.debug(
+                f"#{self.serial_number}: API response for browser stop: {data}")
+
+            if data.get('code') == 0:
+                logger.debug(
+                    f"#{self.serial_number}: Browser stopped successfully via API.")
+                return True
+            logger.warning(
+                f"#{self.serial_number}: API stop returned unexpected code: {data.get('code')}")
+        except requests.exceptions.RequestException as e:
+            logger.debug(
+                f"#{self.serial_number}: Network issue while stopping browser via API: {str(e)}")
+        except Exception as e:
+            logger.debug(
+                f"#{self.serial_number}: Unexpected error during API stop: {str(e)}")
+        return False
+
+    @traced("close_browser")
+    def close_browser(self, timeout=CLOSE_TIMEOUT):
+        """
+        Закрывает браузер: завершение сессии WebDriver и остановка профиля через API
+        выполняются параллельно, общее время ограничено timeout секундами.
         """
         logger.debug(
             f"#{self.serial_number}: Initiating browser closure process.")
@@ -202,54 +267,267 @@ class BrowserManager:
             return False
 
         self.browser_closed = True  # Устанавливаем флаг перед попыткой закрытия
+        driver, self.driver = self.driver, None
+        if self.profiler:
+            try:
+                self.profiler.report()
+            except Exception as e:
+                logger.debug(
+                    f"#{self.serial_number}: Failed to report WebDriver profile: {e}")
+            self.profiler = None
+        result = {"stopped": False}
 
-        # Попытка закрыть браузер через WebDriver
-        if not stop_event.is_set():
+        def quit_driver():
             try:
-                if self.driver:
-                    logger.debug(
-                        f"#{self.serial_number}: Attempting to close Chromedriver via WebDriver.")
-                    self.driver.quit()  # Закрываем все окна и завершаем сессию WebDriver
-                    logger.debug(
-                        f"#{self.serial_number}: Chromedriver closed successfully via WebDriver.")
+                logger.debug(
+                    f"#{self.serial_number}: Attempting to close Chromedriver via WebDriver.")
+                driver.quit()  # Закрываем все окна и завершаем сессию WebDriver
+                logger.debug(
+                    f"#{self.serial_number}: Chromedriver closed successfully via WebDriver.")
             except WebDriverException as e:
                 logger.debug(
                     f"#{self.serial_number}: WebDriverException while closing Chromedriver: {str(e)}")
             except Exception as e:
                 logger.debug(
                     f"#{self.serial_number}: General exception while closing Chromedriver via WebDriver: {str(e)}")
-            finally:
-                # Устанавливаем driver в None
-                self.driver = None
-                logger.debug(
-                    f"#{self.serial_number}: Resetting driver to None.")
+
+        def stop_profile():
+            result["stopped"] = self.stop_browser_via_api(timeout=timeout)
+
+        deadline = time.monotonic() + timeout
+        # Остановка через API определяет результат, quit лишь освобождает chromedriver
+        api_thread = Thread(target=stop_profile, daemon=True)
+        api_thread.start()
+        if driver:
+            Thread(target=quit_driver, daemon=True).start()
+        api_thread.join(max(0, deadline - time.monotonic()))
+
+        if result["stopped"]:
+            mark_profile_launched(self.serial_number, launched=False)
+            return True
+        if api_thread.is_alive():
+            logger.warning(
+                f"#{self.serial_number}: Browser closure did not finish within {timeout} seconds.")
+        else:
+            logger.error(
+                f"#{self.serial_number}: Browser closure process completed with errors.")
+        return False
+
+
+def close_browsers(managers, timeout=CLOSE_TIMEOUT):
+    """
+    Параллельно закрывает браузеры нескольких профилей с общим дедлайном.
+
+    :param managers: Итерируемый набор объектов BrowserManager.
+    :param timeout: Общее время ожидания закрытия в секундах.
+    :return: Количество профилей, закрытие которых не уложилось в дедлайн.
+    """
+    deadline = time.monotonic() + timeout
+    threads = []
+    for manager in managers:
+        thread = Thread(target=manager.close_browser,
+                        kwargs={"timeout": timeout}, daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join(max(0, deadline - time.monotonic()))
+
+    pending = sum(1 for thread in threads if thread.is_alive())
+    if pending:
+        logger.warning(
+            f"{pending} browser(s) did not close within {timeout} seconds.")
+    return pending
+
+
+def _read_launched_profiles():
+    if not os.path.exists(LAUNCHED_PROFILES_FILE):
+        return set()
+    try:
+        with open(LAUNCHED_PROFILES_FILE, "r") as f:
+            return set(json.load(f))
+    except Exception as e:
+        logger.debug(f"Failed to load launched profiles: {e}")
+        return set()
+
+
+def get_launched_profiles():
+    """
+    Возвращает множество номеров профилей, запущенных скриптом и не закрытых.
+    """
+    with launched_profiles_lock, file_lock(LAUNCHED_PROFILES_FILE):
+        return _read_launched_profiles()
+
+
+def mark_profile_launched(serial_number, launched=True):
+    """
+    Отмечает профиль как запущенный скриптом или снимает отметку.
+    """
+    serial_number = str(serial_number)
+    with launched_profiles_lock, file_lock(LAUNCHED_PROFILES_FILE):
+        profiles = _read_launched_profiles()
+        if launched:
+            profiles.add(serial_number)
+        else:
+            profiles.discard(serial_number)
         try:
-            logger.debug(
-                f"#{self.serial_number}: Attempting to stop browser via API as fallback.")
-            response = requests.get(
-                'http://local.adspower.net:50325/api/v1/browser/stop',
-                params={'serial_number': self.serial_number},
-                timeout=10
-            )
-            response.raise_for_status()
-            data = response.json()
-            logger.debug(
-                f"#{self.serial_number}: API response for browser stop: {data}")
+            os.makedirs(os.path.dirname(LAUNCHED_PROFILES_FILE), exist_ok=True)
+            with open(LAUNCHED_PROFILES_FILE, "w") as f:
+                json.dump(sorted(profiles), f)
+        except Exception as e:
+            logger.debug(f"Failed to save launched profiles: {e}")
 
-            if data.get('code') == 0:
-                logger.debug(
-                    f"#{self.serial_number}: Browser stopped successfully via API.")
-                return True
-            else:
-                logger.warning(
-                    f"#{self.serial_number}: API stop returned unexpected code: {data.get('code')}")
-        except requests.exceptions.RequestException as e:
-            logger.debug(
-                f"#{self.serial_number}: Network issue while stopping browser via API: {str(e)}")
+
+def migrate_launched_profiles(accounts):
+    """
+    Однократно заполняет список запущенных скриптом профилей при первом запуске
+    после обновления: открытые профили аккаунтов скрипта считаются оставшимися
+    от его прошлой версии, а не открытыми вручную. Иначе они откладывались бы бесконечно.
+
+    :param accounts: Номера профилей, которые обрабатывает скрипт.
+    :return: Количество отмеченных профилей.
+    """
+    if os.path.exists(LAUNCHED_PROFILES_FILE):
+        return 0
+    user_ids = get_active_browsers()
+    if user_ids is None:
+        return 0
+    serial_numbers = set(resolve_serial_numbers(user_ids).values()) if user_ids else set()
+    if None in serial_numbers:
+        # Без сопоставления номеров миграция повторится при следующем запуске
+        logger.debug(
+            "Failed to resolve active profiles. Launched profiles migration postponed.")
+        return 0
+    leftovers = serial_numbers & {str(account) for account in accounts}
+    with launched_profiles_lock, file_lock(LAUNCHED_PROFILES_FILE):
+        try:
+            os.makedirs(os.path.dirname(LAUNCHED_PROFILES_FILE), exist_ok=True)
+            with open(LAUNCHED_PROFILES_FILE, "w") as f:
+                json.dump(sorted(leftovers), f)
         except Exception as e:
+            logger.debug(f"Failed to save launched profiles: {e}")
+            return 0
+    if leftovers:
+        logger.info(
+            f"Marked {len(leftovers)} open profile(s) as launched by the script: {', '.join(sorted(leftovers))}")
+    return len(leftovers)
+
+
+def get_active_browsers(timeout=10):
+    """
+    Возвращает user_id всех открытых профилей одним запросом к API AdsPower.
+
+    :return: Список user_id или None, если API недоступно.
+    """
+    try:
+        adspower_requests_total.inc(endpoint="/browser/local-active")
+        response = requests.get(
+            f'{ADSPOWER_API_URL}/browser/local-active', timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+        if data.get('code') != 0:
             logger.debug(
-                f"#{self.serial_number}: Unexpected error during API stop: {str(e)}")
+                f"Unexpected response while listing active browsers: {data}")
+            return None
+        return [item['user_id'] for item in data.get('data', {}).get('list', [])]
+    except requests.exceptions.RequestException as e:
+        logger.debug(f"Network issue while listing active browsers: {e}")
+    except Exception as e:
+        logger.debug(f"Unexpected error while listing active browsers: {e}")
+    return None
 
-        logger.error(
-            f"#{self.serial_number}: Browser closure process completed with errors.")
+
+def resolve_serial_numbers(user_ids):
+    """
+    Сопоставляет user_id профилей с их номерами, обновляя кэш при промахе.
+    """
+    if any(user_id not in profile_ids_cache for user_id in user_ids):
+        for profile in get_all_profiles():
+            profile_ids_cache[profile['user_id']] = str(
+                profile['serial_number'])
+    return {user_id: profile_ids_cache.get(user_id) for user_id in user_ids}
+
+
+def stop_profile_by_user_id(user_id, timeout=10):
+    """
+    Останавливает профиль по user_id через API AdsPower.
+    """
+    try:
+        adspower_requests_total.inc(endpoint="/browser/stop")
+        response = requests.get(
+            f'{ADSPOWER_API_URL}/browser/stop',
+            params={'user_id': user_id},
+            timeout=timeout
+        )
+        response.raise_for_status()
+        return response.json().get('code') == 0
+    except Exception as e:
+        logger.debug(f"Failed to stop profile {user_id} via API: {e}")
         return False
+
+
+def reap_orphaned_browsers(claim, release, timeout=CLOSE_TIMEOUT):
+    """
+    Закрывает браузеры, оставшиеся открытыми после сбоя или перезапуска.
+    Сиротой считается профиль, который запускал скрипт, и который планировщик
+    сейчас не обрабатывает. Профили, открытые вручную, не затрагиваются.
+    На время остановки профиль занимается, чтобы воркер не запустил его
+    между проверкой и остановкой.
+
+    :param claim: Функция, занимающая профиль по номеру; False, если профиль обрабатывается.
+    :param release: Функция, освобождающая занятый профиль.
+    :param timeout: Общее время ожидания остановки в секундах.
+    :return: Количество закрытых профилей.
+    """
+    user_ids = get_active_browsers()
+    if user_ids is None:
+        return 0
+
+    launched = get_launched_profiles()
+    serial_numbers = resolve_serial_numbers(user_ids) if user_ids else {}
+
+    if None in serial_numbers.values():
+        # Список профилей недоступен: открытые браузеры нельзя сопоставить с номерами,
+        # поэтому отметки запущенных профилей не снимаются
+        logger.debug(
+            "Failed to resolve some active profiles. Skipping launched profiles cleanup.")
+    else:
+        # Профили, которые уже закрыты, больше не отслеживаем
+        for serial_number in launched - set(serial_numbers.values()):
+            if claim(serial_number):
+                try:
+                    mark_profile_launched(serial_number, launched=False)
+                finally:
+                    release(serial_number)
+
+    orphans = {}
+    for user_id, serial_number in serial_numbers.items():
+        if serial_number in launched and claim(serial_number):
+            orphans[user_id] = serial_number
+    if not orphans:
+        logger.debug("No orphaned browsers found.")
+        return 0
+
+    logger.info(f"Stopping {len(orphans)} orphaned browser(s): "
+                f"{', '.join(sorted(orphans.values()))}")
+    stopped = []
+
+    def stop_orphan(user_id, serial_number):
+        # Профиль остаётся занятым до конца остановки, даже после общего дедлайна
+        try:
+            if stop_profile_by_user_id(user_id, timeout=timeout):
+                mark_profile_launched(serial_number, launched=False)
+                stopped.append(serial_number)
+        finally:
+            release(serial_number)
+
+    deadline = time.monotonic() + timeout
+    threads = [Thread(target=stop_orphan, args=item, daemon=True)
+               for item in orphans.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(max(0, deadline - time.monotonic()))
+
+    logger.debug(f"Orphaned browsers stopped: {len(stopped)}/{len(orphans)}")
+    return len(stopped)
@@ -0,0 +1,128 @@
+import re
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+import logging
+
+# Настройка логирования
+logger = logging.getLogger("application_logger")
+
+CONTROL_HOST = "127.0.0.1"  # API управления доступно только локально
+CLIENT_TIMEOUT = 5
+
+
+class ControlError(Exception):
+    """
+    Ошибка выполнения команды управления с HTTP-статусом ответа.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class _ControlHandler(BaseHTTPRequestHandler):
+    def _dispatch(self, method):
+        # Запросы со страниц браузера (с заголовком Origin) отклоняются,
+        # чтобы сторонний сайт не мог управлять планировщиком через localhost
+        if self.headers.get("Origin"):
+            self._respond(403, {"error": "Cross-origin requests are not allowed."})
+            return
+        path = self.path.split("?", 1)[0].rstrip("/") or "/"
+        for route_method, pattern, handler in self.server.routes:
+            match = pattern.fullmatch(path)
+            if not match:
+                continue
+            if route_method != method:
+                self._respond(405, {"error": f"Use {route_method} for {path}."})
+                return
+            try:
+                self._respond(200, handler(**match.groupdict()))
+            except ControlError as e:
+                self._respond(e.status, {"error": str(e)})
+            except Exception as e:
+                logger.error(f"Control command {method} {path} failed: {e}")
+                self._respond(500, {"error": str(e)})
+            return
+        self._respond(404, {"error": f"Unknown command {path}."})
+
+    def _respond(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False,
+                          default=str, indent=2).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def log_message(self, format, *args):
+        logger.debug(f"Control request: {format % args}")
+
+
+class ControlServer:
+    """
+    HTTP API управления работающим планировщиком (только localhost).
+
+    Команды задаются маршрутами (метод, шаблон пути, обработчик). Обработчик получает
+    именованные группы шаблона и возвращает словарь, который отдаётся в JSON.
+
+    :param routes: Список (метод, регулярное выражение пути, обработчик).
+    :param port: Порт сервера.
+    """
+
+    def __init__(self, routes, port):
+        self.routes = [(method, re.compile(pattern), handler)
+                       for method, pattern, handler in routes]
+        self.port = port
+        self.server = None
+
+    def start(self):
+        """
+        Запускает сервер в фоновом потоке.
+
+        :return: True, если сервер запущен.
+        """
+        try:
+            self.server = ThreadingHTTPServer(
+                (CONTROL_HOST, self.port), _ControlHandler)
+        except OSError as e:
+            logger.error(
+                f"Failed to start control API on port {self.port}: {e}")
+            return False
+        self.server.daemon_threads = True
+        self.server.routes = self.routes
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(
+            f"Control API available at http://{CONTROL_HOST}:{self.port}/")
+        return True
+
+    def shutdown(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def send_command(port, method, path, timeout=CLIENT_TIMEOUT):
+    """
+    Отправляет команду работающему планировщику.
+
+    :return: Кортеж (HTTP-статус, ответ) или None, если планировщик не запущен.
+    """
+    try:
+        response = requests.request(
+            method, f"http://{CONTROL_HOST}:{port}{path}", timeout=timeout)
+    except requests.exceptions.RequestException:
+        return None
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = {"error": response.text}
+    return response.status_code, payload
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import time
+import threading
+from datetime import datetime
+import logging
+
+# Настройка логирования
+logger = logging.getLogger("application_logger")
+
+PROFILE_FILE = os.path.join("log", "webdriver_profile.jsonl")
+SLOWEST_CALLS = 5  # Количество самых медленных вызовов в сводке
+TOP_CALLERS = 10  # Количество методов в сводке
+CALLER_FILE = "telegram_bot_automation.py"  # Модуль, методы которого считаются источником вызовов
+
+_profile_file_lock = threading.Lock()
+_step = threading.local()
+
+
+def set_current_step(step):
+    """
+    Запоминает текущий шаг обработки для потока (используется при разбивке команд по шагам).
+    """
+    _step.name = step
+
+
+def get_current_step():
+    return getattr(_step, "name", None)
+
+
+def is_profiling_enabled(settings):
+    return settings.get("PROFILE_WEBDRIVER", "false").strip().lower() == "true"
+
+
+def _find_caller():
+    """
+    Возвращает имя метода TelegramBotAutomation, из которого выполнена команда WebDriver.
+    """
+    frame = sys._getframe(2)
+    while frame:
+        if frame.f_code.co_filename.endswith(CALLER_FILE):
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return "other"
+
+
+class DriverProfiler:
+    """
+    Профилировщик команд WebDriver.
+
+    Подменяет метод execute экземпляра драйвера: через него проходят все команды,
+    включая команды элементов (.text, get_attribute, find_elements, опросы WebDriverWait)
+    и CDP. Для каждой команды учитываются количество и время по методу бота и шагу обработки.
+
+    :param account: Аккаунт (серийный номер профиля).
+    :param driver: Экземпляр Selenium WebDriver.
+    """
+
+    def __init__(self, account, driver):
+        self.account = account
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.stats = {}  # (метод, шаг, команда) -> [количество, суммарное время]
+        self.slowest = []  # [(время, команда, метод, шаг)]
+        self.commands = 0
+        self.wire_time = 0.0
+        self._execute = driver.execute
+        driver.execute = self.execute
+
+    def execute(self, driver_command, params=None):
+        started = time.perf_counter()
+        try:
+            return self._execute(driver_command, params)
+        finally:
+            self.record(driver_command, time.perf_counter() - started)
+
+    def record(self, command, duration):
+        method = _find_caller()
+        step = get_current_step()
+        with self.lock:
+            stat = self.stats.setdefault((method, step, command), [0, 0.0])
+            stat[0] += 1
+            stat[1] += duration
+            self.commands += 1
+            self.wire_time += duration
+            self.slowest.append((duration, command, method, step))
+            if len(self.slowest) > SLOWEST_CALLS * 4:
+                self.slowest.sort(reverse=True)
+                del self.slowest[SLOWEST_CALLS:]
+
+    def summary(self):
+        """
+        Возвращает сводку по командам за время жизни драйвера.
+        """
+        with self.lock:
+            by_caller = {}
+            for (method, step, command), (count, total) in self.stats.items():
+                caller = by_caller.setdefault(
+                    (method, step), {"method": method, "step": step, "commands": 0, "time": 0.0, "by_command": {}})
+                caller["commands"] += count
+                caller["time"] += total
+                caller["by_command"][command] = count
+            callers = sorted(by_caller.values(),
+                             key=lambda item: item["time"], reverse=True)
+            for caller in callers:
+                caller["time"] = round(caller["time"], 3)
+            slowest = sorted(self.slowest, reverse=True)[:SLOWEST_CALLS]
+            return {
+                "account": self.account,
+                "finished": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "duration": round(time.monotonic() - self.started, 1),
+                "commands": self.commands,
+                "wire_time": round(self.wire_time, 3),
+                "callers": callers[:TOP_CALLERS],
+                "slowest": [
+                    {"time": round(duration, 3), "command": command,
+                     "method": method, "step": step}
+                    for duration, command, method, step in slowest
+                ],
+            }
+
+    def report(self, path=PROFILE_FILE):
+        """
+        Выводит сводку в лог и дописывает её в JSONL-файл.
+        """
+        summary = self.summary()
+        if not summary["commands"]:
+            return summary
+        lines = [
+            f"#{self.account}: WebDriver profile: {summary['commands']} commands, "
+            f"{summary['wire_time']:.2f}s wire time in {summary['duration']:.0f}s session."
+        ]
+        for caller in summary["callers"]:
+            lines.append(
+                f"  {caller['method']} [{caller['step'] or '-'}]: {caller['commands']} commands, {caller['time']:.2f}s")
+        for call in summary["slowest"]:
+            lines.append(
+                f"  slow: {call['command']} {call['time']:.2f}s in {call['method']} [{call['step'] or '-'}]")
+        logger.info("\n".join(lines))
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with _profile_file_lock:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.error(f"Failed to write WebDriver profile '{path}': {e}")
+        return summary
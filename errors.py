@@ -0,0 +1,134 @@
+import random
+import requests
+from selenium.common.exceptions import WebDriverException, TimeoutException
+
+# Действия при ошибке обработки аккаунта
+RETRY_IN_SESSION = "in_session"  # Повтор в той же сессии браузера
+RELAUNCH = "relaunch"            # Повтор с перезапуском браузера
+BACKOFF = "backoff"              # Короткая пауза и возврат в очередь
+QUARANTINE = "quarantine"        # Длительная пауза для неисправного аккаунта
+
+# Признаки потери связи с профилем в тексте WebDriverException
+BROWSER_GONE_MARKERS = (
+    "chrome not reachable",
+    "invalid session id",
+    "disconnected",
+    "connection refused",
+    "max retries exceeded",
+)
+
+
+class AutomationError(Exception):
+    """
+    Базовый класс ошибок обработки аккаунта.
+    """
+
+
+class ProfileBusyError(AutomationError):
+    """
+    Профиль открыт вне скрипта (вручную или другим инструментом).
+    """
+
+
+class AdsPowerError(AutomationError):
+    """
+    Сбой API AdsPower, запуска профиля или сетевого соединения с ним.
+    """
+
+
+class NavigationError(AutomationError):
+    """
+    Не удалось открыть Telegram Web, найти группу или ссылку на приложение.
+    """
+
+
+class IframeValidationError(AutomationError):
+    """
+    Iframe приложения не загрузился или содержит неожиданный адрес.
+    """
+
+
+class GameStateError(AutomationError):
+    """
+    Не удалось прочитать состояние игры (баланс, прогресс).
+    """
+
+
+class AuthError(AutomationError):
+    """
+    Сессия Telegram недействительна: нет данных пользователя.
+    """
+
+
+class BudgetExceededError(AutomationError):
+    """
+    Запуск или шаг превысил отведённое время и был остановлен сторожем.
+    """
+
+
+class RetryPolicy:
+    """
+    Политика повторов для класса ошибок.
+
+    :param action: Действие при ошибке (RETRY_IN_SESSION, RELAUNCH, BACKOFF, QUARANTINE).
+    :param max_attempts: Количество попыток в рамках одного запуска аккаунта.
+    :param backoff: Диапазон паузы (мин, макс) в секундах после исчерпания попыток.
+    """
+
+    def __init__(self, action, max_attempts, backoff):
+        self.action = action
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def backoff_delay(self, streak=1, cap=None):
+        """
+        Возвращает паузу перед повтором, удваивая её с каждой подряд неудачной обработкой.
+
+        :param streak: Количество неудачных обработок аккаунта подряд.
+        :param cap: Максимальная пауза в секундах.
+        """
+        delay = random.randint(*self.backoff) * 2 ** max(0, streak - 1)
+        return min(delay, cap) if cap else delay
+
+
+RETRY_POLICIES = {
+    AdsPowerError: RetryPolicy(BACKOFF, 1, (60, 300)),
+    NavigationError: RetryPolicy(RELAUNCH, 3, (900, 1800)),
+    IframeValidationError: RetryPolicy(RETRY_IN_SESSION, 3, (900, 1800)),
+    GameStateError: RetryPolicy(RETRY_IN_SESSION, 3, (900, 1800)),
+    AuthError: RetryPolicy(QUARANTINE, 1, (6 * 3600, 12 * 3600)),
+    BudgetExceededError: RetryPolicy(BACKOFF, 1, (900, 1800)),
+}
+# Для неклассифицированных ошибок сохраняется прежнее поведение
+DEFAULT_RETRY_POLICY = RetryPolicy(RELAUNCH, 3, (1800, 4200))
+
+
+def classify_error(error):
+    """
+    Приводит исключение к классу из таксономии ошибок.
+
+    :param error: Исключение, возникшее при обработке аккаунта.
+    :return: Экземпляр AutomationError или исходное исключение, если класс не определён.
+    """
+    if isinstance(error, AutomationError):
+        return error
+    if isinstance(error, requests.exceptions.RequestException):
+        return AdsPowerError(str(error))
+    if isinstance(error, TimeoutException):
+        return NavigationError(str(error).splitlines()[0] if str(error) else "Timeout")
+    if isinstance(error, WebDriverException):
+        message = str(error).lower()
+        if any(marker in message for marker in BROWSER_GONE_MARKERS):
+            return AdsPowerError(str(error).splitlines()[0])
+        return NavigationError(str(error).splitlines()[0] if str(error) else "WebDriver error")
+    return error
+
+
+def get_retry_policy(error):
+    """
+    Возвращает политику повторов для классифицированной ошибки.
+    """
+    for error_class in type(error).__mro__:
+        if error_class in RETRY_POLICIES:
+            return RETRY_POLICIES[error_class]
+    return DEFAULT_RETRY_POLICY
@@ -0,0 +1,221 @@
+import time
+import requests
+from collections import deque
+from threading import Lock, Thread
+from colorama import Fore
+from browser_manager import ADSPOWER_API_URL
+from metrics import adspower_requests_total
+from errors import AdsPowerError, NavigationError
+import logging
+
+# Настройка логирования
+logger = logging.getLogger("application_logger")
+
+# Состояния глобального предохранителя
+CLOSED = "closed"        # Зависимости доступны, очередь работает
+OPEN = "open"            # Сбой зависимостей, очередь удерживается
+HALF_OPEN = "half_open"  # Восстановление, запуски допускаются постепенно
+
+# Ошибки, указывающие на сбой общих зависимостей, а не конкретного аккаунта.
+# Ошибки навигации сюда не входят: у каждого профиля свой прокси,
+# и недоступность Telegram через один прокси не говорит об общем сбое
+OUTAGE_ERRORS = (AdsPowerError,)
+
+# Ошибки навигации учитываются отдельно, по количеству различных аккаунтов:
+# сбой Telegram признаётся, только если он затронул несколько профилей
+TELEGRAM_ERRORS = (NavigationError,)
+
+ADSPOWER_STATUS_URL = ADSPOWER_API_URL.rsplit("/api/", 1)[0] + "/status"
+PROBE_TIMEOUT = 10
+
+
+def probe_adspower():
+    """
+    Проверяет доступность локального API AdsPower.
+    """
+    try:
+        adspower_requests_total.inc(endpoint="/status")
+        response = requests.get(ADSPOWER_STATUS_URL, timeout=PROBE_TIMEOUT)
+        response.raise_for_status()
+        return response.json().get("code") == 0
+    except Exception as e:
+        logger.debug(f"AdsPower probe failed: {e}")
+        return False
+
+
+DEFAULT_PROBES = {"AdsPower": probe_adspower}
+
+
+class HealthMonitor:
+    """
+    Глобальный предохранитель для сбоев AdsPower и Telegram.
+
+    Учитывает долю сбойных запусков по всем аккаунтам и дешёвые проверки доступности.
+    Размыкается и удерживает очередь, только если доля сбоев в окне повышена и
+    probe_failures проверок подряд завершились неудачей, либо если ошибки навигации
+    за nav_window секунд возникли у nav_accounts различных аккаунтов (один сбойный прокси
+    так предохранитель не разомкнёт). После успешных проверок переходит
+    в режим восстановления, допуская сначала один запуск, затем вдвое больше после
+    каждого успешного, пока не будет достигнуто количество воркеров.
+
+    :param workers: Количество воркеров.
+    :param probes: Словарь {имя: функция проверки}.
+    :param window: Количество последних запусков для расчёта доли сбоев.
+    :param threshold: Доля сбоев, после которой выполняются проверки.
+    :param min_samples: Минимальное количество запусков для оценки доли сбоев.
+    :param probe_interval: Интервал проверок в секундах.
+    :param probe_failures: Количество неудачных проверок подряд для размыкания.
+    :param nav_accounts: Количество различных аккаунтов с ошибками навигации для размыкания.
+    :param nav_window: Окно учёта ошибок навигации в секундах.
+    """
+
+    def __init__(self, workers, probes=None, window=20, threshold=0.6, min_samples=5, probe_interval=60,
+                 probe_failures=3, nav_accounts=3, nav_window=600):
+        self.workers = workers
+        self.probes = probes or DEFAULT_PROBES
+        self.outcomes = deque(maxlen=window)
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.probe_interval = probe_interval
+        self.lock = Lock()
+        self.state = CLOSED
+        self.allowed = workers  # Допустимое количество одновременных запусков
+        self.running = 0
+        self.probe_failures = max(1, probe_failures)
+        self.failed_probes = 0  # Неудачные проверки подряд
+        self.rate_elevated = False
+        self.nav_accounts = max(2, nav_accounts)
+        self.nav_window = nav_window
+        self.nav_failures = {}  # аккаунт -> время последней ошибки навигации
+
+    def is_open(self):
+        with self.lock:
+            return self.state == OPEN
+
+    def try_acquire(self):
+        """
+        Запрашивает разрешение на запуск задачи из очереди.
+
+        :return: True, если запуск разрешён (тогда обязателен вызов release).
+        """
+        with self.lock:
+            if self.state == OPEN or self.running >= self.allowed:
+                return False
+            self.running += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.running = max(0, self.running - 1)
+
+    def record_outcome(self, success, error=None, account=None):
+        """
+        Учитывает результат попытки обработки аккаунта.
+        Ошибки, не связанные со сбоем зависимостей, не учитываются.
+        """
+        if not success and isinstance(error, TELEGRAM_ERRORS) and account is not None:
+            self._record_navigation_failure(account)
+            return
+        if not success and not isinstance(error, OUTAGE_ERRORS):
+            return
+
+        with self.lock:
+            self.outcomes.append(success)
+            if self.state == HALF_OPEN:
+                if not success:
+                    self._open("failure during recovery")
+                    return
+                self.allowed = min(self.workers, self.allowed * 2)
+                if self.allowed >= self.workers:
+                    self._close()
+                return
+
+            was_elevated = self.rate_elevated
+            self.rate_elevated = self._is_rate_elevated()
+            check_probes = self.state == CLOSED and self.rate_elevated and not was_elevated
+            failure_rate = self._failure_rate()
+
+        if check_probes:
+            # Дальнейшие проверки выполняет периодический поток
+            logger.warning(
+                f"High failure rate across accounts ({failure_rate:.0%}). Checking dependencies...")
+            self.check()
+
+    def _record_navigation_failure(self, account):
+        """
+        Учитывает ошибку навигации аккаунта и размыкает предохранитель,
+        если за окно ошибки возникли у nav_accounts различных аккаунтов.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.nav_failures[str(account)] = now
+            self.nav_failures = {
+                key: at for key, at in self.nav_failures.items() if now - at <= self.nav_window}
+            affected = len(self.nav_failures)
+            if self.state == OPEN or affected < self.nav_accounts:
+                return
+            self.nav_failures.clear()
+            self._open(
+                f"Telegram unreachable from {affected} accounts within {self.nav_window}s")
+
+    def _failure_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def _is_rate_elevated(self):
+        return len(self.outcomes) >= self.min_samples and self._failure_rate() >= self.threshold
+
+    def check(self):
+        """
+        Выполняет проверки доступности и обновляет состояние предохранителя.
+        """
+        results = {name: probe() for name, probe in self.probes.items()}
+        healthy = all(results.values())
+        with self.lock:
+            if healthy:
+                self.failed_probes = 0
+                if self.state == OPEN:
+                    # После сбоя Telegram пробные запуски в режиме восстановления
+                    # заново наберут ошибки навигации, если сбой продолжается
+                    self.state = HALF_OPEN
+                    self.allowed = 1
+                    self.outcomes.clear()
+                    self.rate_elevated = False
+                    logger.info("Dependencies are reachable again. Resuming queue gradually.",
+                                extra={'color': Fore.YELLOW})
+            else:
+                self.failed_probes += 1
+                down = ", ".join(
+                    name for name, ok in results.items() if not ok)
+                if self.state != OPEN and self.failed_probes < self.probe_failures:
+                    logger.warning(
+                        f"{down} unreachable ({self.failed_probes}/{self.probe_failures} checks).")
+                elif self.state == HALF_OPEN or (self.state == CLOSED and self.rate_elevated):
+                    self._open(f"{down} unreachable")
+        return healthy
+
+    def _open(self, reason):
+        self.state = OPEN
+        self.allowed = 0
+        logger.error(
+            f"Health circuit opened ({reason}). Holding the task queue.")
+
+    def _close(self):
+        self.state = CLOSED
+        self.allowed = self.workers
+        self.outcomes.clear()
+        self.rate_elevated = False
+        logger.info("Health circuit closed. Task queue fully resumed.",
+                    extra={'color': Fore.GREEN})
+
+    def start(self, stop_event):
+        """
+        Запускает поток периодических проверок доступности.
+        """
+        def run():
+            while not stop_event.wait(self.probe_interval):
+                try:
+                    self.check()
+                except Exception as e:
+                    logger.error(f"Error during health check: {e}")
+
+        Thread(target=run, daemon=True).start()
@@ -6,15 +6,28 @@ import argparse
 import os
 import json
 import traceback
-from queue import Queue, Empty
-from threading import Timer, Lock, Thread
+import time
+from queue import Empty
+from threading import Timer, Lock, Thread, Event
 from datetime import datetime, timedelta
 from prettytable import PrettyTable
 from colorama import Fore, Style
 from update_manager import check_and_update, restart_script, ignore_files_in_git
-from telegram_bot_automation import TelegramBotAutomation
+from telegram_bot_automation import TelegramBotAutomation, remaining_quest_clicks
+from browser_manager import BrowserManager, close_browsers, reap_orphaned_browsers, migrate_launched_profiles, CLOSE_TIMEOUT
+from errors import (ProfileBusyError, BudgetExceededError, classify_error,
+                    get_retry_policy, RETRY_IN_SESSION, RELAUNCH, QUARANTINE)
+from pipeline import RunCheckpoint, RunWatchdog, run_account_session, run_quest_session
+from worker_pool import WorkerPool, WorkerSession, DEFAULT_MAX_SESSIONS
+from scheduler import TaskQueue, RunStats, FillRateModel, SlotAllocator, AdmissionController, PRIORITY_SHUTDOWN, PRIORITY_UPDATE, PRIORITY_DUE, PRIORITY_RETRY, PRIORITY_QUARANTINE
+from account_state import account_state
+from health import HealthMonitor
+from tracing import configure_tracing, span
+import metrics
+from control import ControlServer, ControlError, send_command
+from status_view import StatusModel, LiveStatusView, format_balance
 import random
-from utils import get_accounts, reset_balances, setup_logger, load_settings, is_debug_enabled, GlobalFlags, stop_event, get_color, visible, check_requirements
+from utils import get_accounts, reset_balances, setup_logger, load_settings, is_debug_enabled, GlobalFlags, stop_event, get_color, visible, check_requirements, get_int_setting
 import logging
 # Настройка логирования
 logger = logging.getLogger("application_logger")
@@ -29,18 +42,93 @@ check_requirements()
 settings = load_settings()
 
 
+DEFAULT_UPDATE_INTERVAL = 3 * 60 * 60  # 3 часа по умолчанию
+DEFAULT_REAPER_INTERVAL = 10 * 60  # 10 минут по умолчанию
+DEFAULT_PROFILE_BUSY_BACKOFF = 2 * 60  # 2 минуты по умолчанию
+PROFILE_BUSY_WARN_DEFERRALS = 10  # Каждые столько откладываний аккаунта выводится предупреждение
+SCHEDULE_MIN_DELAY = 5  # Минимальная задержка после заполнения прогресса, минут
+DEFAULT_SCHEDULE_WINDOW = 25  # Ширина окна для распределения запуска, минут
+DEFAULT_ADMISSION_INTERVAL = 60  # Интервал допуска новых аккаунтов в очередь, сек
+DEFAULT_HEALTH_PROBE_INTERVAL = 60  # Интервал проверки доступности AdsPower, сек
+DEFAULT_HEALTH_PROBE_FAILURES = 3  # Неудачных проверок подряд для приостановки очереди
+DEFAULT_HEALTH_NAV_ACCOUNTS = 3  # Аккаунтов с ошибками навигации для признания сбоя Telegram
+DEFAULT_HEALTH_NAV_WINDOW = 600  # Окно учёта ошибок навигации, сек
+DEFAULT_QUARANTINE_AFTER = 5  # Количество неудачных обработок подряд до карантина
+DEFAULT_QUARANTINE_BACKOFF_CAP = 12 * 60 * 60  # Максимальная пауза между повторами, сек
+DEFAULT_RUN_TIME_BUDGET = 40 * 60  # Бюджет времени на обработку аккаунта, сек
+DEFAULT_STEP_TIME_BUDGET = 20 * 60  # Бюджет времени на один шаг обработки, сек
+QUEST_YIELD_DELAY = 60  # Пауза перед повторной попыткой квестов, если ждёт фарм, сек
+BUSY_ACCOUNT_RETRY_DELAY = 30  # Пауза перед возвратом в очередь аккаунта, занятого другим воркером, сек
+DEFAULT_STATUS_TABLE_INTERVAL = 60 * 60  # Интервал вывода полной таблицы балансов, сек
+DEFAULT_LOAD_CURVE_INTERVAL = 15 * 60  # Интервал вывода прогноза загрузки слотов, сек
+DEFAULT_KEEP_ALIVE_THRESHOLD = 10 * 60  # Порог, при котором сессия остаётся открытой до следующего сбора, сек
+
 # Глобальные переменные
-bot = None
+active_bots = {}  # Открытые сессии: номер аккаунта -> TelegramBotAutomation
+active_bots_lock = Lock()
+in_flight_accounts = set()  # Аккаунты, которые сейчас обрабатываются
+quest_accounts = set()  # Аккаунты, занятые очередью квестов
+quest_yield_requests = set()  # Аккаунты, квесты которых должны уступить место фарму
 active_timers = []
 balance_dict = {}
+status_model = StatusModel()  # Сортированный индекс аккаунтов и итоговый баланс для вывода
+live_view = None  # Обновляемая таблица в терминале (STATUS_VIEW=live)
 balance_lock = Lock()
 update_lock = Lock()
 task_lock = Lock()
-account_lock = Lock()
-active_profile_lock = Lock()
-task_queue = Queue()
+run_stats = RunStats(account_state)
+# Срок запуска аккаунта, снятого с очереди, не должен давать ложное опоздание
+task_queue = TaskQueue(
+    on_remove=lambda key: run_stats.forget(key.partition("account:")[2]))
+quest_queue = TaskQueue()  # Отдельная очередь для длительных квестов
+fill_model = FillRateModel(account_state)
+max_workers = max(1, get_int_setting(settings, "MAX_WORKERS", 1))
+quest_workers = max(1, get_int_setting(settings, "QUEST_WORKERS", 1))
+schedule_window = get_int_setting(
+    settings, "SCHEDULE_WINDOW", DEFAULT_SCHEDULE_WINDOW)
+admission = AdmissionController(
+    admit=lambda account, due: enqueue_account(
+        account, balance_dict, active_timers, due=due),
+    interval=get_int_setting(settings, "ADMISSION_INTERVAL",
+                             DEFAULT_ADMISSION_INTERVAL),
+    rate=get_int_setting(settings, "ADMISSION_RATE", max_workers * 2),
+    max_rate=max_workers * 10,
+)
+slot_allocator = SlotAllocator(max_workers, run_stats)
+health_monitor = HealthMonitor(
+    max_workers,
+    probe_interval=get_int_setting(
+        settings, "HEALTH_PROBE_INTERVAL", DEFAULT_HEALTH_PROBE_INTERVAL),
+    probe_failures=get_int_setting(
+        settings, "HEALTH_PROBE_FAILURES", DEFAULT_HEALTH_PROBE_FAILURES),
+    nav_accounts=get_int_setting(
+        settings, "HEALTH_NAV_ACCOUNTS", DEFAULT_HEALTH_NAV_ACCOUNTS),
+    nav_window=get_int_setting(
+        settings, "HEALTH_NAV_WINDOW", DEFAULT_HEALTH_NAV_WINDOW),
+)
 has_logged_queue_empty = False
-DEFAULT_UPDATE_INTERVAL = 3 * 60 * 60  # 3 часа по умолчанию
+browser_close_timeout = get_int_setting(
+    settings, "BROWSER_CLOSE_TIMEOUT", CLOSE_TIMEOUT)
+profile_busy_backoff = get_int_setting(
+    settings, "PROFILE_BUSY_BACKOFF", DEFAULT_PROFILE_BUSY_BACKOFF)
+quarantine_after = max(1, get_int_setting(
+    settings, "QUARANTINE_AFTER", DEFAULT_QUARANTINE_AFTER))
+quarantine_backoff_cap = get_int_setting(
+    settings, "QUARANTINE_BACKOFF_CAP", DEFAULT_QUARANTINE_BACKOFF_CAP)
+keep_alive_threshold = get_int_setting(
+    settings, "KEEP_ALIVE_THRESHOLD", DEFAULT_KEEP_ALIVE_THRESHOLD)
+run_time_budget = get_int_setting(
+    settings, "RUN_TIME_BUDGET", DEFAULT_RUN_TIME_BUDGET)
+step_time_budget = get_int_setting(
+    settings, "STEP_TIME_BUDGET", DEFAULT_STEP_TIME_BUDGET)
+# Режим выполнения сессий: thread — в потоке планировщика, process — в процессах пула
+worker_mode = settings.get("WORKER_MODE", "thread").strip().lower()
+worker_pool = None  # Создаётся при запуске, если WORKER_MODE=process
+queue_paused = Event()  # Выдача задач приостановлена через API управления
+draining = Event()  # Завершение работы после обработки текущих аккаунтов
+cancelled_accounts = set()  # Аккаунты, снятые с планирования через API управления
+scheduled_accounts = []  # Аккаунты текущего цикла в том виде, в каком их вернул get_accounts
+control_port = get_int_setting(settings, "CONTROL_PORT", 0)  # 0 — API управления отключено
 temp_dir = "temp"
 TIMERS_FILE = os.path.join(temp_dir, "timers.json")  # Полный путь к файлу
 ROOT_TIMERS_FILE = "timers.json"  # Путь к файлу в корневой директории
@@ -71,7 +159,25 @@ else:
     logger.debug(f"Timers file already exists: {TIMERS_FILE}")
 
 
-def schedule_periodic_update_check(task_queue: Queue, interval: int = DEFAULT_UPDATE_INTERVAL):
+def enqueue_account(account, balance_dict, active_timers, priority=PRIORITY_DUE, due=None):
+    """
+    Добавляет аккаунт в очередь обработки. Если аккаунт уже в очереди,
+    задачи объединяются с сохранением более высокого приоритета.
+    Внутри класса приоритета аккаунты упорядочены по запасу времени:
+    раньше запускается тот, чей срок минус оценка длительности запуска меньше.
+
+    :param due: Время, к которому аккаунт должен быть обработан (по умолчанию сейчас).
+    """
+    with active_bots_lock:
+        if str(account) in cancelled_accounts:
+            logger.debug(f"#{account}: Account is cancelled. Not queuing.")
+            return False
+    order = run_stats.order_key(account, due or datetime.now())
+    return task_queue.put((account, balance_dict, active_timers), priority,
+                          key=f"account:{account}", order=order)
+
+
+def schedule_periodic_update_check(task_queue: TaskQueue, interval: int = DEFAULT_UPDATE_INTERVAL):
     """
     Планирует периодическую проверку обновлений, добавляя задачу в очередь с учётом stop_event.
     """
@@ -84,15 +190,9 @@ def schedule_periodic_update_check(task_queue: Queue, interval: int = DEFAULT_UP
                 break
 
             try:
-                # Проверка на наличие задачи в очереди
-                found = any(
-                    isinstance(task, tuple) and len(
-                        task) >= 1 and task[0] == "check_updates"
-                    for task in list(task_queue.queue)
-                )
-                if not found:
-                    logger.debug("Adding scheduled update check to queue...")
-                    task_queue.put(("check_updates", None))
+                # Задача с тем же ключом повторно не добавляется
+                logger.debug("Adding scheduled update check to queue...")
+                if task_queue.put(("check_updates", None), PRIORITY_UPDATE, key="check_updates"):
                     logger.debug("Successfully added update check to queue.")
                 else:
                     logger.debug(
@@ -106,6 +206,162 @@ def schedule_periodic_update_check(task_queue: Queue, interval: int = DEFAULT_UP
     Thread(target=periodic_task, daemon=True).start()
 
 
+def claim_account(account):
+    """
+    Отмечает аккаунт как обрабатываемый, если его не обрабатывает другой воркер.
+
+    :return: True, если аккаунт занят текущим воркером.
+    """
+    with active_bots_lock:
+        if str(account) in in_flight_accounts:
+            return False
+        in_flight_accounts.add(str(account))
+        return True
+
+
+def release_account(account):
+    """
+    Освобождает аккаунт, занятый claim_account.
+    """
+    with active_bots_lock:
+        in_flight_accounts.discard(str(account))
+
+
+def requeue_busy_account(account, balance_dict, active_timers):
+    """
+    Возвращает в очередь после паузы аккаунт, занятый другим воркером.
+    Если аккаунт занят квестами, они получают сигнал уступить место фарму.
+    """
+    with active_bots_lock:
+        if str(account) in quest_accounts:
+            quest_yield_requests.add(str(account))
+    logger.debug(
+        f"#{account}: Account is busy. Requeued in {BUSY_ACCOUNT_RETRY_DELAY} seconds.")
+
+    def requeue():
+        if timer in active_timers:
+            active_timers.remove(timer)
+        if not stop_event.is_set():
+            enqueue_account(account, balance_dict, active_timers,
+                            due=last_due_time(account))
+
+    timer = Timer(BUSY_ACCOUNT_RETRY_DELAY, requeue)
+    timer.account = str(account)  # Для отмены через API управления
+    active_timers.append(timer)
+    timer.start()
+
+
+def last_due_time(account):
+    """
+    Возвращает последний известный срок запуска аккаунта (для оценки просрочки).
+    Если срок неизвестен, возвращает текущее время.
+    """
+    last_due = account_state.get(account, "next_schedule")
+    if last_due:
+        try:
+            return datetime.strptime(last_due, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            pass
+    return datetime.now()
+
+
+def is_profile_idle(serial_number):
+    """
+    Проверяет, что профиль сейчас не обрабатывается планировщиком.
+    """
+    with active_bots_lock:
+        return str(serial_number) not in in_flight_accounts
+
+
+def schedule_periodic_reaper(interval: int = DEFAULT_REAPER_INTERVAL):
+    """
+    Периодически закрывает браузеры, оставшиеся открытыми после сбоев.
+    """
+    def periodic_task():
+        while not stop_event.wait(interval):
+            try:
+                reap_orphaned_browsers(
+                    claim_account, release_account, timeout=browser_close_timeout)
+            except Exception as e:
+                logger.error(f"Error while reaping orphaned browsers: {e}")
+        logger.debug("Stop event set. Cancelling periodic browser reaping.")
+
+    logger.debug(
+        f"Starting orphaned browser reaper thread with interval {interval} seconds.")
+    Thread(target=periodic_task, daemon=True).start()
+
+
+def schedule_status_report(interval: int = DEFAULT_STATUS_TABLE_INTERVAL):
+    """
+    Периодически выводит полную таблицу балансов, если с прошлого вывода были изменения.
+    После каждого аккаунта в лог пишется только строка сводки.
+    """
+    if not interval:
+        return
+
+    def periodic_task():
+        shown_version = status_model.version
+        while not stop_event.wait(interval):
+            if status_model.version != shown_version:
+                shown_version = status_model.version
+                generate_and_display_table(
+                    balance_dict, table_type="balance", show_total=True)
+
+    Thread(target=periodic_task, daemon=True).start()
+
+
+def start_status_view(mode):
+    """
+    Запускает обновляемую таблицу в терминале, если STATUS_VIEW=live и терминал её поддерживает.
+    """
+    if mode != "live":
+        return None
+    if not LiveStatusView.is_supported():
+        logger.warning(
+            "Live status view requires an ANSI terminal. Using log output.")
+        return None
+    return LiveStatusView(status_model).start(stop_event)
+
+
+def start_metrics(port):
+    """
+    Подключает показатели планировщика к метрикам и запускает HTTP-сервер метрик
+    (METRICS_PORT, 0 — отключено).
+    """
+    if not port:
+        return None
+    metrics.queue_depth.set_function(task_queue.qsize, queue="farm")
+    metrics.queue_depth.set_function(quest_queue.qsize, queue="quests")
+    metrics.queue_depth.set_function(admission.backlog_size, queue="admission")
+    metrics.active_workers.set_function(lambda: len(in_flight_accounts))
+    group_minutes = slot_allocator.slot_seconds * 3 // 60  # Группа load_forecast — 3 слота
+    groups = len(slot_allocator.load_forecast()[0])
+    for group in range(groups):
+        metrics.projected_load.set_function(
+            lambda group=group: slot_allocator.load_forecast()[0][group],
+            offset_minutes=group * group_minutes)
+    return metrics.start_metrics_server(port)
+
+
+def schedule_load_curve_report(interval: int = DEFAULT_LOAD_CURVE_INTERVAL):
+    """
+    Периодически выводит прогноз загрузки слотов, если с прошлого вывода
+    распределитель запланировал новые запуски.
+    """
+    if not interval:
+        return
+
+    def periodic_task():
+        shown_curve = None
+        while not stop_event.wait(interval):
+            curve = slot_allocator.load_curve()
+            if curve != shown_curve:
+                shown_curve = curve
+                logger.info(curve)
+
+    Thread(target=periodic_task, daemon=True).start()
+
+
 def load_timers():
     """
     Загружает таймеры из JSON-файла, фильтрует устаревшие и возвращает актуальные данные.
@@ -188,230 +444,360 @@ def save_timers(timers):
 def process_account(account, balance_dict, active_timers):
     """
     Обрабатывает указанный аккаунт, выполняя задания и обновляя данные балансов.
-    Если другой аккаунт уже обрабатывается, ждёт его завершения.
+    Если этот же аккаунт уже обрабатывается другим воркером, возвращает его в очередь.
     """
 
     logger.info(f"Processing account: {account}", extra={'color': Fore.CYAN})
-    retry_count = 0
+    attempt = 0
+    checkpoint = RunCheckpoint(account)
     success = False
-    message_logged = False
-    global bot
+    deferred = False
+    quests_pending = False
+    bot = None
+    watchdog = None
+
+    # Пытаемся занять профиль
+    if not claim_account(account):
+        # Аккаунт занят другим воркером (квестами или удерживаемой сессией):
+        # не держим воркер в ожидании, а возвращаем задачу в очередь после паузы
+        requeue_busy_account(account, balance_dict, active_timers)
+        return
 
-    while not stop_event.is_set():
-        # Пытаемся захватить блокировку
-        if active_profile_lock.acquire(blocking=False):
+    try:
+        logger.debug(
+            f"#{account}: Starting processing for account: {account}")
+        run_started = time.monotonic()
+        slot_allocator.release(account)
+        lateness = run_stats.record_start(account)
+        metrics.schedule_lateness_seconds.observe(lateness)
+        if lateness:
+            logger.debug(
+                f"#{account}: Started {lateness:.0f}s after schedule.")
+        watchdog = RunWatchdog(
+            checkpoint, run_time_budget, step_time_budget,
+            on_expire=lambda: force_stop_profile(account)).start()
+        while not success and not stop_event.is_set():
             try:
-                logger.debug(
-                    f"#{account}: Starting processing for account: {account}")
-                with account_lock:
-                    while retry_count < 3 and not success and not stop_event.is_set():
-                        try:
-                            if stop_event.is_set():
-                                logger.debug(
-                                    f"#{account}: Stop event detected. Exiting.")
-                                return
-
-                            # Инициализация объекта TelegramBotAutomation
-                            bot = TelegramBotAutomation(account, settings)
-
-                            # Выполнение действий
-                            navigate_and_perform_actions(bot, account)
-
-                            # Получение данных аккаунта
-                            username = bot.get_username()
-                            if not username or username == "N/A":
-                                raise ValueError(
-                                    f"#{account}: Invalid username")
-
-                            balance = parse_balance(bot.get_balance())
-                            if balance <= 0:
-                                raise ValueError(
-                                    f"#{account}: Invalid balance")
-
-                            next_schedule = calculate_next_schedule(
-                                bot.get_time())
+                # Браузер перезапускается только если предыдущая сессия закрыта
+                if bot is None:
+                    bot = open_session(account)
+                    with active_bots_lock:
+                        active_bots[account] = bot
+
+                # Выполнение действий (с первого невыполненного шага) и получение данных
+                username, balance, progress_before, progress = run_session(
+                    bot, account, checkpoint)
+                # Оставшееся время по измеренной скорости заполнения аккаунта
+                fill_model.record(account, progress_before)
+                fill_model.record(account, progress)
+                next_schedule = calculate_next_schedule(
+                    fill_model.remaining(account, progress[1] if progress else None), account)
+
+                # Обновление баланса
+                update_balance_info(
+                    account, username, balance, next_schedule, "Success", balance_dict
+                )
+                success = True
+                metrics.runs_total.inc(outcome="success")
+                health_monitor.record_outcome(True)
+                reset_failure_streak(account)
+                # Квесты ставятся в очередь после освобождения аккаунта:
+                # пока сессия удерживается, очередь квестов не смогла бы его занять
+                quests_pending = enable_quests
+                logger.info(
+                    f"#{account}: Next schedule: {next_schedule.strftime('%Y-%m-%d %H:%M:%S')}"
+                )
 
-                            # Обновление баланса
-                            update_balance_info(
-                                account, username, balance, next_schedule, "Success", balance_dict
-                            )
-                            success = True
-                            logger.info(
-                                f"#{account}: Next schedule: {next_schedule.strftime('%Y-%m-%d %H:%M:%S')}"
-                            )
+                # Следующий сбор скоро: выполняем его в открытой сессии
+                if keep_session_alive(account, bot, next_schedule, watchdog):
+                    run_stats.record_run(
+                        account, time.monotonic() - run_started)
+                    run_started = time.monotonic()
+                    checkpoint.next_cycle()
+                    success = False
+                    attempt = 0
+                    continue
 
-                            # Установка таймера
-                            if next_schedule:
-                                schedule_next_run(
-                                    account, next_schedule, balance_dict, active_timers
-                                )
+                # Установка таймера
+                if next_schedule:
+                    schedule_next_run(
+                        account, next_schedule, balance_dict, active_timers
+                    )
 
-                        except Exception as e:
-                            retry_count += 1
-                            logger.debug(
-                                f"#{account}: Error on attempt {retry_count}: {e}"
-                            )
-                            update_balance_info(
-                                account, "N/A", 0.0, datetime.now(), "ERROR", balance_dict
-                            )
-                            if retry_count >= 3:
-                                retry_delay = random.randint(
-                                    1800, 4200)  # 30–70 минут
-                                next_retry_time = datetime.now() + timedelta(seconds=retry_delay)
-                                schedule_retry(
-                                    account, next_retry_time, balance_dict, active_timers, retry_delay
-                                )
+            except ProfileBusyError:
+                # Профиль занят: не держим воркер, откладываем аккаунт
+                defer_account(account, balance_dict, active_timers)
+                deferred = True
+                break
 
-                        finally:
-                            if not stop_event.is_set():
-                                if bot:
-                                    try:
-                                        bot.browser_manager.close_browser()
-                                    except Exception:
-                                        logger.debug(
-                                            f"#{account}: Failed to close browser.")
+            except Exception as e:
+                if stop_event.is_set():
+                    break
+                # Ошибка зависшего вызова после остановки профиля сторожем
+                error = BudgetExceededError(checkpoint.expired) if checkpoint.expired \
+                    else classify_error(e)
+                policy = get_retry_policy(error)
+                attempt += 1
+                logger.info(
+                    f"#{account}: {type(error).__name__} on attempt {attempt}/{policy.max_attempts}: "
+                    f"{str(e).splitlines()[0] if str(e) else ''}"
+                )
+                update_balance_info(
+                    account, "N/A", 0.0, datetime.now(), "ERROR", balance_dict
+                )
+                metrics.errors_total.inc(
+                    error_class=type(error).__name__)
+                health_monitor.record_outcome(False, error, account)
 
-                if success:
-                    generate_and_display_table(
-                        balance_dict, table_type="balance", show_total=True)
+                if health_monitor.is_open():
+                    # Сбой AdsPower или Telegram: не тратим попытки и не сдвигаем
+                    # расписание, аккаунт ждёт восстановления в очереди
+                    logger.info(
+                        f"#{account}: Dependencies unavailable. Holding account until recovery.")
+                    enqueue_account(account, balance_dict, active_timers,
+                                    due=last_due_time(account))
+                    break
+
+                if attempt < policy.max_attempts and policy.action in (RETRY_IN_SESSION, RELAUNCH):
+                    if policy.action == RELAUNCH:
+                        close_account_session(account, bot)
+                        checkpoint.reset_session()
+                        bot = None
+                    continue
 
-            finally:
-                active_profile_lock.release()
-                logger.debug(f"#{account}: Completed processing for account.")
-            break  # Выходим из цикла ожидания
+                # Попытки исчерпаны: освобождаем воркер и планируем повтор
+                metrics.runs_total.inc(outcome="failed")
+                retry_delay, quarantined = register_failure(
+                    account, policy)
+                next_retry_time = datetime.now() + timedelta(seconds=retry_delay)
+                schedule_retry(
+                    account, next_retry_time, balance_dict, active_timers, retry_delay,
+                    status="QUARANTINED" if quarantined else "ERROR"
+                )
+                break
 
-        else:
-            if not message_logged:
-                logger.debug(f"#{account}: Waiting for active profile lock.")
-                message_logged = True
-            # Используем `wait` вместо `time.sleep` для быстрого выхода
-            stop_event.wait(1)
+        # При остановке браузер закрывает cleanup_resources
+        if not stop_event.is_set():
+            close_account_session(account, bot)
 
-        if stop_event.is_set():
-            logger.debug(
-                f"#{account}: Stop event detected in outer loop. Exiting.")
-            return
+        if not deferred and not stop_event.is_set():
+            admission.record_outcome(success)
+        if success:
+            run_stats.record_run(
+                account, time.monotonic() - run_started)
+            logger.info(status_model.summary())
 
+    finally:
+        if watchdog:
+            watchdog.stop()
+        with active_bots_lock:
+            in_flight_accounts.discard(str(account))
+        logger.debug(f"#{account}: Completed processing for account.")
 
-# Навигация и выполнение действий с ботом
+    if quests_pending and not stop_event.is_set():
+        enqueue_quests(account)
 
 
-def navigate_and_perform_actions(bot, account):
+def open_session(account):
     """
-    Навигация и выполнение всех задач с ботом.
+    Открывает сессию аккаунта: запускает браузер в текущем процессе
+    или выделяет процесс из пула (браузер запускается в нём при первом запуске).
     """
-    if stop_event.is_set():
-        logger.info("Stop event detected. Aborting navigation and actions.")
-        return
+    if worker_pool:
+        return worker_pool.acquire(account)
+    bot = TelegramBotAutomation(account, settings)
+    if bot.browser_manager.launch_latency is not None:
+        record_launch_latency(bot.browser_manager.launch_latency)
+    return bot
 
-    if not bot.navigate_to_bot():
-        raise Exception("Failed to navigate to bot")
 
-    if stop_event.is_set():
-        logger.debug("Stop event detected. Aborting after navigation.")
-        return
-
-    if not bot.send_message():
-        raise Exception("Failed to send message")
-
-    if stop_event.is_set():
-        logger.debug("Stop event detected. Aborting after sending message.")
-        return
-
-    if not bot.click_link():
-        raise Exception("Failed to start app")
+def record_launch_latency(seconds):
+    """
+    Учитывает время запуска профиля в допуске аккаунтов и в метриках.
+    """
+    admission.record_launch_latency(seconds)
+    metrics.browser_launch_seconds.observe(seconds)
 
-    if stop_event.is_set():
-        logger.debug("Stop event detected. Aborting after starting app.")
-        return
 
-    logger.debug("Preparing account...")
-    bot.preparing_account()
+def run_session(bot, account, checkpoint):
+    """
+    Выполняет запуск аккаунта в открытой сессии.
 
-    if stop_event.is_set():
-        logger.debug("Stop event detected. Aborting before run to Home tab.")
-        return
+    :return: Кортеж (имя пользователя, баланс, замер прогресса до сбора, замер прогресса в конце).
+    """
+    with span("run", account, mode=worker_mode):
+        if isinstance(bot, WorkerSession):
+            return bot.run(checkpoint)
+        return run_account_session(bot, account, checkpoint)
 
-    if stop_event.is_set():
-        logger.debug("Stop event detected. Aborting before farming.")
-        return
 
-    logger.info("Starting farming...")
-    bot.farming()
-    if stop_event.is_set():
-        logger.debug("Stop event detected. Aborting before performing quests.")
-        return
-    bot.create_stars()
+def worker_slot_available():
+    """
+    Проверяет, хватает ли воркеров для остальных аккаунтов, если один удерживает сессию.
+    """
+    with active_bots_lock:
+        busy = len(in_flight_accounts)
+    return task_queue.empty() or busy < max_workers
 
-    logger.debug("Performing quests...")
-    if enable_quests:
-        logger.info(f"#{account}: Launching quests...")
-        bot.create_quests()
-        logger.info(f"#{account}: The quests are completed.")
 
+def keep_session_alive(account, bot, next_schedule, watchdog):
+    """
+    Удерживает сессию открытой до следующего сбора, если он наступит в пределах
+    KEEP_ALIVE_THRESHOLD и удержание не мешает другим аккаунтам.
+    Это экономит запуск браузера и навигацию по Telegram Web.
 
-# Парсинг баланса
+    :return: True, если срок наступил и сбор нужно выполнить в открытой сессии;
+             False, если сессию нужно закрыть и запланировать запуск как обычно.
+    """
+    if not keep_alive_threshold or not bot or not next_schedule:
+        return False
+    if draining.is_set() or str(account) in cancelled_accounts:
+        return False
+    if (next_schedule - datetime.now()).total_seconds() > keep_alive_threshold:
+        return False
+    if not worker_slot_available():
+        return False
+
+    logger.info(
+        f"#{account}: Next collection at {next_schedule.strftime('%H:%M:%S')}. Keeping session alive.")
+    update_balance_info(
+        account, balance_dict.get(account, {}).get("username", "N/A"),
+        balance_dict.get(account, {}).get("balance", 0.0), next_schedule, "Kept alive", balance_dict)
+    watchdog.restart()
+    while datetime.now() < next_schedule:
+        if stop_event.wait(1):
+            return False
+        # Удержание сессии не должно задерживать другие аккаунты
+        if not worker_slot_available():
+            logger.info(
+                f"#{account}: Other accounts are waiting. Closing kept-alive session.")
+            return False
+        watchdog.restart()
+    return True
+
+
+def force_stop_profile(account):
+    """
+    Принудительно останавливает профиль аккаунта через API AdsPower.
+    Используется сторожем, когда блокирующий вызов WebDriver превысил бюджет времени.
+    Процесс воркера при этом завершается.
+    """
+    with active_bots_lock:
+        bot = active_bots.get(account)
+    if isinstance(bot, WorkerSession):
+        bot.kill()
+    manager = bot.browser_manager if bot else BrowserManager(account)
+    manager.stop_browser_via_api()
 
 
-def parse_balance(balance):
+def close_account_session(account, bot):
     """
-    Парсинг баланса из строки в число.
-
-    :param balance: Строка с балансом.
-    :return: Баланс в формате float или 0.0 при ошибке.
+    Закрывает браузер аккаунта и удаляет сессию из реестра открытых сессий.
     """
+    if not bot:
+        return
     try:
-        if balance is None:
-            if is_debug_enabled():
-                logger.debug(
-                    f"#{account}: Received None for balance. Returning 0.0.")
-            return 0.0
+        if isinstance(bot, WorkerSession):
+            bot.close(timeout=browser_close_timeout)
+        else:
+            bot.browser_manager.close_browser(timeout=browser_close_timeout)
+    except Exception:
+        logger.debug(f"#{account}: Failed to close browser.")
+    with active_bots_lock:
+        active_bots.pop(account, None)
 
-        if isinstance(balance, (int, float)):
-            if is_debug_enabled():
-                logger.debug(
-                    f"#{account}: Balance is already numeric: {balance}")
-            return float(balance)
 
-        if isinstance(balance, str) and balance.replace('.', '', 1).isdigit():
-            parsed_balance = float(balance)
-            if is_debug_enabled():
-                logger.debug(
-                    f"#{account}: Parsed balance successfully: {parsed_balance}")
-            return parsed_balance
+def defer_account(account, balance_dict, active_timers):
+    """
+    Откладывает обработку аккаунта, профиль которого открыт вне скрипта,
+    и возвращает его в очередь после короткой паузы.
+    """
+    delay = random.randint(profile_busy_backoff, profile_busy_backoff * 2)
+    next_run = datetime.now() + timedelta(seconds=delay)
+
+    with balance_lock:
+        account_data = balance_dict.setdefault(
+            account, {"username": "N/A", "balance": 0.0})
+        account_data["deferrals"] = account_data.get("deferrals", 0) + 1
+        account_data["next_schedule"] = next_run.strftime("%Y-%m-%d %H:%M:%S")
+        account_data["status"] = "Deferred"
+        deferrals = account_data["deferrals"]
+        status_model.update(account, account_data)
+
+    logger.info(
+        f"#{account}: Profile is busy. Deferred for {delay} seconds (deferrals: {deferrals}).")
+    if deferrals % PROFILE_BUSY_WARN_DEFERRALS == 0:
+        logger.warning(
+            f"#{account}: Profile was busy {deferrals} times. "
+            f"If it is not open by hand, close it in AdsPower.")
+    schedule_next_run(account, next_run, balance_dict,
+                      active_timers, status="Deferred")
+
+
+def register_failure(account, policy):
+    """
+    Учитывает неудачную обработку аккаунта и рассчитывает паузу до повтора.
+    Пауза растёт экспоненциально с каждой неудачей подряд (до QUARANTINE_BACKOFF_CAP),
+    после QUARANTINE_AFTER неудач подряд аккаунт помещается в карантин.
 
-        if is_debug_enabled():
-            logger.debug(
-                f"#{account}: Invalid balance format: {balance}. Returning 0.0.")
-        return 0.0
-    except Exception as e:
-        logger.error(f"#{account}: Error parsing balance: {e}")
-        if is_debug_enabled():
-            logger.debug(
-                f"#{account}: Error traceback:", exc_info=True)
-        return 0.0
+    :return: Кортеж (пауза в секундах, находится ли аккаунт в карантине).
+    """
+    streak = account_state.get(account, "failure_streak", 0) + 1
+    account_state.update(account, failure_streak=streak)
+    quarantined = policy.action == QUARANTINE or streak >= quarantine_after
+    if streak >= quarantine_after:
+        retry_delay = quarantine_backoff_cap
+    else:
+        retry_delay = policy.backoff_delay(streak, cap=quarantine_backoff_cap)
+
+    if quarantined:
+        logger.warning(
+            f"#{account}: Account quarantined after {streak} failed run(s) in a row. "
+            f"Next attempt in {retry_delay // 60} minutes.")
+    else:
+        logger.info(
+            f"#{account}: Failed runs in a row: {streak}. Next attempt in {retry_delay // 60} minutes.")
+    return retry_delay, quarantined
+
+
+def reset_failure_streak(account):
+    """
+    Сбрасывает счётчик неудач после успешной обработки аккаунта.
+    """
+    streak = account_state.get(account, "failure_streak", 0)
+    if streak:
+        account_state.update(account, failure_streak=0)
+        logger.info(
+            f"#{account}: Account recovered after {streak} failed run(s) in a row.")
 
 
 # Расчет следующего выполнения
-def calculate_next_schedule(schedule_time):
+def calculate_next_schedule(remaining_seconds, account):
     """
-    Расчёт времени следующего выполнения.
+    Расчёт времени следующего выполнения. Время выбирается распределителем слотов
+    в окне фарма, чтобы запуски аккаунтов не скапливались в одно время.
 
-    :param schedule_time: Время в формате "HH:MM:SS" или None.
+    :param remaining_seconds: Время до заполнения прогресса в секундах или None.
+    :param account: Аккаунт, для которого рассчитывается время.
     :return: Объект datetime с рассчитанным временем.
     """
     try:
-        if schedule_time and ":" in schedule_time:
-            hours, minutes, seconds = map(int, schedule_time.split(":"))
-            next_schedule = datetime.now() + timedelta(hours=hours, minutes=minutes,
-                                                       seconds=seconds) + timedelta(minutes=random.randint(5, 30))
+        if remaining_seconds is not None:
+            earliest = datetime.now() + timedelta(seconds=remaining_seconds) + \
+                timedelta(minutes=SCHEDULE_MIN_DELAY)
+            next_schedule = slot_allocator.allocate(
+                account, earliest, earliest + timedelta(minutes=schedule_window))
+            logger.debug(slot_allocator.load_curve())
             if is_debug_enabled():
                 logger.debug(
-                    f"#{account}: Next schedule calculated from provided time '{schedule_time}': {next_schedule.strftime('%Y-%m-%d %H:%M:%S')}")
+                    f"#{account}: Next schedule calculated from remaining time {remaining_seconds:.0f}s "
+                    f"(fill time {fill_model.fill_time(account)}s): {next_schedule.strftime('%Y-%m-%d %H:%M:%S')}")
             return next_schedule
 
-        # Если schedule_time недоступно или некорректно
-        default_schedule = datetime.now() + timedelta(hours=8)
+        # Если время до заполнения неизвестно
+        earliest = datetime.now() + timedelta(hours=8)
+        default_schedule = slot_allocator.allocate(
+            account, earliest, earliest + timedelta(minutes=schedule_window))
         if is_debug_enabled():
             logger.debug(
                 f"#{account}: Default schedule time applied: {default_schedule.strftime('%Y-%m-%d %H:%M:%S')}")
@@ -419,7 +805,7 @@ def calculate_next_schedule(schedule_time):
 
     except Exception as e:
         logger.error(
-            f"#{account}: Error calculating next schedule from time '{schedule_time}': {e}")
+            f"#{account}: Error calculating next schedule from remaining time '{remaining_seconds}': {e}")
         if is_debug_enabled():
             logger.debug(
                 f"#{account}: Error traceback:", exc_info=True)
@@ -451,8 +837,12 @@ def update_balance_info(account, username, balance, next_schedule, status, balan
                 "balance": balance,
                 "next_schedule": next_schedule.strftime("%Y-%m-%d %H:%M:%S"),
                 "status": status,
+                "deferrals": balance_dict.get(account, {}).get("deferrals", 0),
+                "failure_streak": account_state.get(account, "failure_streak", 0),
             }
 
+            status_model.update(account, balance_dict[account])
+
             # Загрузка и обновление таймеров
             timers_data = load_timers()
             # Синхронизация данных
@@ -473,7 +863,7 @@ def update_balance_info(account, username, balance, next_schedule, status, balan
 
 
 # Планирование следующего запуска
-def schedule_next_run(account, next_schedule, balance_dict, active_timers):
+def schedule_next_run(account, next_schedule, balance_dict, active_timers, status="Active"):
     """
     Планирует следующий запуск для указанного аккаунта.
 
@@ -481,6 +871,7 @@ def schedule_next_run(account, next_schedule, balance_dict, active_timers):
     :param next_schedule: Время следующего запуска.
     :param balance_dict: Словарь с балансами аккаунтов.
     :param active_timers: Список активных таймеров.
+    :param status: Статус таймера, сохраняемый в файл таймеров.
     """
     try:
         delay = (next_schedule - datetime.now()).total_seconds()
@@ -501,10 +892,16 @@ def schedule_next_run(account, next_schedule, balance_dict, active_timers):
                 timers_data[account] = {
                     "username": username,
                     "next_schedule": next_schedule.strftime("%Y-%m-%d %H:%M:%S"),
-                    "status": "Active",
+                    "status": status,
                     "balance": balance,
+                    "deferrals": account_data.get("deferrals", 0),
+                    "failure_streak": account_state.get(account, "failure_streak", 0),
                 }
                 save_timers(timers_data)
+            slot_allocator.reserve(account, next_schedule)
+            # Последний срок сохраняется для оценки просрочки после перезапуска
+            account_state.update(
+                account, next_schedule=next_schedule.strftime("%Y-%m-%d %H:%M:%S"))
 
             def run_after_delay():
                 """
@@ -523,10 +920,13 @@ def schedule_next_run(account, next_schedule, balance_dict, active_timers):
                 # Добавляем задачу в очередь обработки
                 logger.debug(
                     f"#{account}: Adding account to task queue after delay.")
-                task_queue.put((account, balance_dict, active_timers))
+                enqueue_account(account, balance_dict, active_timers,
+                                priority=PRIORITY_QUARANTINE if status == "QUARANTINED" else PRIORITY_DUE,
+                                due=next_schedule)
 
             # Создаём таймер и запускаем его
             timer = Timer(delay, run_after_delay)
+            timer.account = str(account)  # Для отмены через API управления
             active_timers.append(timer)
             timer.start()
 
@@ -549,6 +949,114 @@ def schedule_next_run(account, next_schedule, balance_dict, active_timers):
             )
 
 
+def enqueue_quests(account):
+    """
+    Добавляет квесты аккаунта в очередь квестов (после фарма и создания звёзд).
+    Если дневной лимит кликов исчерпан или аккаунт снят с планирования, квесты не ставятся в очередь.
+    """
+    with active_bots_lock:
+        if str(account) in cancelled_accounts:
+            logger.debug(f"#{account}: Account is cancelled. Quests not queued.")
+            return False
+    if remaining_quest_clicks(account) <= 0:
+        logger.debug(f"#{account}: Daily quest limit reached. Quests not queued.")
+        return False
+    return quest_queue.put(("quests", account), key=f"quests:{account}", order=time.time())
+
+
+def farming_pending(account=None):
+    """
+    Проверяет, должны ли квесты уступить место фарму: в очереди фарма есть
+    ожидающие задачи или фарм ждёт аккаунт, занятый квестами.
+    """
+    if account is not None:
+        with active_bots_lock:
+            if str(account) in quest_yield_requests:
+                return True
+    return not task_queue.empty()
+
+
+def process_quests(account):
+    """
+    Выполняет квесты аккаунта в отдельной сессии браузера.
+    Квесты не срочные: при ошибке они не повторяются, а ставятся в очередь
+    снова после следующего успешного фарма.
+
+    :return: False, если квесты нужно продолжить позже.
+    """
+    if not claim_account(account):
+        # Аккаунт обрабатывается фармом: квесты продолжатся позже
+        return False
+    with active_bots_lock:
+        quest_accounts.add(str(account))
+        quest_yield_requests.discard(str(account))
+
+    checkpoint = RunCheckpoint(account)
+    bot = None
+    watchdog = None
+    try:
+        # Лимит мог быть исчерпан, пока квесты ждали в очереди
+        if remaining_quest_clicks(account) <= 0:
+            logger.debug(
+                f"#{account}: Daily quest limit reached. Skipping quests.")
+            return True
+        watchdog = RunWatchdog(
+            checkpoint, run_time_budget, step_time_budget,
+            on_expire=lambda: force_stop_profile(account)).start()
+        bot = open_session(account)
+        with active_bots_lock:
+            active_bots[account] = bot
+        if isinstance(bot, WorkerSession):
+            return bot.run_quests(checkpoint, should_yield=lambda: farming_pending(account))
+        return run_quest_session(bot, account, checkpoint,
+                                 should_yield=lambda: farming_pending(account))
+    except ProfileBusyError:
+        logger.info(f"#{account}: Profile is busy. Quests postponed.")
+        return False
+    except Exception as e:
+        logger.error(f"#{account}: Error while performing quests: {e}")
+        return True
+    finally:
+        if watchdog:
+            watchdog.stop()
+        if not stop_event.is_set():
+            close_account_session(account, bot)
+        with active_bots_lock:
+            quest_accounts.discard(str(account))
+            quest_yield_requests.discard(str(account))
+            in_flight_accounts.discard(str(account))
+
+
+def quest_queue_processor():
+    """
+    Обработчик очереди квестов (QUEST_WORKERS потоков).
+    Квесты запускаются, только когда в очереди фарма нет ожидающих задач,
+    и прерываются, если такие задачи появились.
+    """
+    logger.debug("Quest queue processor started.")
+    while not stop_event.is_set():
+        if queue_paused.is_set() or draining.is_set():
+            stop_event.wait(1)
+            continue
+        try:
+            task = quest_queue.get(timeout=1)
+        except Empty:
+            continue
+        try:
+            if task is None:  # Сигнал завершения
+                break
+            _, account = task
+            if health_monitor.is_open() or farming_pending() or not process_quests(account):
+                # Квесты уступают место фарму и будут продолжены позже
+                if not stop_event.wait(QUEST_YIELD_DELAY):
+                    enqueue_quests(account)
+        except Exception as e:
+            logger.debug(f"Unhandled exception in quest processor: {e}")
+        finally:
+            quest_queue.task_done()
+    logger.debug("Quest queue processor stopped.")
+
+
 def task_queue_processor(task_queue, active_timers):
     global has_logged_queue_empty
     """
@@ -556,6 +1064,15 @@ def task_queue_processor(task_queue, active_timers):
     """
     logger.debug("Task queue processor started.")
     while not stop_event.is_set():
+        # Пауза или завершение по команде API управления: новые задачи не выдаются
+        if queue_paused.is_set() or draining.is_set():
+            stop_event.wait(1)
+            continue
+        # При сбое зависимостей очередь удерживается, после восстановления
+        # задачи выдаются постепенно
+        if not health_monitor.try_acquire():
+            stop_event.wait(1)
+            continue
         try:
             # Получаем задачу из очереди с таймаутом
             try:
@@ -618,11 +1135,14 @@ def task_queue_processor(task_queue, active_timers):
         except Exception as e:
             logger.debug(f"Unhandled exception in task processor: {e}")
 
+        finally:
+            health_monitor.release()
+
     logger.debug("Task queue processor stopped.")
 
 
 # Планирование повторной попытки
-def schedule_retry(account, next_retry_time, balance_dict, active_timers, retry_delay):
+def schedule_retry(account, next_retry_time, balance_dict, active_timers, retry_delay, status="ERROR"):
     """
     Планирование повторной попытки выполнения.
 
@@ -631,6 +1151,7 @@ def schedule_retry(account, next_retry_time, balance_dict, active_timers, retry_
     :param balance_dict: Словарь с балансами аккаунтов.
     :param active_timers: Список активных таймеров.
     :param retry_delay: Задержка перед повторной попыткой (в секундах).
+    :param status: Статус аккаунта до повторной попытки.
     """
     try:
         # Проверяем stop_event перед планированием задачи
@@ -641,12 +1162,12 @@ def schedule_retry(account, next_retry_time, balance_dict, active_timers, retry_
 
         # Обновляем информацию о следующем запуске
         update_balance_info(
-            account, "N/A", 0.0, next_retry_time, "ERROR", balance_dict
+            account, "N/A", 0.0, next_retry_time, status, balance_dict
         )
 
         def retry_task():
             """
-            Запускает повторную попытку process_account после задержки.
+            Возвращает аккаунт в общую очередь после задержки.
             """
             try:
                 if stop_event.is_set():
@@ -655,18 +1176,23 @@ def schedule_retry(account, next_retry_time, balance_dict, active_timers, retry_
                     return  # Прерываем выполнение задачи
 
                 logger.debug(
-                    f"#{account}: Retrying process_account after delay.")
-                process_account(account, balance_dict, active_timers)
+                    f"#{account}: Adding account to task queue for retry.")
+                # Аккаунты в карантине обрабатываются после остальных
+                enqueue_account(account, balance_dict, active_timers,
+                                priority=PRIORITY_QUARANTINE if status == "QUARANTINED" else PRIORITY_RETRY,
+                                due=next_retry_time)
             except Exception as retry_error:
                 logger.debug(
-                    f"#{account}: Exception during retry execution: {retry_error}", exc_info=True
+                    f"#{account}: Exception during retry scheduling: {retry_error}", exc_info=True
                 )
             finally:
                 # Удаляем таймер из active_timers после завершения
-                active_timers.remove(timer)
+                if timer in active_timers:
+                    active_timers.remove(timer)
 
         # Создаём таймер и добавляем в список активных таймеров
         timer = Timer(retry_delay, retry_task)
+        timer.account = str(account)  # Для отмены через API управления
         active_timers.append(timer)
         timer.start()
 
@@ -681,75 +1207,244 @@ def schedule_retry(account, next_retry_time, balance_dict, active_timers, retry_
         )
 
 
+def cancel_account_timers(account):
+    """
+    Отменяет таймеры запуска и повтора аккаунта и удаляет его из файла таймеров.
+
+    :return: Количество отменённых таймеров.
+    """
+    cancelled = 0
+    for timer in list(active_timers):
+        if getattr(timer, "account", None) == str(account) and timer.is_alive():
+            timer.cancel()
+            cancelled += 1
+            if timer in active_timers:
+                active_timers.remove(timer)
+    with balance_lock:
+        timers_data = load_timers()
+        if timers_data.pop(str(account), None) is not None:
+            save_timers(timers_data)
+    return cancelled
+
+
+def normalize_account(account, accounts=None):
+    """
+    Приводит номер аккаунта к виду, в котором его вернул get_accounts.
+    Номера из ACCOUNTS — числа, из accounts.txt и профилей AdsPower — строки;
+    без приведения один аккаунт попал бы в balance_dict и файл таймеров под двумя ключами.
+
+    :param accounts: Известные аккаунты (по умолчанию аккаунты текущего цикла).
+    """
+    for known in scheduled_accounts if accounts is None else accounts:
+        if str(known) == str(account):
+            return known
+    return account
+
+
+def control_enqueue(account):
+    """
+    Команда API управления: поставить аккаунт в очередь немедленно.
+    Запланированный запуск аккаунта отменяется, чтобы он не выполнился повторно.
+    """
+    if draining.is_set():
+        raise ControlError("Scheduler is draining. New accounts are not accepted.", 409)
+    account = normalize_account(account)
+    with active_bots_lock:
+        cancelled_accounts.discard(str(account))
+        running = str(account) in in_flight_accounts
+    cancel_account_timers(account)
+    admission.withdraw(account)
+    queued = enqueue_account(account, balance_dict,
+                             active_timers, due=datetime.now())
+    logger.info(f"#{account}: Queued by control API.",
+                extra={'color': Fore.CYAN})
+    return {"account": account, "queued": queued, "in_flight": running}
+
+
+def control_cancel(account):
+    """
+    Команда API управления: снять аккаунт с планирования.
+    Текущая обработка аккаунта завершается, но новые запуски не планируются
+    до команды enqueue или перезапуска скрипта.
+    """
+    account = normalize_account(account)
+    with active_bots_lock:
+        cancelled_accounts.add(str(account))
+        running = str(account) in in_flight_accounts
+    result = {
+        "account": account,
+        "removed_from_queue": task_queue.remove(f"account:{account}"),
+        "removed_quests": quest_queue.remove(f"quests:{account}"),
+        "removed_from_admission": admission.withdraw(account),
+        "timers_cancelled": cancel_account_timers(account),
+        "in_flight": running,
+    }
+    logger.info(f"#{account}: Cancelled by control API.",
+                extra={'color': Fore.YELLOW})
+    return result
+
+
+def control_pause():
+    """
+    Команда API управления: приостановить выдачу задач. Текущие аккаунты дорабатываются.
+    """
+    queue_paused.set()
+    logger.info("Queue paused by control API.", extra={'color': Fore.YELLOW})
+    return control_state()
+
+
+def control_resume():
+    queue_paused.clear()
+    logger.info("Queue resumed by control API.", extra={'color': Fore.CYAN})
+    return control_state()
+
+
+def control_drain():
+    """
+    Команда API управления: дождаться завершения текущих аккаунтов,
+    не принимая новых, и завершить работу.
+    """
+    if not draining.is_set():
+        draining.set()
+        logger.info("Draining: finishing in-flight accounts, then exiting.",
+                    extra={'color': Fore.YELLOW})
+
+        def wait_for_drain():
+            while not stop_event.wait(1):
+                with active_bots_lock:
+                    if not in_flight_accounts:
+                        break
+            if not stop_event.is_set():
+                logger.info("Drain complete. Stopping.",
+                            extra={'color': Fore.MAGENTA})
+                stop_event.set()
+
+        Thread(target=wait_for_drain, daemon=True).start()
+    return control_state()
+
+
+def control_state():
+    """
+    Команда API управления: состояние планировщика.
+    """
+    with active_bots_lock:
+        running = sorted(in_flight_accounts)
+        cancelled = sorted(cancelled_accounts)
+    with balance_lock:
+        timers_data = load_timers()
+    return {
+        "paused": queue_paused.is_set(),
+        "draining": draining.is_set(),
+        "health": health_monitor.state,
+        "workers": max_workers,
+        "in_flight": running,
+        "queue": task_queue.keys(),
+        "quest_queue": quest_queue.keys(),
+        "admission_backlog": admission.backlog_size(),
+        "load_curve": slot_allocator.load_curve(),
+        "projected_load": slot_allocator.load_forecast()[0],
+        "cancelled": cancelled,
+        "timers": timers_data,
+    }
+
+
+def start_control(port):
+    """
+    Запускает API управления (CONTROL_PORT, 0 — отключено).
+    """
+    if not port:
+        return None
+    server = ControlServer([
+        ("GET", r"/state", control_state),
+        ("POST", r"/pause", control_pause),
+        ("POST", r"/resume", control_resume),
+        ("POST", r"/drain", control_drain),
+        ("POST", r"/accounts/(?P<account>\d+)/enqueue", control_enqueue),
+        ("POST", r"/accounts/(?P<account>\d+)/cancel", control_cancel),
+    ], port)
+    return server if server.start() else None
+
+
 def generate_and_display_table(data, table_type="balance", show_total=True):
     """
     Универсальная функция для генерации и вывода таблиц.
+    Таблица балансов строится по status_model: аккаунты уже упорядочены
+    по времени запуска, итоговый баланс поддерживается при обновлениях.
     """
     try:
         table = PrettyTable()
-        total_balance = 0
+        quarantine_table = PrettyTable()
 
         if table_type == "balance":
             table.field_names = ["ID", "Username",
-                                 "Balance", "Next Scheduled Time", "Status"]
-            with balance_lock:
-                sorted_data = sorted(
-                    data.items(),
-                    key=lambda item: datetime.strptime(
-                        item[1]["next_schedule"], "%Y-%m-%d %H:%M:%S"
-                    ) if item[1]["next_schedule"] != "N/A" else datetime.max
-                )
-
-                for account, details in sorted_data:
-                    balance = (
-                        int(details["balance"])
-                        if details["balance"] == int(details["balance"])
-                        else round(details["balance"], 2)
-                    )
-                    next_schedule = (
-                        datetime.strptime(
-                            details["next_schedule"], "%Y-%m-%d %H:%M:%S"
-                        ).strftime("%Y-%m-%d %H:%M:%S")
-                        if details["next_schedule"] != "N/A" else "N/A"
-                    )
-                    # Цвета с приоритетом: ANSI -> Windows API -> Без цвета
-                    color = get_color(
-                        Fore.RED) if details["status"] == "ERROR" else get_color(Fore.CYAN)
+                                 "Balance", "Next Scheduled Time", "Status", "Deferred"]
+            quarantine_table.field_names = ["ID", "Username",
+                                            "Failed Runs", "Next Attempt"]
+            for account, details in status_model.rows_in_order():
+                balance = format_balance(details.get("balance") or 0.0)
+                next_schedule = details.get("next_schedule") or "N/A"
+                # Цвета с приоритетом: ANSI -> Windows API -> Без цвета
+                if details["status"] == "QUARANTINED":
+                    # Аккаунты в карантине выводятся отдельной таблицей
+                    color = get_color(Fore.RED)
                     reset = get_color(Style.RESET_ALL)
-
-                    table.add_row([
+                    quarantine_table.add_row([
                         f"{color}{account}{reset}",
                         f"{color}{details['username']}{reset}",
-                        f"{color}{balance}{reset}",
+                        f"{color}{details.get('failure_streak', 0)}{reset}",
                         f"{color}{next_schedule}{reset}",
-                        f"{color}{details['status']}{reset}",
                     ])
-                    if details["status"] != "ERROR":
-                        total_balance += balance
+                    continue
+                if details["status"] == "ERROR":
+                    color = get_color(Fore.RED)
+                elif details["status"] == "Deferred":
+                    color = get_color(Fore.YELLOW)
+                else:
+                    color = get_color(Fore.CYAN)
+                reset = get_color(Style.RESET_ALL)
+
+                table.add_row([
+                    f"{color}{account}{reset}",
+                    f"{color}{details['username']}{reset}",
+                    f"{color}{balance}{reset}",
+                    f"{color}{next_schedule}{reset}",
+                    f"{color}{details['status']}{reset}",
+                    f"{color}{details.get('deferrals', 0)}{reset}",
+                ])
 
             logger.info("\nCurrent Balance Table:\n" + str(table))
+            if quarantine_table.rows:
+                logger.info("\nQuarantined Accounts:\n" + str(quarantine_table))
             if show_total:
                 total_color = get_color(Fore.MAGENTA)
                 reset = get_color(Style.RESET_ALL)
                 logger.info(
-                    f"Total Balance: {total_color}{str(total_balance).rstrip('0').rstrip('.')}{reset}"
+                    f"Total Balance: {total_color}{format_balance(round(status_model.total_balance, 2))}{reset}"
+                )
+            runs, avg_lateness, max_lateness, total_lateness = run_stats.lateness_summary()
+            if runs:
+                logger.info(
+                    f"Schedule lateness over last {runs} runs: avg {avg_lateness:.0f}s, "
+                    f"max {max_lateness:.0f}s, total {total_lateness:.0f}s"
                 )
 
         elif table_type == "timers":
             table.field_names = ["Account ID", "Username",
                                  "Next Scheduled Time", "Status"]
+            # Время в формате "%Y-%m-%d %H:%M:%S" упорядочивается как строка
             sorted_data = sorted(
-                data.items(),
-                key=lambda item: datetime.strptime(
-                    item[1]["next_schedule"], "%Y-%m-%d %H:%M:%S"),
-            )
+                data.items(), key=lambda item: item[1]["next_schedule"])
 
             for account, details in sorted_data:
                 username = details.get("username", "N/A")
                 next_schedule = details["next_schedule"]
                 status = details["status"]
-                color = get_color(
-                    Fore.GREEN) if status == "Active" else get_color(Fore.RED)
+                if status in ("Active", "Kept alive"):
+                    color = get_color(Fore.GREEN)
+                elif status == "Deferred":
+                    color = get_color(Fore.YELLOW)
+                else:
+                    color = get_color(Fore.RED)
                 reset = get_color(Style.RESET_ALL)
 
                 table.add_row([
@@ -797,8 +1492,11 @@ def sync_timers_with_balance(balance_dict):
                         # Загружаем баланс из таймеров
                         "balance": timer_info.get("balance", 0.0),
                         "next_schedule": timer_info["next_schedule"],
-                        "status": timer_info["status"]
+                        "status": timer_info["status"],
+                        "deferrals": timer_info.get("deferrals", 0),
+                        "failure_streak": timer_info.get("failure_streak", 0),
                     }
+                    status_model.update(account, balance_dict[account])
                     if is_debug_enabled():
                         logger.debug(
                             f"Timer data synced with balance.")
@@ -819,7 +1517,6 @@ def sync_timers_with_balance(balance_dict):
 
 
 def cleanup_resources(active_timers, task_queue):
-    global bot
     """
     Останавливает все активные таймеры, выполняет очистку ресурсов и очищает очередь.
     """
@@ -840,25 +1537,29 @@ def cleanup_resources(active_timers, task_queue):
 
     # Очищаем задачи из очереди
     try:
-        while not task_queue.empty():
-            task = task_queue.get_nowait()  # Извлекаем задачу без ожидания
-            logger.debug(f"Discarding task during cleanup: {task}")
-            task_queue.task_done()  # Помечаем задачу как выполненную
+        discarded = task_queue.clear() + quest_queue.clear()
+        logger.debug(f"Discarded {discarded} task(s) during cleanup.")
         logger.debug("Task queue successfully cleared.")
     except Exception as queue_error:
         logger.debug(
             f"Exception during task queue cleanup: {queue_error}", exc_info=True)
 
-    # Закрываем браузер, если он существует
-    if bot:
+    # Параллельно закрываем все открытые браузеры с общим дедлайном
+    with active_bots_lock:
+        bots = list(active_bots.values())
+        active_bots.clear()  # Очищаем реестр для предотвращения утечек
+    if bots:
         try:
-            logger.info("Closing browser during cleanup...",
+            logger.info(f"Closing {len(bots)} browser(s) during cleanup...",
                         extra={'color': Fore.CYAN})
-            bot.browser_manager.close_browser()
+            close_browsers([bot.browser_manager for bot in bots],
+                           timeout=browser_close_timeout)
         except Exception as browser_error:
-            logger.warning(f"Failed to close browser: {browser_error}")
-        finally:
-            bot = None  # Очищаем глобальный объект `bot` для предотвращения утечек
+            logger.warning(f"Failed to close browsers: {browser_error}")
+
+    # Завершаем процессы воркеров
+    if worker_pool:
+        worker_pool.shutdown(timeout=browser_close_timeout)
 
     logger.info("All resources cleaned up. Exiting gracefully.",
                 extra={'color': Fore.MAGENTA})
@@ -878,7 +1579,8 @@ if __name__ == "__main__":
     sys.excepthook = handle_uncaught_exception
     signal.signal(signal.SIGINT, signal.default_int_handler)
 
-    task_processor_thread = None  # Инициализируем переменную
+    task_processor_threads = []  # Инициализируем переменную
+    quest_threads = []
     try:
         # Настройка аргументов командной строки
         parser = argparse.ArgumentParser(
@@ -887,7 +1589,7 @@ if __name__ == "__main__":
         parser.add_argument("--debug", action="store_true",
                             help="Enable debug logging")
         parser.add_argument("--account", type=int,
-                            help="Force processing a specific account")
+                            help="Force processing a specific account (queued in the running scheduler if CONTROL_PORT is set)")
         parser.add_argument(
             "--visible", type=int, choices=[0, 1], default=0, help="Set visible mode (1 for visible, 0 for headless)"
         )
@@ -911,16 +1613,50 @@ if __name__ == "__main__":
         else:
             logger.info("Quests are disabled.")
 
+        # Трассировка шагов (TRACE_ENABLED)
+        configure_tracing(settings)
+
+        # Пул процессов для изоляции сессий браузера
+        if worker_mode == "process":
+            worker_pool = WorkerPool(
+                settings,
+                on_launch=record_launch_latency,
+                max_sessions=get_int_setting(
+                    settings, "WORKER_MAX_SESSIONS", DEFAULT_MAX_SESSIONS),
+                debug_mode=args.debug,
+                visible_mode=visible.is_set(),
+            )
+            logger.info("Account sessions run in isolated worker processes.")
+
         # Отключение отслеживания в GitHub
         files_to_ignore = ["settings.txt", "accounts.txt"]
         ignore_files_in_git(files_to_ignore)
 
         # Принудительный запуск аккаунта
         if args.account:
-            account = args.account
+            # Если планировщик уже запущен, аккаунт ставится в его очередь,
+            # чтобы не конкурировать с ним за профиль AdsPower
+            reply = send_command(
+                control_port, "POST", f"/accounts/{args.account}/enqueue") if control_port else None
+            if reply:
+                status, payload = reply
+                if status == 200:
+                    logger.info(
+                        f"Account {args.account} queued in the running scheduler. Exiting.")
+                else:
+                    logger.error(
+                        f"Running scheduler rejected account {args.account}: {payload.get('error')}")
+                sys.exit(0 if status == 200 else 1)
+            # --account задаёт число, а в accounts.txt и профилях AdsPower номера — строки
+            # (запущенный планировщик приводит номер сам)
+            args.account = normalize_account(args.account, get_accounts())
             logger.debug(f"Processing account {args.account} in debug mode...")
             try:
                 process_account(args.account, balance_dict, active_timers)
+                if quest_queue.remove(f"quests:{args.account}"):
+                    process_quests(args.account)
+                generate_and_display_table(
+                    balance_dict, table_type="balance", show_total=True)
                 logger.info(
                     f"Account {args.account} processing completed. Exiting.")
             except Exception as e:
@@ -937,21 +1673,52 @@ if __name__ == "__main__":
         check_and_update(priority_task_queue=task_queue,
                          is_task_active=lambda: not task_queue.empty())
         schedule_periodic_update_check(task_queue, update_interval)
+        migrate_launched_profiles(get_accounts())
+        reap_orphaned_browsers(
+            claim_account, release_account, timeout=browser_close_timeout)
+        admission.start(stop_event)
+        health_monitor.start(stop_event)
+        start_metrics(get_int_setting(settings, "METRICS_PORT", 0))
+        start_control(control_port)
+        live_view = start_status_view(
+            settings.get("STATUS_VIEW", "log").strip().lower())
+        if not live_view:
+            schedule_status_report(get_int_setting(
+                settings, "STATUS_TABLE_INTERVAL", DEFAULT_STATUS_TABLE_INTERVAL))
+        schedule_load_curve_report(get_int_setting(
+            settings, "LOAD_CURVE_INTERVAL", DEFAULT_LOAD_CURVE_INTERVAL))
+        schedule_periodic_reaper(get_int_setting(
+            settings, "REAPER_INTERVAL", DEFAULT_REAPER_INTERVAL))
         while not stop_event.is_set():
             try:
                 reset_balances()
                 accounts = get_accounts()
+                scheduled_accounts = accounts
                 sync_timers_with_balance(balance_dict)
                 generate_and_display_table(timers_data, table_type="timers")
                 logger.info("Starting account processing cycle.")
 
-                # Запуск обработчика очереди задач
-                task_processor_thread = Thread(
-                    target=task_queue_processor,
-                    args=(task_queue, active_timers),
-                    daemon=True
-                )
-                task_processor_thread.start()
+                # Запуск обработчиков очереди задач (MAX_WORKERS на всё время работы)
+                task_processor_threads = [
+                    thread for thread in task_processor_threads if thread.is_alive()]
+                while len(task_processor_threads) < max_workers:
+                    task_processor_thread = Thread(
+                        target=task_queue_processor,
+                        args=(task_queue, active_timers),
+                        daemon=True
+                    )
+                    task_processor_thread.start()
+                    task_processor_threads.append(task_processor_thread)
+
+                # Отдельная полоса квестов со своим лимитом (QUEST_WORKERS)
+                if enable_quests:
+                    quest_threads = [
+                        thread for thread in quest_threads if thread.is_alive()]
+                    while len(quest_threads) < quest_workers:
+                        quest_thread = Thread(
+                            target=quest_queue_processor, daemon=True)
+                        quest_thread.start()
+                        quest_threads.append(quest_thread)
 
                 # Обработка аккаунтов
                 for account in accounts:
@@ -971,18 +1738,29 @@ if __name__ == "__main__":
                                 logger.debug(
                                     f"#{account}: Account scheduled for {next_schedule}. Skipping immediate processing."
                                 )
+                                # Карантин сохраняется после перезапуска скрипта
+                                status = "QUARANTINED" if timer_info.get(
+                                    "status") == "QUARANTINED" else "Active"
                                 schedule_next_run(
-                                    account, next_schedule, balance_dict, active_timers)
+                                    account, next_schedule, balance_dict, active_timers, status=status)
                                 continue
                         if stop_event.is_set():  # Дополнительная проверка перед добавлением в очередь
                             break
+                        if f"account:{account}" in task_queue or not is_profile_idle(account):
+                            continue
+                        # Новые аккаунты допускаются в очередь постепенно, самые просроченные первыми
                         logger.debug(
-                            f"#{account}: Adding account to task queue for processing.")
-                        task_queue.put((account, balance_dict, active_timers))
+                            f"#{account}: Submitting account for admission to the task queue.")
+                        admission.submit(account, last_due_time(account))
                     except Exception as e:
                         logger.error(
                             f"Error while scheduling account {account}: {e}")
 
+                # Первая партия допускается сразу, а не через ADMISSION_INTERVAL
+                admission.wake()
+
+                logger.info(slot_allocator.load_curve())
+
                 # Ожидание завершения таймеров
                 while not stop_event.is_set() and any(timer.is_alive() for timer in active_timers):
                     # Используем stop_event для быстрой проверки и выхода
@@ -1004,12 +1782,20 @@ if __name__ == "__main__":
     except Exception as e:
         logger.error(f"Unhandled exception in main loop: {e}")
     finally:
-        logger.debug("Waiting for task queue processor to stop...")
-        task_queue.put(None)
-
-        if task_processor_thread and task_processor_thread.is_alive():
+        # Возвращаем обычный вывод лога в терминал до сообщений о завершении
+        if live_view:
+            live_view.stop()
+        logger.debug("Waiting for task queue processors to stop...")
+        for _ in task_processor_threads:
+            task_queue.put(None, PRIORITY_SHUTDOWN)
+        for _ in quest_threads:
+            quest_queue.put(None, PRIORITY_SHUTDOWN)
+
+        shutdown_deadline = time.monotonic() + 5
+        for task_processor_thread in task_processor_threads + quest_threads:
             try:
-                task_processor_thread.join(timeout=5)
+                task_processor_thread.join(
+                    timeout=max(0, shutdown_deadline - time.monotonic()))
                 if task_processor_thread.is_alive():
                     logger.debug(
                         "Task queue processor thread did not terminate in time. Forcing shutdown.")
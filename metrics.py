@@ -0,0 +1,225 @@
+import bisect
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import logging
+
+# Настройка логирования
+logger = logging.getLogger("application_logger")
+
+METRICS_HOST = "127.0.0.1"  # Метрики доступны только локально
+METRICS_PREFIX = "tinyverse_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин гистограмм, сек
+LAUNCH_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120)
+STEP_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200)
+LATENESS_BUCKETS = (0, 30, 60, 300, 600, 1800, 3600, 7200)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Базовый класс метрики с метками.
+
+    :param name: Имя метрики (без префикса).
+    :param description: Описание (HELP).
+    :param labels: Имена меток.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, description, labels=()):
+        self.name = METRICS_PREFIX + name
+        self.description = description
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self):
+        """
+        Возвращает строки значений в текстовом формате Prometheus.
+        """
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in items]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}",
+                 f"# TYPE {self.name} {self.kind}"]
+        return lines + self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Текущее значение. Значение можно задать напрямую или функцией,
+    которая вызывается при каждом запросе метрик.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, description, labels=()):
+        super().__init__(name, description, labels)
+        self.functions = {}
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def set_function(self, function, **labels):
+        self.functions[self._key(labels)] = function
+
+    def samples(self):
+        for key, function in list(self.functions.items()):
+            try:
+                value = function()
+            except Exception as e:
+                logger.debug(f"Failed to read gauge {self.name}: {e}")
+                continue
+            with self.lock:
+                self.values[key] = value
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets, labels=()):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, (list(counts), total, count))
+                           for key, (counts, total, count) in self.values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labels, key, [('le', _format_value(float(bound)))])} {cumulative}")
+            lines.append(
+                f"{self.name}_bucket{_format_labels(self.labels, key, [('le', '+Inf')])} {count}")
+            lines.append(
+                f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(
+                f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Набор метрик процесса.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+queue_depth = registry.register(Gauge(
+    "queue_depth", "Tasks waiting in the scheduler queues.", ("queue",)))
+active_workers = registry.register(Gauge(
+    "active_workers", "Accounts currently being processed."))
+browser_launch_seconds = registry.register(Histogram(
+    "browser_launch_seconds", "AdsPower profile start latency.", LAUNCH_BUCKETS))
+step_duration_seconds = registry.register(Histogram(
+    "step_duration_seconds", "Duration of pipeline steps.", STEP_BUCKETS, ("step",)))
+schedule_lateness_seconds = registry.register(Histogram(
+    "schedule_lateness_seconds", "Delay between the scheduled and the actual start of a run.", LATENESS_BUCKETS))
+runs_total = registry.register(Counter(
+    "runs_total", "Finished account runs by outcome.", ("outcome",)))
+errors_total = registry.register(Counter(
+    "errors_total", "Failed run attempts by error class.", ("error_class",)))
+projected_load = registry.register(Gauge(
+    "projected_load", "Runs reserved by the slot allocator per upcoming time group.", ("offset_minutes",)))
+adspower_requests_total = registry.register(Counter(
+    "adspower_requests_total", "Requests to the AdsPower local API by endpoint.", ("endpoint",)))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Metrics request: {format % args}")
+
+
+def start_metrics_server(port, metrics_registry=registry):
+    """
+    Запускает HTTP-сервер метрик на localhost в фоновом потоке.
+
+    :param port: Порт сервера.
+    :return: Сервер (для остановки через shutdown) или None, если порт занят.
+    """
+    try:
+        server = ThreadingHTTPServer((METRICS_HOST, port), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"Failed to start metrics server on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    server.registry = metrics_registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(
+        f"Metrics available at http://{METRICS_HOST}:{port}/metrics")
+    return server
@@ -0,0 +1,202 @@
+import time
+from utils import stop_event
+import logging
+
+# Настройка логирования
+logger = logging.getLogger("application_logger")
+
+# Каркас фоновой задачи на странице. Тело задачи (BODY) — асинхронная функция
+# (job, args), которая сообщает прогресс через job.report({...}), проверяет job.cancel
+# и завершается через job.finish(состояние, результат).
+# Прогресс дублируется в localStorage, чтобы задача продолжилась после перезагрузки страницы.
+# Новый запуск (без resume) очищает сохранённый прогресс, чтобы не подхватить остатки
+# прошлого запуска; при продолжении сохранённый прогресс свежее последнего опроса.
+# Если задача с тем же именем ещё выполняется, возвращается ALREADY_RUNNING.
+JOB_RUNNER_JS = r"""
+const [name, args, resume] = arguments;
+const storageKey = "pageJob:" + name;
+window.__pageJobs = window.__pageJobs || {};
+const previous = window.__pageJobs[name];
+if (previous && previous.state === "running") {
+    return "already_running";
+}
+let saved = null;
+if (resume) {
+    try { saved = JSON.parse(localStorage.getItem(storageKey)); } catch (e) {}
+} else {
+    try { localStorage.removeItem(storageKey); } catch (e) {}
+}
+const job = {
+    name: name,
+    state: "running",
+    progress: Object.assign({}, resume || {}, saved || {}),
+    result: null,
+    error: null,
+    cancel: false,
+    started: Date.now(),
+    updated: Date.now(),
+};
+job.report = (progress) => {
+    Object.assign(job.progress, progress);
+    job.updated = Date.now();
+    try { localStorage.setItem(storageKey, JSON.stringify(job.progress)); } catch (e) {}
+};
+job.finish = (state, result) => {
+    job.state = state;
+    job.result = result === undefined ? null : result;
+    job.updated = Date.now();
+    try { localStorage.removeItem(storageKey); } catch (e) {}
+};
+window.__pageJobs[name] = job;
+const body = async (job, args) => {
+__BODY__
+};
+body(job, args).then(() => {
+    if (job.state === "running") job.finish("done");
+}).catch((e) => {
+    job.error = String(e);
+    job.finish("error");
+});
+return "started";
+"""
+
+ALREADY_RUNNING = "already_running"
+
+POLL_JOB_JS = r"""
+const job = (window.__pageJobs || {})[arguments[0]];
+if (!job) return null;
+return {
+    state: job.state, progress: job.progress, result: job.result,
+    error: job.error, started: job.started, updated: job.updated
+};
+"""
+
+CANCEL_JOB_JS = r"""
+const job = (window.__pageJobs || {})[arguments[0]];
+if (job) job.cancel = true;
+return !!job;
+"""
+
+
+def build_job_script(body):
+    """
+    Встраивает тело задачи в каркас фоновой задачи на странице.
+    """
+    return JOB_RUNNER_JS.replace("__BODY__", body)
+
+
+def start_page_job(driver, name, script, args=None, resume=None):
+    """
+    Запускает фоновую задачу на странице, не дожидаясь её завершения.
+
+    :param script: Скрипт, построенный build_job_script.
+    :param resume: Прогресс, с которого нужно продолжить (например, после перезагрузки).
+    :return: "started" или ALREADY_RUNNING, если задача с тем же именем ещё выполняется.
+    """
+    return driver.execute_script(script, name, args or {}, resume)
+
+
+def poll_page_job(driver, name):
+    """
+    Возвращает состояние задачи ({state, progress, result, error, started, updated})
+    или None, если задачи на странице нет (например, страница была перезагружена).
+    """
+    return driver.execute_script(POLL_JOB_JS, name)
+
+
+def cancel_page_job(driver, name):
+    """
+    Просит задачу на странице завершиться.
+    """
+    try:
+        return driver.execute_script(CANCEL_JOB_JS, name)
+    except Exception as e:
+        logger.debug(f"Failed to cancel page job '{name}': {e}")
+        return False
+
+
+def _cancel_with_progress(driver, name, status):
+    """
+    Отменяет задачу и возвращает её последнее состояние, чтобы не потерять
+    прогресс, сделанный после предыдущего опроса.
+    """
+    cancel_page_job(driver, name)
+    try:
+        return poll_page_job(driver, name) or status
+    except Exception as e:
+        logger.debug(f"Failed to poll page job '{name}' after cancel: {e}")
+        return status
+
+
+def _start_replacing(driver, name, script, args, resume, poll_interval, attempts=3):
+    """
+    Запускает задачу; если на странице ещё выполняется прежняя задача с тем же именем
+    (например, брошенная после таймаута), отменяет её и ждёт завершения.
+
+    :return: True, если задача запущена.
+    """
+    for _ in range(attempts):
+        if start_page_job(driver, name, script, args, resume) != ALREADY_RUNNING:
+            return True
+        logger.info(
+            f"Page job '{name}' from a previous run is still running. Cancelling it.")
+        cancel_page_job(driver, name)
+        if stop_event.wait(poll_interval):
+            return False
+    return start_page_job(driver, name, script, args, resume) != ALREADY_RUNNING
+
+
+def run_page_job(driver, name, script, args=None, timeout=None, poll_interval=5,
+                 should_stop=None, on_progress=None, max_restarts=3):
+    """
+    Запускает фоновую задачу на странице и опрашивает её состояние.
+
+    В отличие от execute_async_script, Python не блокируется на время выполнения:
+    между опросами проверяются stop_event и should_stop, а задача отменяется по таймауту.
+    Если задача пропала со страницы (перезагрузка), она перезапускается с последнего прогресса.
+
+    :param timeout: Максимальное время выполнения в секундах.
+    :param should_stop: Функция без аргументов; True — отменить задачу.
+    :param on_progress: Функция, получающая состояние задачи при каждом опросе.
+    :return: Последнее состояние задачи; state — done, timeout, cancelled, error, lost
+        или busy (прежняя задача с тем же именем не завершилась).
+    """
+    started = time.monotonic()
+    if not _start_replacing(driver, name, script, args, None, poll_interval):
+        logger.warning(
+            f"Page job '{name}' could not be started: a previous run did not stop.")
+        return {"state": "busy", "progress": {}}
+    status = {"state": "running", "progress": {}}
+    restarts = 0
+
+    while True:
+        if stop_event.wait(poll_interval) or (should_stop and should_stop()):
+            status = _cancel_with_progress(driver, name, status)
+            status["state"] = "cancelled"
+            return status
+
+        if timeout and time.monotonic() - started > timeout:
+            status = _cancel_with_progress(driver, name, status)
+            logger.warning(
+                f"Page job '{name}' exceeded {timeout} seconds. Cancelled.")
+            status["state"] = "timeout"
+            return status
+
+        current = poll_page_job(driver, name)
+        if current is None:
+            if restarts >= max_restarts:
+                status["state"] = "lost"
+                return status
+            restarts += 1
+            logger.info(
+                f"Page job '{name}' is gone (page reloaded?). Resuming from {status.get('progress')}.")
+            if not _start_replacing(driver, name, script, args, status.get("progress"), poll_interval):
+                status["state"] = "busy"
+                return status
+            continue
+
+        status = current
+        if on_progress:
+            on_progress(status)
+        if status.get("state") != "running":
+            return status
@@ -0,0 +1,328 @@
+import time
+from threading import Thread, Event
+from utils import stop_event
+from errors import NavigationError, BudgetExceededError, GameStateError
+from driver_profiler import set_current_step
+from tracing import span
+from metrics import step_duration_seconds
+import logging
+
+# Настройка логирования
+logger = logging.getLogger("application_logger")
+
+# Шаги, привязанные к сессии браузера: после перезапуска их нужно повторить
+SESSION_STEPS = ("navigate_to_bot", "send_message",
+                 "click_link", "preparing_account")
+
+
+class RunCheckpoint:
+    """
+    Контрольная точка одного запуска аккаунта.
+    Запоминает выполненные шаги и их результаты, чтобы повтор в рамках
+    запуска продолжался с первого невыполненного шага.
+    """
+
+    def __init__(self, account):
+        self.account = account
+        self.completed = {}
+        self.current_step = None  # Выполняемый шаг и время его начала
+        self.step_started = None
+        self.expired = None  # Причина остановки сторожем, если бюджет превышен
+
+    def is_done(self, step):
+        return step in self.completed
+
+    def start_step(self, step):
+        self.current_step = step
+        self.step_started = time.monotonic()
+
+    def finish_step(self):
+        if self.current_step and self.step_started is not None:
+            step_duration_seconds.observe(
+                time.monotonic() - self.step_started, step=self.current_step)
+        self.current_step = None
+        self.step_started = None
+
+    def mark_done(self, step, result=None):
+        self.completed[step] = result
+        logger.debug(f"#{self.account}: Step '{step}' completed.")
+
+    def result(self, step):
+        return self.completed.get(step)
+
+    def reset_session(self):
+        """
+        Сбрасывает шаги сессии браузера перед перезапуском.
+        Выполненные действия в игре (сбор, звёзды, квесты) не сбрасываются.
+        """
+        for step in SESSION_STEPS:
+            self.completed.pop(step, None)
+
+    def next_cycle(self):
+        """
+        Сбрасывает действия в игре для следующего сбора в той же сессии браузера.
+        Шаги сессии (навигация, запуск приложения) остаются выполненными.
+        """
+        for step in list(self.completed):
+            if step not in SESSION_STEPS:
+                del self.completed[step]
+
+
+def run_step(checkpoint, step, action):
+    """
+    Выполняет шаг, если он ещё не отмечен в контрольной точке.
+
+    :param checkpoint: Контрольная точка запуска.
+    :param step: Имя шага.
+    :param action: Функция без аргументов, выполняющая шаг.
+    :return: Результат шага (сохранённый, если шаг уже выполнен).
+    """
+    if checkpoint.expired:
+        raise BudgetExceededError(checkpoint.expired)
+    if checkpoint.is_done(step):
+        logger.debug(
+            f"#{checkpoint.account}: Step '{step}' already completed. Skipping.")
+        return checkpoint.result(step)
+
+    checkpoint.start_step(step)
+    set_current_step(step)
+    try:
+        with span(step, checkpoint.account):
+            result = action()
+    finally:
+        checkpoint.finish_step()
+        set_current_step(None)
+    checkpoint.mark_done(step, result)
+    return result
+
+
+class RunWatchdog:
+    """
+    Сторож запуска аккаунта: следит за бюджетом времени на весь запуск и на каждый шаг.
+
+    Блокирующие вызовы Selenium не прерываются через stop_event, поэтому при превышении
+    бюджета сторож вызывает on_expire (принудительная остановка профиля через API AdsPower),
+    после чего зависший вызов завершается ошибкой, а запуск считается неудачным.
+
+    :param checkpoint: Контрольная точка запуска (источник текущего шага).
+    :param run_budget: Бюджет на весь запуск в секундах (0 — без ограничения).
+    :param step_budget: Бюджет на один шаг в секундах (0 — без ограничения).
+    :param on_expire: Функция без аргументов, останавливающая профиль.
+    """
+
+    def __init__(self, checkpoint, run_budget, step_budget, on_expire):
+        self.checkpoint = checkpoint
+        self.run_budget = run_budget
+        self.step_budget = step_budget
+        self.on_expire = on_expire
+        self.started = time.monotonic()
+        self.finished = Event()
+        self.thread = Thread(target=self._watch, daemon=True)
+
+    def start(self):
+        if self.run_budget or self.step_budget:
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.finished.set()
+
+    def restart(self):
+        """
+        Начинает отсчёт бюджета запуска заново (следующий сбор в открытой сессии).
+        """
+        self.started = time.monotonic()
+
+    def _overrun(self):
+        now = time.monotonic()
+        if self.run_budget and now - self.started > self.run_budget:
+            return f"Run exceeded time budget of {self.run_budget}s"
+        step, step_started = self.checkpoint.current_step, self.checkpoint.step_started
+        if self.step_budget and step and step_started and now - step_started > self.step_budget:
+            return f"Step '{step}' exceeded time budget of {self.step_budget}s"
+        return None
+
+    def _watch(self):
+        while not self.finished.wait(1) and not stop_event.is_set():
+            reason = self._overrun()
+            if not reason:
+                continue
+            self.checkpoint.expired = reason
+            logger.error(
+                f"#{self.checkpoint.account}: {reason}. Force-stopping the profile.")
+            try:
+                self.on_expire()
+            except Exception as e:
+                logger.debug(
+                    f"#{self.checkpoint.account}: Failed to force-stop profile: {e}")
+            return
+
+
+def require(result, message):
+    """
+    Возвращает результат шага или выбрасывает NavigationError, если шаг не удался.
+    """
+    if not result:
+        raise NavigationError(message)
+    return result
+
+
+def open_game(bot, checkpoint):
+    """
+    Открывает Telegram Web, группу и приложение игры.
+
+    :return: False, если обработка прервана по stop_event.
+    """
+    if stop_event.is_set():
+        logger.info("Stop event detected. Aborting navigation and actions.")
+        return False
+
+    run_step(checkpoint, "navigate_to_bot", lambda: require(
+        bot.navigate_to_bot(), "Failed to navigate to bot"))
+
+    if stop_event.is_set():
+        logger.debug("Stop event detected. Aborting after navigation.")
+        return False
+
+    run_step(checkpoint, "send_message", lambda: require(
+        bot.send_message(), "Failed to send message"))
+
+    if stop_event.is_set():
+        logger.debug("Stop event detected. Aborting after sending message.")
+        return False
+
+    run_step(checkpoint, "click_link", lambda: require(
+        bot.click_link(), "Failed to start app"))
+
+    if stop_event.is_set():
+        logger.debug("Stop event detected. Aborting after starting app.")
+        return False
+
+    logger.debug("Preparing account...")
+    run_step(checkpoint, "preparing_account", bot.preparing_account)
+    return not stop_event.is_set()
+
+
+def navigate_and_perform_actions(bot, account, checkpoint):
+    """
+    Навигация и выполнение срочных задач с ботом (фарм и создание звёзд).
+    Квесты выполняются отдельной задачей (см. run_quest_session).
+    Уже выполненные в этом запуске шаги пропускаются.
+    """
+    if not open_game(bot, checkpoint):
+        logger.debug("Stop event detected. Aborting before farming.")
+        return
+
+    # Замер прогресса до сбора уточняет скорость заполнения аккаунта
+    run_step(checkpoint, "progress_before",
+             lambda: read_progress(bot))
+    if not checkpoint.is_done("farming"):
+        logger.info("Starting farming...")
+    run_step(checkpoint, "farming", bot.farming)
+    if stop_event.is_set():
+        logger.debug("Stop event detected. Aborting before creating stars.")
+        return
+    run_step(checkpoint, "create_stars", bot.create_stars)
+
+
+def run_quest_session(bot, account, checkpoint, should_yield=None):
+    """
+    Выполняет квесты аккаунта в открытой сессии.
+    Прогресс квестов сохраняется ботом, поэтому прерванный запуск продолжается с того же места.
+
+    :param should_yield: Функция без аргументов; True — квесты уступают место фарму.
+    :return: True, если квесты завершены, False — если прерваны.
+    """
+    if not open_game(bot, checkpoint):
+        return False
+
+    logger.info(f"#{account}: Launching quests...")
+    completed = run_step(checkpoint, "create_quests",
+                         lambda: bot.create_quests(should_yield=should_yield))
+    if completed:
+        logger.info(f"#{account}: The quests are completed.")
+    else:
+        logger.info(f"#{account}: Quests paused and will be resumed later.")
+    return bool(completed)
+
+
+def read_username(bot, account):
+    """
+    Читает имя пользователя. Недействительную сессию Telegram get_username
+    определяет сам (AuthError); пустой результат — временный сбой страницы,
+    который повторяется в той же сессии.
+    """
+    username = bot.get_username()
+    if not username or username == "N/A":
+        raise GameStateError(f"#{account}: Username is not available yet")
+    return username
+
+
+def read_balance(bot, account):
+    """
+    Читает баланс и проверяет, что состояние игры получено.
+    """
+    balance = parse_balance(bot.get_balance(), account)
+    if balance <= 0:
+        raise GameStateError(f"#{account}: Invalid balance")
+    return balance
+
+
+def parse_balance(balance, account=None):
+    """
+    Парсинг баланса из строки в число.
+
+    :param balance: Строка с балансом.
+    :param account: Аккаунт (для логирования).
+    :return: Баланс в формате float или 0.0 при ошибке.
+    """
+    try:
+        if balance is None:
+            logger.debug(
+                f"#{account}: Received None for balance. Returning 0.0.")
+            return 0.0
+
+        if isinstance(balance, (int, float)):
+            logger.debug(
+                f"#{account}: Balance is already numeric: {balance}")
+            return float(balance)
+
+        if isinstance(balance, str) and balance.replace('.', '', 1).isdigit():
+            parsed_balance = float(balance)
+            logger.debug(
+                f"#{account}: Parsed balance successfully: {parsed_balance}")
+            return parsed_balance
+
+        logger.debug(
+            f"#{account}: Invalid balance format: {balance}. Returning 0.0.")
+        return 0.0
+    except Exception as e:
+        logger.error(f"#{account}: Error parsing balance: {e}")
+        logger.debug(f"#{account}: Error traceback:", exc_info=True)
+        return 0.0
+
+
+def read_progress(bot):
+    """
+    Замер прогресса фарма.
+
+    :return: Кортеж (unix-время, процент или None).
+    """
+    return time.time(), bot.get_progress()
+
+
+def run_account_session(bot, account, checkpoint):
+    """
+    Выполняет все действия в открытой сессии и читает данные аккаунта.
+    Используется как в потоке планировщика, так и в процессе пула воркеров.
+
+    :return: Кортеж (имя пользователя, баланс, замер прогресса до сбора, замер прогресса в конце).
+    """
+    navigate_and_perform_actions(bot, account, checkpoint)
+
+    username = run_step(
+        checkpoint, "get_username", lambda: read_username(bot, account))
+    balance = run_step(
+        checkpoint, "get_balance", lambda: read_balance(bot, account))
+    progress = run_step(checkpoint, "get_progress", lambda: read_progress(bot))
+    return username, balance, checkpoint.result("progress_before"), progress
@@ -0,0 +1,570 @@
+import heapq
+import itertools
+import random
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from queue import Empty
+from threading import Condition, Event, Lock, Thread
+import logging
+
+# Настройка логирования
+logger = logging.getLogger("application_logger")
+
+# Классы приоритета задач (меньше — раньше)
+PRIORITY_SHUTDOWN = -1
+PRIORITY_UPDATE = 0   # Проверка обновлений
+PRIORITY_DUE = 1      # Плановый фарм
+PRIORITY_RETRY = 2    # Просроченные повторы после ошибок
+PRIORITY_QUARANTINE = 3  # Повторы аккаунтов в карантине
+
+DEFAULT_RUN_DURATION = 180  # Оценка длительности запуска до первых измерений, сек
+RUN_DURATION_ALPHA = 0.3    # Вес нового измерения в скользящем среднем
+LATENESS_WINDOW = 200       # Количество последних запусков в метрике опозданий
+STALE_DUE_AGE = 24 * 60 * 60  # Срок запуска старше этого считается устаревшим, сек
+SLOT_SECONDS = 5 * 60       # Размер слота распределения нагрузки
+ADMISSION_LATENCY_LIMIT = 20  # Задержка запуска профиля AdsPower, выше которой темп снижается, сек
+ADMISSION_SUCCESS_TARGET = 0.8  # Доля успешных запусков, при которой темп повышается
+LOAD_CURVE_BARS = "▁▂▃▄▅▆▇█"
+DEFAULT_FILL_TIME = 60 * 60  # Время заполнения прогресса до первых измерений, сек
+FILL_TIME_ALPHA = 0.5        # Вес нового измерения скорости заполнения
+FILL_TIME_BOUNDS = (10 * 60, 24 * 60 * 60)  # Допустимые значения измерения, сек
+MIN_FILL_DELTA = 5           # Минимальный прирост процента для измерения
+
+
+class TaskQueue:
+    """
+    Очередь задач с приоритетами и индексом по ключу.
+
+    Задачи упорядочены по (класс приоритета, порядок внутри класса, номер добавления).
+    Повторное добавление задачи с тем же ключом объединяется с уже стоящей в очереди:
+    остаётся запись с более высоким приоритетом. Добавление и проверка дубликатов
+    выполняются за O(log n) и O(1) соответственно; вытесненные записи удаляются лениво.
+
+    :param on_remove: Функция, получающая ключ задачи, удалённой из очереди через remove.
+    """
+
+    def __init__(self, on_remove=None):
+        self.on_remove = on_remove
+        self._heap = []
+        self._index = {}  # ключ -> запись в куче
+        self._counter = itertools.count()
+        self._size = 0
+        self._unfinished = 0
+        self._condition = Condition()
+
+    def put(self, task, priority=PRIORITY_DUE, key=None, order=0):
+        """
+        Добавляет задачу в очередь.
+
+        :param task: Задача.
+        :param priority: Класс приоритета.
+        :param key: Ключ для объединения дубликатов или None.
+        :param order: Порядок внутри класса приоритета (меньше — раньше).
+        :return: True, если задача добавлена или повысила приоритет стоящей в очереди.
+        """
+        with self._condition:
+            sort_key = (priority, order)
+            existing = self._index.get(key) if key is not None else None
+            if existing is not None:
+                if existing[0] <= sort_key:
+                    logger.debug(
+                        f"Task '{key}' is already queued. Coalescing.")
+                    return False
+                # Новая запись важнее: старая вытесняется
+                existing[3] = None
+                existing[4] = False
+                self._size -= 1
+                self._unfinished -= 1
+
+            entry = [sort_key, next(self._counter), key, task, True]
+            heapq.heappush(self._heap, entry)
+            if key is not None:
+                self._index[key] = entry
+            self._size += 1
+            self._unfinished += 1
+            self._condition.notify()
+            return True
+
+    def get(self, timeout=None):
+        """
+        Извлекает задачу с наивысшим приоритетом.
+
+        :param timeout: Время ожидания в секундах или None для бесконечного ожидания.
+        :raises Empty: Если за timeout задача не появилась.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._size > 0, timeout):
+                raise Empty
+            return self._pop()
+
+    def get_nowait(self):
+        with self._condition:
+            if self._size == 0:
+                raise Empty
+            return self._pop()
+
+    def _pop(self):
+        while self._heap:
+            _, _, key, task, valid = heapq.heappop(self._heap)
+            if not valid:
+                continue
+            if key is not None:
+                self._index.pop(key, None)
+            self._size -= 1
+            return task
+        raise Empty
+
+    def remove(self, key):
+        """
+        Удаляет задачу с указанным ключом из очереди.
+
+        :return: True, если задача была в очереди.
+        """
+        with self._condition:
+            entry = self._index.pop(key, None)
+            if entry is None:
+                return False
+            entry[3] = None
+            entry[4] = False
+            self._size -= 1
+            self._unfinished -= 1
+        if self.on_remove:
+            self.on_remove(key)
+        return True
+
+    def task_done(self):
+        with self._condition:
+            if self._unfinished > 0:
+                self._unfinished -= 1
+
+    def clear(self):
+        """
+        Удаляет все задачи из очереди.
+
+        :return: Количество удалённых задач.
+        """
+        with self._condition:
+            removed = self._size
+            self._heap.clear()
+            self._index.clear()
+            self._unfinished -= removed
+            self._size = 0
+            return removed
+
+    def __contains__(self, key):
+        with self._condition:
+            return key in self._index
+
+    def keys(self):
+        """
+        Возвращает ключи задач в порядке выдачи.
+        """
+        with self._condition:
+            entries = sorted(entry[:3] for entry in self._index.values())
+        return [key for _, _, key in entries]
+
+    def qsize(self):
+        with self._condition:
+            return self._size
+
+    def empty(self):
+        return self.qsize() == 0
+
+
+class FillRateModel:
+    """
+    Модель скорости заполнения прогресса фарма для каждого аккаунта.
+
+    Время полного заполнения оценивается по последовательным замерам (время, процент)
+    в пределах одного цикла заполнения (процент вырос, сбора между замерами не было)
+    и сглаживается экспоненциальным скользящим средним. Последний замер и оценка
+    сохраняются в состоянии аккаунта.
+
+    :param state_store: Хранилище состояния аккаунтов.
+    """
+
+    def __init__(self, state_store, alpha=FILL_TIME_ALPHA, default_fill_time=DEFAULT_FILL_TIME):
+        self.state_store = state_store
+        self.alpha = alpha
+        self.default_fill_time = default_fill_time
+
+    def fill_time(self, account):
+        """
+        Возвращает оценку времени полного заполнения прогресса в секундах.
+        """
+        return self.state_store.get(account, "fill_time", self.default_fill_time)
+
+    def record(self, account, sample):
+        """
+        Учитывает замер прогресса и уточняет скорость заполнения по предыдущему замеру.
+
+        :param sample: Кортеж (unix-время, процент) или None.
+        """
+        if not sample or sample[1] is None:
+            return
+        timestamp, percent = sample
+        previous = self.state_store.get(account, "fill_sample")
+        fields = {"fill_sample": [timestamp, percent]}
+
+        # Заполненный прогресс (100%) даёт лишь нижнюю границу скорости
+        if previous and percent < 100 and percent - previous[1] >= MIN_FILL_DELTA \
+                and timestamp > previous[0]:
+            measured = (timestamp - previous[0]) * 100 / \
+                (percent - previous[1])
+            if FILL_TIME_BOUNDS[0] <= measured <= FILL_TIME_BOUNDS[1]:
+                known = self.state_store.get(account, "fill_time")
+                estimate = measured if known is None else (
+                    self.alpha * measured + (1 - self.alpha) * known)
+                fields["fill_time"] = round(estimate)
+                logger.debug(
+                    f"#{account}: Measured fill time {measured:.0f}s, estimated {estimate:.0f}s.")
+        self.state_store.update(account, **fields)
+
+    def remaining(self, account, percent):
+        """
+        Возвращает оставшееся до заполнения время в секундах или None, если процент неизвестен.
+        """
+        if percent is None:
+            return None
+        return self.fill_time(account) * max(0, 100 - percent) / 100
+
+
+class RunStats:
+    """
+    Статистика запусков аккаунтов: экспоненциальное скользящее среднее длительности
+    и опоздание старта относительно запланированного времени.
+
+    :param state_store: Хранилище состояния аккаунтов для сохранения оценок.
+    """
+
+    def __init__(self, state_store, alpha=RUN_DURATION_ALPHA, default_duration=DEFAULT_RUN_DURATION):
+        self.state_store = state_store
+        self.alpha = alpha
+        self.default_duration = default_duration
+        self.lock = Lock()
+        self.due_times = {}  # аккаунт -> время, к которому запуск должен начаться
+        self.lateness = deque(maxlen=LATENESS_WINDOW)
+        self.fleet_duration = default_duration  # Средняя длительность по всем аккаунтам
+
+    def estimate(self, account):
+        """
+        Возвращает оценку длительности запуска аккаунта в секундах.
+        """
+        return self.state_store.get(account, "run_duration", self.default_duration)
+
+    def record_run(self, account, duration):
+        """
+        Обновляет скользящее среднее длительности запуска.
+        """
+        previous = self.state_store.get(account, "run_duration")
+        estimate = duration if previous is None else (
+            self.alpha * duration + (1 - self.alpha) * previous)
+        self.state_store.update(account, run_duration=round(estimate, 1))
+        with self.lock:
+            self.fleet_duration = self.alpha * duration + \
+                (1 - self.alpha) * self.fleet_duration
+        logger.debug(
+            f"#{account}: Run took {duration:.0f}s, estimated duration {estimate:.0f}s.")
+
+    def order_key(self, account, due):
+        """
+        Порядок в очереди: самое позднее время старта, при котором запуск
+        ещё завершится к сроку (срок минус оценка длительности).
+        """
+        with self.lock:
+            # Номер аккаунта может быть строкой или числом в зависимости от источника
+            known = self.due_times.get(str(account))
+            if known is None or due < known:
+                self.due_times[str(account)] = due
+        return due.timestamp() - self.estimate(account)
+
+    def forget(self, account):
+        """
+        Удаляет срок запуска аккаунта, снятого с очереди, чтобы следующий
+        старт не получил ложное опоздание.
+        """
+        with self.lock:
+            self.due_times.pop(str(account), None)
+
+    def record_start(self, account, started=None):
+        """
+        Фиксирует старт запуска и опоздание относительно запланированного времени.
+        Неизвестный или устаревший (старше STALE_DUE_AGE) срок даёт нулевое опоздание.
+
+        :return: Опоздание в секундах.
+        """
+        started = started or datetime.now()
+        with self.lock:
+            due = self.due_times.pop(str(account), None)
+            if due is None:
+                return 0.0
+            lateness = max(0.0, (started - due).total_seconds())
+            if lateness > STALE_DUE_AGE:
+                logger.debug(
+                    f"#{account}: Due time {due} is stale. Lateness not recorded.")
+                return 0.0
+            self.lateness.append(lateness)
+        return lateness
+
+    def lateness_summary(self):
+        """
+        Возвращает (количество запусков, среднее, максимальное и суммарное опоздание) по окну.
+        """
+        with self.lock:
+            values = list(self.lateness)
+        if not values:
+            return 0, 0.0, 0.0, 0.0
+        total = sum(values)
+        return len(values), total / len(values), max(values), total
+
+
+class SlotAllocator:
+    """
+    Распределяет следующие запуски аккаунтов по слотам времени с учётом пропускной
+    способности: количество воркеров, умноженное на длительность слота и делённое
+    на среднюю длительность запуска. Каждый запуск остаётся в своём окне фарма.
+
+    :param workers: Количество воркеров, обрабатывающих очередь.
+    :param run_stats: Статистика запусков для оценки средней длительности.
+    """
+
+    def __init__(self, workers, run_stats, slot_seconds=SLOT_SECONDS):
+        self.workers = workers
+        self.run_stats = run_stats
+        self.slot_seconds = slot_seconds
+        self.lock = Lock()
+        self.load = {}          # номер слота -> количество запланированных запусков
+        self.reservations = {}  # аккаунт -> номер слота
+
+    def capacity(self):
+        """
+        Количество запусков, которое воркеры успевают выполнить за один слот.
+        """
+        return max(1.0, self.workers * self.slot_seconds / max(1.0, self.run_stats.fleet_duration))
+
+    def _slot(self, moment):
+        return int(moment.timestamp() // self.slot_seconds)
+
+    def _reserve(self, account, slot):
+        self._release(account)
+        self.load[slot] = self.load.get(slot, 0) + 1
+        self.reservations[account] = slot
+
+    def _release(self, account):
+        slot = self.reservations.pop(account, None)
+        if slot is not None:
+            self.load[slot] -= 1
+            if self.load[slot] <= 0:
+                del self.load[slot]
+
+    def allocate(self, account, earliest, latest):
+        """
+        Выбирает время запуска в окне [earliest, latest]: самый ранний слот
+        с запасом пропускной способности, иначе наименее загруженный.
+
+        :return: datetime следующего запуска.
+        """
+        with self.lock:
+            capacity = self.capacity()
+            first, last = self._slot(earliest), self._slot(latest)
+            candidates = range(first, last + 1)
+            free = [slot for slot in candidates
+                    if self.load.get(slot, 0) + 1 <= capacity]
+            slot = free[0] if free else min(
+                candidates, key=lambda slot: self.load.get(slot, 0))
+            self._reserve(account, slot)
+
+        # Случайное время внутри слота, не выходящее за границы окна
+        slot_start = datetime.fromtimestamp(slot * self.slot_seconds)
+        start = max(earliest, slot_start)
+        end = min(latest, slot_start + timedelta(seconds=self.slot_seconds))
+        offset = random.uniform(0, max(0.0, (end - start).total_seconds()))
+        return start + timedelta(seconds=offset)
+
+    def reserve(self, account, moment):
+        """
+        Учитывает уже запланированный запуск (например, восстановленный таймер).
+        """
+        with self.lock:
+            self._reserve(account, self._slot(moment))
+
+    def release(self, account):
+        """
+        Освобождает слот аккаунта при старте запуска.
+        """
+        with self.lock:
+            self._release(account)
+
+    def load_forecast(self, hours=12, group_slots=3):
+        """
+        Возвращает прогноз загрузки: (количество запусков по группам слотов
+        на ближайшие часы, пропускная способность группы).
+        """
+        with self.lock:
+            capacity = self.capacity() * group_slots
+            now_slot = self._slot(datetime.now())
+            groups = hours * 3600 // (self.slot_seconds * group_slots)
+            counts = [
+                sum(self.load.get(now_slot + group * group_slots + i, 0)
+                    for i in range(group_slots))
+                for group in range(groups)
+            ]
+        return counts, capacity
+
+    def load_curve(self, hours=12, group_slots=3):
+        """
+        Возвращает строку с прогнозом загрузки по группам слотов на ближайшие часы.
+        """
+        counts, capacity = self.load_forecast(hours, group_slots)
+        bars = "".join(
+            LOAD_CURVE_BARS[min(len(LOAD_CURVE_BARS) - 1,
+                                int(count / capacity * (len(LOAD_CURVE_BARS) - 1)))]
+            if count else " "
+            for count in counts
+        )
+        peak = max(counts) if counts else 0
+        minutes = self.slot_seconds * group_slots // 60
+        return (f"Projected load next {hours}h ({minutes} min slots, capacity {capacity:.1f}): "
+                f"[{bars}] peak {peak}, scheduled {sum(counts)}")
+
+
+class AdmissionController:
+    """
+    Постепенный допуск аккаунтов в очередь при старте и перезапуске цикла.
+    За каждый интервал допускается не больше rate аккаунтов, самые просроченные первыми.
+    Темп растёт на единицу при высокой доле успехов и быстром запуске профилей
+    и уменьшается вдвое при ошибках или медленном AdsPower.
+
+    :param admit: Функция (account, due), добавляющая аккаунт в очередь.
+    :param interval: Интервал допуска в секундах.
+    :param rate: Начальное количество аккаунтов за интервал.
+    :param max_rate: Максимальное количество аккаунтов за интервал.
+    """
+
+    def __init__(self, admit, interval, rate, max_rate):
+        self.admit = admit
+        self.interval = interval
+        self.max_rate = max(1, max_rate)
+        self.rate = max(1, min(rate, self.max_rate))
+        self.lock = Lock()
+        self.backlog = []     # куча (срок, номер, аккаунт)
+        self.pending = set()  # аккаунты в backlog
+        self.counter = itertools.count()
+        self.successes = 0
+        self.failures = 0
+        self.latencies = []
+        self.wakeup = Event()
+
+    def submit(self, account, due):
+        """
+        Ставит аккаунт в очередь на допуск. Повторная постановка игнорируется.
+        """
+        with self.lock:
+            if account in self.pending:
+                return False
+            self.pending.add(account)
+            heapq.heappush(self.backlog, (due.timestamp(),
+                           next(self.counter), account))
+            return True
+
+    def withdraw(self, account):
+        """
+        Убирает аккаунт из очереди на допуск.
+
+        :return: True, если аккаунт ожидал допуска.
+        """
+        with self.lock:
+            # Номер аккаунта может быть строкой или числом в зависимости от источника
+            matches = {item for item in self.pending if str(item) == str(account)}
+            if not matches:
+                return False
+            self.pending -= matches
+            self.backlog = [
+                item for item in self.backlog if item[2] not in matches]
+            heapq.heapify(self.backlog)
+            return True
+
+    def record_outcome(self, success):
+        with self.lock:
+            if success:
+                self.successes += 1
+            else:
+                self.failures += 1
+
+    def record_launch_latency(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def backlog_size(self):
+        with self.lock:
+            return len(self.backlog)
+
+    def wake(self):
+        """
+        Будит поток допуска после постановки аккаунтов в очередь.
+        Если прошлая партия была пустой, следующая допускается сразу, иначе по истечении интервала.
+        """
+        self.wakeup.set()
+
+    def _adapt(self):
+        """
+        Пересчитывает темп допуска по итогам прошедшего интервала.
+        """
+        total = self.successes + self.failures
+        latency = max(self.latencies) if self.latencies else 0.0
+        if total or self.latencies:
+            success_rate = self.successes / total if total else 1.0
+            if success_rate < ADMISSION_SUCCESS_TARGET or latency > ADMISSION_LATENCY_LIMIT:
+                self.rate = max(1, self.rate // 2)
+            elif total:
+                self.rate = min(self.max_rate, self.rate + 1)
+            logger.debug(
+                f"Admission: success rate {success_rate:.0%}, max launch latency {latency:.1f}s, "
+                f"rate {self.rate} per {self.interval}s.")
+        self.successes = self.failures = 0
+        self.latencies = []
+
+    def admit_batch(self):
+        """
+        Допускает очередную партию аккаунтов.
+
+        :return: Количество допущенных аккаунтов.
+        """
+        with self.lock:
+            self._adapt()
+            batch = []
+            while self.backlog and len(batch) < self.rate:
+                due, _, account = heapq.heappop(self.backlog)
+                self.pending.discard(account)
+                batch.append((account, datetime.fromtimestamp(due)))
+            remaining = len(self.backlog)
+
+        for account, due in batch:
+            self.admit(account, due)
+        if batch:
+            logger.info(
+                f"Admitted {len(batch)} account(s) to the queue, {remaining} waiting.")
+        return len(batch)
+
+    def start(self, stop_event):
+        """
+        Запускает поток допуска, работающий до установки stop_event.
+        """
+        def run():
+            while not stop_event.is_set():
+                self.wakeup.clear()
+                admitted = 0
+                try:
+                    admitted = self.admit_batch()
+                except Exception as e:
+                    logger.error(f"Error during account admission: {e}")
+                if admitted:
+                    stop_event.wait(self.interval)
+                    continue
+                # Пустая партия не расходует темп: ждём новых аккаунтов, не дожидаясь конца интервала
+                deadline = time.monotonic() + self.interval
+                while not stop_event.is_set() and not self.wakeup.is_set() and time.monotonic() < deadline:
+                    self.wakeup.wait(1)
+
+        Thread(target=run, daemon=True).start()
@@ -0,0 +1,278 @@
+import sys
+import shutil
+import bisect
+import logging
+from collections import Counter, deque
+from datetime import datetime
+from threading import Lock, Thread
+from colorama import Fore, Style
+from utils import get_color, supports_ansi, StripAnsiFormatter
+
+# Настройка логирования
+logger = logging.getLogger("application_logger")
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+NOT_SCHEDULED = "N/A"
+EXCLUDED_FROM_TOTAL = ("ERROR", "QUARANTINED")  # Статусы, баланс которых не входит в итог
+LIVE_REFRESH_INTERVAL = 1  # Интервал обновления экрана, сек
+LIVE_LOG_LINES = 8  # Количество последних сообщений лога под таблицей
+
+STATUS_COLORS = {
+    "ERROR": Fore.RED,
+    "QUARANTINED": Fore.RED,
+    "Deferred": Fore.YELLOW,
+    "Kept alive": Fore.GREEN,
+}
+
+
+def format_balance(balance):
+    return str(int(balance)) if balance == int(balance) else str(round(balance, 2))
+
+
+def _balance_contribution(details):
+    if details.get("status") in EXCLUDED_FROM_TOTAL:
+        return 0.0
+    return details.get("balance") or 0.0
+
+
+def _sort_key(details):
+    # Время в формате TIME_FORMAT упорядочивается как строка, разбор не нужен.
+    # Аккаунты без расписания идут последними
+    next_schedule = details.get("next_schedule") or NOT_SCHEDULED
+    return (1, "") if next_schedule == NOT_SCHEDULED else (0, next_schedule)
+
+
+class StatusModel:
+    """
+    Состояние аккаунтов для вывода, обновляемое по изменениям.
+
+    Хранит индекс аккаунтов, отсортированный по времени следующего запуска,
+    итоговый баланс и количество аккаунтов по статусам. Обновление аккаунта
+    занимает O(log n) на поиск в индексе вместо пересортировки всех аккаунтов.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.rows = {}  # аккаунт -> данные (username, balance, next_schedule, status, ...)
+        self.index = []  # отсортированный список (ключ сортировки, аккаунт)
+        self.total_balance = 0.0
+        self.status_counts = Counter()
+        self.version = 0  # Увеличивается при каждом изменении
+
+    def update(self, account, details):
+        """
+        Обновляет данные аккаунта.
+
+        :return: True, если данные изменились.
+        """
+        account = str(account)
+        details = dict(details)
+        with self.lock:
+            previous = self.rows.get(account)
+            if previous == details:
+                return False
+            if previous is not None:
+                position = bisect.bisect_left(
+                    self.index, (_sort_key(previous), account))
+                del self.index[position]
+                self.total_balance -= _balance_contribution(previous)
+                self.status_counts[previous.get("status")] -= 1
+            bisect.insort(self.index, (_sort_key(details), account))
+            self.total_balance += _balance_contribution(details)
+            self.status_counts[details.get("status")] += 1
+            self.rows[account] = details
+            self.version += 1
+            return True
+
+    def rows_in_order(self, limit=None):
+        """
+        Возвращает список (аккаунт, данные) по времени следующего запуска.
+
+        :param limit: Максимальное количество строк.
+        """
+        with self.lock:
+            return [(account, self.rows[account]) for _, account in self.index[:limit]]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.rows)
+
+    def next_run(self):
+        """
+        Возвращает ближайший предстоящий запуск (аккаунт, время) или None.
+        """
+        now = datetime.now().strftime(TIME_FORMAT)
+        with self.lock:
+            position = bisect.bisect_left(self.index, ((0, now), ""))
+            if position < len(self.index) and self.index[position][0][0] == 0:
+                key, account = self.index[position]
+                return account, key[1]
+        return None
+
+    def summary(self):
+        """
+        Возвращает сводку в одну строку для лога.
+        """
+        with self.lock:
+            accounts = len(self.rows)
+            counts = ", ".join(
+                f"{status} {count}" for status, count in sorted(self.status_counts.items()) if count)
+            total = self.total_balance
+        line = f"Accounts: {accounts} ({counts or 'none'}) | Total Balance: {format_balance(round(total, 2))}"
+        next_run = self.next_run()
+        if next_run:
+            line += f" | Next: #{next_run[0]} at {next_run[1]}"
+        return line
+
+
+class _LogPane(logging.Handler):
+    """
+    Обработчик, сохраняющий последние сообщения лога для показа под таблицей.
+    """
+
+    def __init__(self, lines):
+        super().__init__()
+        self.lines = deque(maxlen=lines)
+        # Цвета сообщений убираются, чтобы обрезка по ширине не ломала escape-коды
+        self.setFormatter(StripAnsiFormatter("%(asctime)s - %(levelname)s - %(message)s"))
+
+    def emit(self, record):
+        try:
+            self.lines.append(self.format(record).splitlines()[0])
+        except Exception:
+            self.handleError(record)
+
+
+class LiveStatusView:
+    """
+    Обновляемая таблица аккаунтов в терминале.
+
+    Экран перерисовывается построчно: выводятся только строки, отличающиеся
+    от показанных в прошлый раз. Пока таблица на экране, вывод лога в консоль
+    заменяется панелью последних сообщений под таблицей.
+
+    :param model: StatusModel.
+    :param stream: Поток вывода (терминал).
+    """
+
+    HEADER = f"{'ID':>8}  {'Username':<20}  {'Balance':>12}  {'Next Scheduled Time':<19}  {'Status':<12}  {'Deferred':>8}"
+
+    def __init__(self, model, stream=None, interval=LIVE_REFRESH_INTERVAL, log_lines=LIVE_LOG_LINES):
+        self.model = model
+        self.stream = stream or sys.stdout
+        self.interval = interval
+        self.log_lines = log_lines
+        self.screen = []  # Строки, показанные на экране
+        self.size = None
+        self.shown_version = None
+        self.shown_log = None
+        self.log_pane = None
+        self.muted_handlers = []
+        self.lock = Lock()
+
+    @staticmethod
+    def is_supported(stream=None):
+        stream = stream or sys.stdout
+        return stream.isatty() and supports_ansi()
+
+    def _format_row(self, account, details, width):
+        line = (
+            f"{account:>8}  {str(details.get('username', 'N/A'))[:20]:<20}  "
+            f"{format_balance(details.get('balance') or 0.0):>12}  "
+            f"{details.get('next_schedule') or NOT_SCHEDULED:<19}  "
+            f"{str(details.get('status'))[:12]:<12}  {details.get('deferrals', 0):>8}"
+        )[:width]
+        color = get_color(STATUS_COLORS.get(details.get("status"), Fore.CYAN))
+        return f"{color}{line}{get_color(Style.RESET_ALL)}"
+
+    def _build(self, width, height):
+        log = list(self.log_pane.lines) if self.log_pane else []
+        table_height = max(1, height - 3 - len(log) - (1 if log else 0))
+        visible = self.model.rows_in_order(table_height)
+        lines = [self.HEADER[:width], "-" * min(width, len(self.HEADER))]
+        lines.extend(self._format_row(account, details, width)
+                     for account, details in visible)
+        lines.extend([""] * (table_height - len(visible)))
+        hidden = len(self.model) - len(visible)
+        summary = self.model.summary() + (f" | {hidden} more" if hidden > 0 else "")
+        lines.append(f"{get_color(Fore.MAGENTA)}{summary[:width]}{get_color(Style.RESET_ALL)}")
+        if log:
+            lines.append("-" * width)
+            lines.extend(line[:width] for line in log)
+        return lines[:height]
+
+    def refresh(self):
+        """
+        Перерисовывает изменившиеся строки экрана.
+        """
+        size = shutil.get_terminal_size()
+        log_state = tuple(self.log_pane.lines) if self.log_pane else ()
+        if size == self.size and self.model.version == self.shown_version and log_state == self.shown_log:
+            return
+        self.shown_version = self.model.version
+        self.shown_log = log_state
+        output = []
+        if size != self.size:
+            # Размер терминала изменился: экран перерисовывается полностью
+            self.size = size
+            self.screen = []
+            output.append("\x1b[2J")
+        lines = self._build(size.columns, size.lines)
+        for number, line in enumerate(lines):
+            if number < len(self.screen) and self.screen[number] == line:
+                continue
+            output.append(f"\x1b[{number + 1};1H{line}\x1b[K")
+        for number in range(len(lines), len(self.screen)):
+            output.append(f"\x1b[{number + 1};1H\x1b[K")
+        self.screen = lines
+        if output:
+            self.stream.write("".join(output))
+            self.stream.flush()
+
+    def _attach_log(self):
+        for handler in logger.handlers:
+            if isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler):
+                self.muted_handlers.append((handler, handler.level))
+                handler.setLevel(logging.CRITICAL + 1)
+        self.log_pane = _LogPane(self.log_lines)
+        self.log_pane.setLevel(logger.level)
+        logger.addHandler(self.log_pane)
+
+    def _detach_log(self):
+        if self.log_pane:
+            logger.removeHandler(self.log_pane)
+            self.log_pane = None
+        for handler, level in self.muted_handlers:
+            handler.setLevel(level)
+        self.muted_handlers = []
+
+    def start(self, stop_event):
+        """
+        Показывает таблицу в альтернативном буфере терминала до установки stop_event.
+        """
+        self.stream.write("\x1b[?1049h\x1b[?25l")  # Альтернативный буфер, курсор скрыт
+        self.stream.flush()
+        self._attach_log()
+
+        def run():
+            while not stop_event.is_set():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.debug(f"Failed to refresh live status view: {e}")
+                stop_event.wait(self.interval)
+            self.stop()
+
+        Thread(target=run, daemon=True).start()
+        return self
+
+    def stop(self):
+        """
+        Возвращает обычный вывод терминала и лога.
+        """
+        with self.lock:
+            if self.log_pane is None:
+                return
+            self._detach_log()
+            self.stream.write("\x1b[?25h\x1b[?1049l")
+            self.stream.flush()
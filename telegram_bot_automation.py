@@ -1,20 +1,127 @@
 import re
 import random
-import time
 import json
 import os
 from datetime import datetime
+from threading import Lock
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import NoSuchElementException, WebDriverException, TimeoutException, StaleElementReferenceException
-from utils import get_max_games, stop_event
+from utils import get_max_games, get_int_setting, stop_event, file_lock
 from urllib.parse import unquote, parse_qs
 from browser_manager import BrowserManager
+from errors import ProfileBusyError, AdsPowerError, IframeValidationError, AuthError
+from page_jobs import build_job_script, run_page_job
+from driver_profiler import DriverProfiler, is_profiling_enabled
 from colorama import Fore, Style
 import logging
 # Настроим логирование (если не было настроено ранее)
 logger = logging.getLogger("application_logger")
+# Файл кликов общий для всех воркеров
+click_data_lock = Lock()
+
+DAILY_CLICK_LIMIT = 10  # Лимит кликов квеста 'Ёлки-иголки!' в сутки
+DAILY_CLICKS_FILE = "daily_clicks.json"  # Клики квеста по аккаунтам за текущие сутки
+QUEST_MAX_ATTEMPTS = 15  # Максимум попыток открыть квест за один запуск
+MAX_STARS_PER_RUN = 50  # Ограничение количества звёзд за один запуск
+
+# Тело фоновой задачи квеста 'Ёлки-иголки!' (см. page_jobs): выполняет оставшиеся клики
+# с паузой между ними. Аргументы: {remaining, maxAttempts, delayMin, delayMax} (паузы в мс).
+# Прогресс: {clicks, attempts, misses}, где misses — причины неудачных попыток.
+NEEDLES_QUEST_JOB_JS = build_job_script(r"""
+    const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+    async function waitFor(find, timeout) {
+        const deadline = Date.now() + timeout;
+        while (Date.now() < deadline) {
+            const element = find();
+            if (element) return element;
+            await sleep(200);
+        }
+        return null;
+    }
+
+    function press(element) {
+        const rect = element.getBoundingClientRect();
+        const opts = {
+            bubbles: true, cancelable: true,
+            clientX: rect.left + rect.width / 2, clientY: rect.top + rect.height / 2
+        };
+        element.dispatchEvent(new MouseEvent("mousedown", opts));
+        element.dispatchEvent(new MouseEvent("mouseup", opts));
+        element.dispatchEvent(new MouseEvent("click", opts));
+    }
+
+    const findTopLeft = () => document.querySelector("div#ui-top-left a.ui-link.blur");
+    const findNeedles = () => Array.from(document.querySelectorAll("a")).find((a) =>
+        a.textContent.includes("Ёлки-иголки!") || a.textContent.includes("Collect needles"));
+
+    // Одна запись на каждую попытку: номер, исход и время
+    let clicks = job.progress.clicks || 0;
+    let attempts = job.progress.attempts || 0;
+    const results = job.progress.results || [];
+    const record = (outcome) => {
+        results.push({ attempt: attempts, outcome: outcome, at: Date.now() });
+        job.report({ clicks, attempts, results });
+    };
+    while (attempts < args.maxAttempts && clicks < args.remaining) {
+        if (job.cancel) return job.finish("cancelled", { clicks, attempts, results });
+        attempts++;
+        const topLeft = await waitFor(findTopLeft, 2000);
+        if (!topLeft) {
+            record("top_left_missing");
+            await sleep(1000);
+            continue;
+        }
+        press(topLeft);
+        const needles = await waitFor(findNeedles, 4000);
+        if (!needles) {
+            record("needles_missing");
+            continue;
+        }
+        press(needles);
+        clicks++;
+        record("clicked");
+        await sleep(args.delayMin + Math.random() * (args.delayMax - args.delayMin));
+    }
+    job.finish("done", { clicks, attempts, results });
+""")
+
+
+def read_click_data(path=DAILY_CLICKS_FILE):
+    """
+    Читает файл кликов квеста. Вызывающий должен держать click_data_lock и file_lock.
+    """
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as file:
+                data = json.load(file)
+
+            # Убедимся, что ключи уникальны
+            unique_data = {}
+            for key, value in data.items():
+                unique_data[str(key)] = value
+            logger.debug(f"Loaded click data: {unique_data}")
+            return unique_data
+        except Exception as e:
+            logger.error(
+                f"Failed to load click data: {str(e)}. Resetting data.")
+            return {}
+    logger.debug("Click data file not found. Returning empty data.")
+    return {}
+
+
+def remaining_quest_clicks(serial_number, path=DAILY_CLICKS_FILE):
+    """
+    Возвращает количество кликов квеста, оставшихся аккаунту на сегодня.
+    Не требует браузера, поэтому лимит проверяется до открытия сессии квестов.
+    """
+    with click_data_lock, file_lock(path):
+        data = read_click_data(path).get(str(serial_number))
+    if not data or data.get("date") != datetime.now().strftime("%Y-%m-%d"):
+        return DAILY_CLICK_LIMIT
+    return max(0, DAILY_CLICK_LIMIT - data.get("clicks", 0))
 
 
 class TelegramBotAutomation:
@@ -22,8 +129,9 @@ class TelegramBotAutomation:
 
     def __init__(self, serial_number, settings):
         # max_games сохраняем в атрибут объекта
-        self.daily_clicks_file = "daily_clicks.json"
+        self.daily_clicks_file = DAILY_CLICKS_FILE
         self.daily_click_data = {}
+        self.last_quest_results = []  # Попытки последнего запуска квеста: attempt, outcome, at
         self.max_games = get_max_games(settings)
         self.remaining_games = None
         self.serial_number = serial_number
@@ -38,19 +146,23 @@ class TelegramBotAutomation:
         logger.debug(
             f"#{self.serial_number}: Initializing automation for account.")
 
-        # Ожидание завершения предыдущей сессии браузера
-        if not self.browser_manager.wait_browser_close():
-            logger.error(
-                f"#{self.serial_number}: Failed to close previous browser session.")
-            raise RuntimeError("Failed to close previous browser session")
+        # Профиль, открытый вне скрипта, не ждём: аккаунт будет отложен
+        if self.browser_manager.is_busy():
+            logger.info(
+                f"#{self.serial_number}: Profile is open outside the script.")
+            raise ProfileBusyError(
+                f"Profile {self.serial_number} is busy")
 
         # Запуск браузера
         if not self.browser_manager.start_browser():
             logger.error(f"#{self.serial_number}: Failed to start browser.")
-            raise RuntimeError("Failed to start browser")
+            raise AdsPowerError("Failed to start browser")
 
         # Сохранение экземпляра драйвера
         self.driver = self.browser_manager.driver
+        if is_profiling_enabled(settings):
+            self.browser_manager.profiler = DriverProfiler(
+                serial_number, self.driver)
 
         logger.debug(
             f"#{self.serial_number}: Automation initialization completed successfully.")
@@ -342,7 +454,7 @@ class TelegramBotAutomation:
                             else:
                                 logger.warning(
                                     f"#{self.serial_number}: Iframe did not load expected content.")
-                                raise Exception(
+                                raise IframeValidationError(
                                     "Iframe content validation failed.")
 
                     # Если нужная ссылка не найдена, прокручиваемся к первому элементу
@@ -381,6 +493,8 @@ class TelegramBotAutomation:
                     f"#{self.serial_number}: Failed to click link or interact with elements (attempt {retries + 1}): {str(e).splitlines()[0]}")
                 retries += 1
                 stop_event.wait(5)
+            except IframeValidationError:
+                raise
             except Exception as e:
                 logger.error(
                     f"#{self.serial_number}: Unexpected error during click_link: {str(e).splitlines()[0]}")
@@ -546,6 +660,9 @@ class TelegramBotAutomation:
     def get_username(self):
         """
         Извлечение имени пользователя из sessionStorage.
+        Возвращает None, если данные ещё не доступны (страница не загрузилась).
+
+        :raises AuthError: Приложение получило параметры запуска без данных пользователя.
         """
         if stop_event.is_set():
             logger.debug(
@@ -570,7 +687,8 @@ class TelegramBotAutomation:
             # Получаем tgWebAppData
             tg_web_app_data = init_data.get("tgWebAppData")
             if not tg_web_app_data:
-                raise Exception("tgWebAppData not found in InitParams.")
+                # Telegram запустил приложение без initData: сессия недействительна
+                raise AuthError("tgWebAppData not found in InitParams.")
 
             # Декодируем tgWebAppData
             decoded_data = unquote(tg_web_app_data)
@@ -585,7 +703,7 @@ class TelegramBotAutomation:
             # Извлекаем параметр 'user' и преобразуем в JSON
             user_data = parsed_data.get("user", [None])[0]
             if not user_data:
-                raise Exception("User data not found in tgWebAppData.")
+                raise AuthError("User data not found in tgWebAppData.")
 
             # Парсим JSON и извлекаем username
             user_info = json.loads(user_data)
@@ -595,6 +713,8 @@ class TelegramBotAutomation:
 
             return username
 
+        except AuthError:
+            raise
         except Exception as e:
             # Логируем ошибку без громоздкого Stacktrace
             error_message = str(e).splitlines()[0]
@@ -661,18 +781,19 @@ class TelegramBotAutomation:
                 f"#{self.serial_number}: Error retrieving balance: {str(e)}")
             return 0
 
-    def get_time(self):
+    def get_progress(self):
         """
-        Получает оставшееся время до завершения прогресса на основе универсального поиска элемента.
-        Если прогресс завершен, возвращает '00:00:00'.
+        Получает процент заполнения прогресса на основе универсального поиска элемента.
+        Если прогресс завершен, возвращает 100.
+
+        :return: Процент (0-100) или None, если прогресс не найден.
         """
         retries = 0
-        total_time_seconds = 3600  # 1 час = 3600 секунд
 
         while retries < self.MAX_RETRIES:
             if stop_event.is_set():
                 logger.debug(
-                    f"#{self.serial_number}: Stop event detected. Exiting get_time.")
+                    f"#{self.serial_number}: Stop event detected. Exiting get_progress.")
                 return None
 
             try:
@@ -692,7 +813,7 @@ class TelegramBotAutomation:
 
                     # Если текст содержит статус завершения
                     if "Собрать пыль" in block_text:
-                        return "00:00:00"  # Прогресс завершен
+                        return 100  # Прогресс завершен
 
                     # Поиск процентов внутри дочерних элементов
                     span_elements = block.find_elements(
@@ -709,20 +830,7 @@ class TelegramBotAutomation:
                             progress_percentage = int(match.group(1))
                             logger.debug(
                                 f"#{self.serial_number}: Current progress percentage: {progress_percentage}%")
-
-                            # Расчет оставшегося времени
-                            remaining_seconds = total_time_seconds * \
-                                (1 - progress_percentage / 100)
-
-                            # Форматирование времени в HH:MM:SS
-                            hours = int(remaining_seconds // 3600)
-                            minutes = int((remaining_seconds % 3600) // 60)
-                            seconds = int(remaining_seconds % 60)
-                            formatted_time = f"{hours:02}:{minutes:02}:{seconds:02}"
-
-                            logger.debug(
-                                f"#{self.serial_number}: Remaining time: {formatted_time}")
-                            return formatted_time
+                            return progress_percentage
 
                 logger.debug(
                     f"#{self.serial_number}: No valid progress or completion blocks found.")
@@ -737,27 +845,52 @@ class TelegramBotAutomation:
 
             except Exception as e:
                 logger.error(
-                    f"#{self.serial_number}: Unexpected error in get_time: {e}")
+                    f"#{self.serial_number}: Unexpected error in get_progress: {e}")
                 return None
 
         logger.debug(
             f"#{self.serial_number}: Failed to retrieve progress after {self.MAX_RETRIES} retries.")
         return None
 
+    def get_time(self, total_time_seconds=3600):
+        """
+        Получает оставшееся время до завершения прогресса.
+        Если прогресс завершен, возвращает '00:00:00'.
+
+        :param total_time_seconds: Время полного заполнения прогресса в секундах.
+        """
+        progress_percentage = self.get_progress()
+        if progress_percentage is None:
+            return None
+
+        # Расчет оставшегося времени
+        remaining_seconds = total_time_seconds * \
+            (1 - progress_percentage / 100)
+
+        # Форматирование времени в HH:MM:SS
+        hours = int(remaining_seconds // 3600)
+        minutes = int((remaining_seconds % 3600) // 60)
+        seconds = int(remaining_seconds % 60)
+        formatted_time = f"{hours:02}:{minutes:02}:{seconds:02}"
+
+        logger.debug(
+            f"#{self.serial_number}: Remaining time: {formatted_time}")
+        return formatted_time
+
     def farming(self):
         """
         Функция автоматизации сбора пыли и создания звезд.
         """
         try:
-            # Получаем оставшееся время
+            # Сбор доступен с 90% независимо от скорости заполнения аккаунта
             logger.debug(f"#{self.serial_number}: Checking progress status.")
-            remaining_time = self.get_time()
+            progress_percentage = self.get_progress()
 
-            if remaining_time is None:
+            if progress_percentage is None:
                 logger.debug(
-                    f"#{self.serial_number}: Remaining time is None, skipping check.")
+                    f"#{self.serial_number}: Progress is None, skipping check.")
             else:
-                if remaining_time == "00:00:00" or int(remaining_time.split(":")[1]) <= 6:
+                if progress_percentage >= 90:
                     logger.info(
                         f"#{self.serial_number}: Progress >= 90% or completed. Attempting to collect dust.")
 
@@ -810,103 +943,200 @@ class TelegramBotAutomation:
 
     def create_stars(self):
         """
-        Процесс создания звезд с повторным открытием окна и проверкой баланса.
+        Процесс создания звезд: звёзды создаются подряд, пока хватает пыли.
+        Окно создания открывается повторно без выхода из игры, если закрылось после создания.
+        Звезда засчитывается, только если после клика баланс пыли уменьшился; процесс
+        останавливается при первом неподтверждённом клике, нехватке пыли, бонусе или
+        изменении цены.
+
+        :return: Словарь {"created": количество созданных звёзд, "spent": потраченная пыль}.
         """
+        created = 0
+        spent = 0
+        price = None
+        failures = 0
         try:
             logger.info(
                 f"#{self.serial_number}: Starting 'Create Stars' process.")
-            for attempt in range(5):  # Максимум 5 попыток
-                try:
-                    # Открытие окна создания звезд
-                    create_stars_button = WebDriverWait(self.driver, 10).until(
-                        EC.element_to_be_clickable(
-                            (By.CSS_SELECTOR, "div#ui-bottom a.ui-link.blur svg + span"))
-                    )
-                    create_stars_button.click()
-
-                    # Проверяем стоимость
-                    price_block = WebDriverWait(self.driver, 10).until(
-                        EC.presence_of_element_located(
-                            (By.CSS_SELECTOR, "label.details.d-flex.justify-content-between"))
-                    )
-
-                    # Извлечение основного баланса
-                    main_balance_element = price_block.find_element(
-                        By.XPATH, ".//span[1]"
-                    )
-                    main_balance_text = main_balance_element.text.strip()
-                    main_balance = int(main_balance_text.replace(
-                        ",", "")) if main_balance_text.replace(",", "").isdigit() else 0
-
-                    # Извлечение дополнительного баланса
-                    additional_balance_element = price_block.find_elements(
-                        By.XPATH, ".//span[contains(text(), '+')]/following-sibling::span[1]"
-                    )
-                    additional_balance = int(additional_balance_element[0].text.strip().replace(
-                        ",", "")) if additional_balance_element else 0
-
+            dust = self.read_dust_balance()
+            while created < MAX_STARS_PER_RUN and failures < 5:  # Максимум 5 неудачных попыток
+                if stop_event.is_set():
                     logger.debug(
-                        f"#{self.serial_number}: Extracted balances - Main: {main_balance}, Additional: {additional_balance}"
-                    )
+                        f"#{self.serial_number}: Stop event detected. Exiting 'Create Stars' process.")
+                    break
+                try:
+                    price_block = self.open_stars_window()
+                    main_balance, additional_balance = self.read_star_price(
+                        price_block)
 
                     # Логика проверки
+                    stop_reason = None
                     if main_balance == 0:
+                        stop_reason = "main balance being 0"
+                    elif additional_balance > 0:
+                        stop_reason = f"additional balance ({additional_balance})"
+                    elif price is not None and main_balance != price:
+                        stop_reason = f"price change ({price} -> {main_balance})"
+                    elif dust is None:
+                        stop_reason = "dust balance being unavailable"
+                    elif dust < main_balance:
+                        stop_reason = f"dust balance ({dust}) below price ({main_balance})"
+                    if stop_reason:
                         logger.info(
-                            f"#{self.serial_number}: 'Create Stars' process stopped due to main balance being 0."
-                        )
-                        # Закрываем окно
-                        close_button = WebDriverWait(self.driver, 10).until(
-                            EC.element_to_be_clickable(
-                                (By.CSS_SELECTOR, "div.content-footer a.ui-link.blur.close"))
+                            f"#{self.serial_number}: 'Create Stars' process stopped due to {stop_reason}."
                         )
-                        close_button.click()
-                        break
-
-                    if additional_balance > 0:
-                        logger.info(
-                            f"#{self.serial_number}: 'Create Stars' process stopped due to additional balance ({additional_balance})."
-                        )
-                        # Закрываем окно
-                        close_button = WebDriverWait(self.driver, 10).until(
-                            EC.element_to_be_clickable(
-                                (By.CSS_SELECTOR, "div.content-footer a.ui-link.blur.close"))
-                        )
-                        close_button.click()
+                        self.close_stars_window()
                         break
 
                     # Если основная логика пройдена, создаем звезды
+                    price = main_balance
                     create_button = WebDriverWait(self.driver, 10).until(
                         EC.element_to_be_clickable(
                             (By.CSS_SELECTOR, "div.content-body .buttons-row button.ui-button"))
                     )
                     create_button.click()
 
-                    # Ожидание закрытия окна
-                    WebDriverWait(self.driver, 10).until(
-                        EC.invisibility_of_element(
-                            (By.CSS_SELECTOR, "div.content-body"))
-                    )
-                    logger.info(
-                        f"#{self.serial_number}: Stars created successfully.")
-                    break
+                    # Ожидание закрытия или обновления окна
+                    try:
+                        WebDriverWait(self.driver, 10).until(
+                            EC.staleness_of(price_block))
+                    except TimeoutException:
+                        logger.debug(
+                            f"#{self.serial_number}: Stars window did not update after creation.")
+
+                    # Звезда засчитывается только после уменьшения баланса пыли
+                    balance_after = self.wait_dust_decrease(dust)
+                    if balance_after is None:
+                        logger.info(
+                            f"#{self.serial_number}: Star creation not confirmed by dust balance ({dust}). "
+                            f"'Create Stars' process stopped.")
+                        break
+                    created += 1
+                    spent += dust - balance_after
+                    logger.debug(
+                        f"#{self.serial_number}: Star created for {dust - balance_after} dust "
+                        f"(dust balance: {dust} -> {balance_after}).")
+                    dust = balance_after
                 except TimeoutException:
+                    failures += 1
                     logger.debug(
                         f"#{self.serial_number}: Timeout during 'Create Stars' process. Retrying..."
                     )
                 except Exception as e:
+                    failures += 1
                     logger.debug(
                         f"#{self.serial_number}: Unexpected issue during 'Create Stars' process: {str(e)}. Retrying..."
                     )
-                finally:
-                    if attempt == 4:
-                        logger.info(
-                            f"#{self.serial_number}: Reached maximum attempts for 'Create Stars' process."
-                        )
+            if failures >= 5:
+                logger.info(
+                    f"#{self.serial_number}: Reached maximum attempts for 'Create Stars' process."
+                )
         except Exception as e:
             logger.error(
                 f"#{self.serial_number}: Error in 'Create Stars' process: {str(e)}", exc_info=False
             )
 
+        if created:
+            logger.info(
+                f"#{self.serial_number}: Stars created: {created}, dust spent: {spent}.")
+        return {"created": created, "spent": spent}
+
+    def read_dust_balance(self):
+        """
+        Читает баланс пыли с кнопки создания звезд.
+
+        :return: Баланс пыли или None, если его не удалось прочитать.
+        """
+        try:
+            element = self.driver.find_element(
+                By.CSS_SELECTOR, "div#ui-bottom a.ui-link.blur svg + span")
+            # textContent доступен, даже когда кнопку перекрывает окно создания
+            text = (element.get_attribute("textContent") or "").strip().replace(",", "")
+            return int(text) if text.isdigit() else None
+        except Exception as e:
+            logger.debug(
+                f"#{self.serial_number}: Failed to read dust balance: {str(e)}")
+            return None
+
+    def wait_dust_decrease(self, balance_before, timeout=5):
+        """
+        Ждёт уменьшения баланса пыли после создания звезды.
+
+        :return: Новый баланс или None, если баланс не уменьшился за timeout секунд.
+        """
+        try:
+            # Баланс возвращается в кортеже: нулевой баланс WebDriverWait счёл бы неудачей
+            return WebDriverWait(self.driver, timeout).until(
+                lambda driver: self._decreased_dust_balance(balance_before))[0]
+        except TimeoutException:
+            return None
+
+    def _decreased_dust_balance(self, balance_before):
+        balance = self.read_dust_balance()
+        if balance is not None and balance < balance_before:
+            return (balance,)
+        return False
+
+    def open_stars_window(self):
+        """
+        Открывает окно создания звезд, если оно ещё не открыто.
+
+        :return: Блок с ценой звезды.
+        """
+        price_locator = (
+            By.CSS_SELECTOR, "label.details.d-flex.justify-content-between")
+        opened = [block for block in self.driver.find_elements(
+            *price_locator) if block.is_displayed()]
+        if opened:
+            return opened[0]
+
+        # Открытие окна создания звезд
+        create_stars_button = WebDriverWait(self.driver, 10).until(
+            EC.element_to_be_clickable(
+                (By.CSS_SELECTOR, "div#ui-bottom a.ui-link.blur svg + span"))
+        )
+        create_stars_button.click()
+
+        # Проверяем стоимость
+        return WebDriverWait(self.driver, 10).until(
+            EC.presence_of_element_located(price_locator))
+
+    def read_star_price(self, price_block):
+        """
+        Читает основной и дополнительный (бонусный) баланс из окна создания звезд.
+
+        :return: Кортеж (основной баланс, дополнительный баланс).
+        """
+        # Извлечение основного баланса
+        main_balance_element = price_block.find_element(
+            By.XPATH, ".//span[1]"
+        )
+        main_balance_text = main_balance_element.text.strip()
+        main_balance = int(main_balance_text.replace(
+            ",", "")) if main_balance_text.replace(",", "").isdigit() else 0
+
+        # Извлечение дополнительного баланса
+        additional_balance_element = price_block.find_elements(
+            By.XPATH, ".//span[contains(text(), '+')]/following-sibling::span[1]"
+        )
+        additional_balance = int(additional_balance_element[0].text.strip().replace(
+            ",", "")) if additional_balance_element else 0
+
+        logger.debug(
+            f"#{self.serial_number}: Extracted balances - Main: {main_balance}, Additional: {additional_balance}"
+        )
+        return main_balance, additional_balance
+
+    def close_stars_window(self):
+        """
+        Закрывает окно создания звезд.
+        """
+        close_button = WebDriverWait(self.driver, 10).until(
+            EC.element_to_be_clickable(
+                (By.CSS_SELECTOR, "div.content-footer a.ui-link.blur.close"))
+        )
+        close_button.click()
+
     def switch_to_iframe(self):
         """
         Switches to the first iframe on the page, if available.
@@ -947,28 +1177,14 @@ class TelegramBotAutomation:
         """
         Загружает данные из JSON-файла или создает пустую структуру, если файл отсутствует.
         """
-        if os.path.exists(self.daily_clicks_file):
-            try:
-                with open(self.daily_clicks_file, "r") as file:
-                    data = json.load(file)
-
-                # Убедимся, что ключи уникальны
-                unique_data = {}
-                for key, value in data.items():
-                    unique_data[str(key)] = value
-                logger.debug(f"Loaded click data: {unique_data}")
-                return unique_data
-            except Exception as e:
-                logger.error(
-                    f"Failed to load click data: {str(e)}. Resetting data.")
-                return {}
-        logger.debug("Click data file not found. Returning empty data.")
-        return {}
+        with click_data_lock, file_lock(self.daily_clicks_file):
+            return read_click_data(self.daily_clicks_file)
 
-    def update_click_data(self, serial_number, current_date, increment_click=False):
+    def update_click_data(self, serial_number, current_date, increment_click=False, clicks=0):
         """
         Обновляет данные кликов для заданного серийного номера и текущей даты.
-        Если increment_click=True, увеличивает количество кликов.
+        Если increment_click=True, увеличивает количество кликов на 1,
+        clicks — на указанное количество.
         """
         serial_number = str(serial_number)  # Убедимся, что ключ всегда строка
         logger.debug(
@@ -990,7 +1206,9 @@ class TelegramBotAutomation:
                 f"Date changed. Reset clicks for serial_number={serial_number}.")
 
         if increment_click:
-            self.daily_click_data[serial_number]["clicks"] += 1
+            clicks += 1
+        if clicks:
+            self.daily_click_data[serial_number]["clicks"] += clicks
             logger.debug(
                 f"Incremented clicks for serial_number={serial_number}. Current clicks: {self.daily_click_data[serial_number]['clicks']}")
 
@@ -1002,13 +1220,15 @@ class TelegramBotAutomation:
         Сохраняет данные в JSON-файл.
         """
         try:
-            # Гарантируем уникальность данных перед сохранением
-            unique_data = {}
-            for key, value in self.daily_click_data.items():
-                unique_data[str(key)] = value
-
-            with open(self.daily_clicks_file, "w") as file:
-                json.dump(unique_data, file, indent=4)
+            with click_data_lock, file_lock(self.daily_clicks_file):
+                # Объединяем с данными других аккаунтов, сохранёнными другими воркерами
+                unique_data = read_click_data(self.daily_clicks_file)
+                serial_number = str(self.serial_number)
+                if serial_number in self.daily_click_data:
+                    unique_data[serial_number] = self.daily_click_data[serial_number]
+
+                with open(self.daily_clicks_file, "w") as file:
+                    json.dump(unique_data, file, indent=4)
             logger.debug(f"Saved click data: {unique_data}")
         except Exception as e:
             logger.error(f"Failed to save click data: {str(e)}")
@@ -1023,9 +1243,15 @@ class TelegramBotAutomation:
         }
         self.save_click_data()
 
-    def create_quests(self):
+    def create_quests(self, should_yield=None):
         """
-        Выполняет процесс нажатия кнопок для создания квестов с учетом ограничения в 10 кликов в сутки.
+        Выполняет квест 'Ёлки-иголки!' с учетом ограничения в 10 кликов в сутки.
+        Все оставшиеся клики выполняет фоновая задача на странице (см. page_jobs),
+        пауза между кликами задаётся настройками QUEST_CLICK_DELAY_MIN/MAX (мс).
+        Количество кликов сохраняется один раз по завершении или прерывании.
+
+        :param should_yield: Функция без аргументов; True — прервать квест, уступив место фарму.
+        :return: False, если квест отложен или прерван, иначе True.
         """
         try:
             logger.info(
@@ -1041,274 +1267,74 @@ class TelegramBotAutomation:
             self.update_click_data(serial_number_str, current_date)
 
             # Проверка лимита кликов
-            if self.daily_click_data.get(serial_number_str, {}).get("clicks", 0) >= 10:
+            remaining = DAILY_CLICK_LIMIT - \
+                self.daily_click_data[serial_number_str]["clicks"]
+            if remaining <= 0:
                 logger.info(
-                    f"#{self.serial_number}: Daily limit of 10 clicks reached. Exiting.")
-                return
-
-            for attempt in range(15):
-                if stop_event.is_set():
-                    logger.debug(
-                        f"#{self.serial_number}: Stop event detected. Exiting 'Quests' process.")
-                    break
-
-                if self.daily_click_data[serial_number_str]["clicks"] >= 10:
-                    logger.info(
-                        f"#{self.serial_number}: Reached daily limit of 10 clicks. Exiting.")
-                    break
-
-                try:
-                    top_left_button = WebDriverWait(self.driver, 2).until(
-                        EC.element_to_be_clickable(
-                            (By.CSS_SELECTOR, "div#ui-top-left a.ui-link.blur svg"))
-                    )
-                    top_left_button.click()
-                    logger.debug(
-                        f"#{self.serial_number}: Clicked top-left button.")
-
-                    try:
-                        elki_igalki_button = WebDriverWait(self.driver, 4).until(
-                            EC.element_to_be_clickable(
-                                (By.XPATH,
-                                 "//a[contains(., 'Ёлки-иголки!') or contains(., 'Collect needles')]")
-                            )
-                        )
-                        elki_igalki_button.click()
-                        self.update_click_data(
-                            serial_number_str, current_date, increment_click=True)
-                        logger.info(
-                            f"#{self.serial_number}: Clicked 'Ёлки-иголки!' button. Total clicks today: {self.daily_click_data[serial_number_str]['clicks']}"
-                        )
-                    except TimeoutException:
-                        logger.debug(
-                            f"#{self.serial_number}: 'Ёлки-иголки!' button not found. Continuing attempts...")
-
-                except TimeoutException:
-                    logger.debug(
-                        f"#{self.serial_number}: Top-left button not found. Retrying...")
-                except Exception as e:
-                    logger.error(
-                        f"#{self.serial_number}: Unexpected error during 'Quests' process: {str(e)}")
-                    break
+                    f"#{self.serial_number}: Daily limit of {DAILY_CLICK_LIMIT} clicks reached. Exiting.")
+                return True
 
-                stop_event.wait(1)
+            if stop_event.is_set():
+                logger.debug(
+                    f"#{self.serial_number}: Stop event detected. Exiting 'Quests' process.")
+                return True
 
-            logger.info(
-                f"#{self.serial_number}: Returning home after quest creation.")
-            self.preparing_account()
+            if should_yield and should_yield():
+                logger.info(
+                    f"#{self.serial_number}: Farming work is waiting. Pausing 'Quests' process.")
+                return False
 
-        except Exception as e:
-            logger.error(
-                f"#{self.serial_number}: Error in 'Quests' process: {str(e)}")
+            delay_min = get_int_setting(
+                self.settings, "QUEST_CLICK_DELAY_MIN", 1000)
+            delay_max = max(delay_min, get_int_setting(
+                self.settings, "QUEST_CLICK_DELAY_MAX", 2500))
+            # Клики выполняет фоновая задача на странице, поэтому между опросами
+            # квест может уступить место фарму. Таймаут — худший случай:
+            # все попытки с ожиданием кнопок и паузой
+            status = run_page_job(
+                self.driver, "needles", NEEDLES_QUEST_JOB_JS,
+                args={"remaining": remaining, "maxAttempts": QUEST_MAX_ATTEMPTS,
+                      "delayMin": delay_min, "delayMax": delay_max},
+                timeout=QUEST_MAX_ATTEMPTS * (6 + delay_max / 1000) + 30,
+                poll_interval=2,
+                should_stop=should_yield,
+            )
 
-    def create_quests2(self):
-        """
-        Выполняет процесс создания одноразового квеста.
-        После входа в окно поиска запускается JavaScript, который кликает по пустому progress‑бару,
-        имитируя клики до заполнения, затем по заполнённому progress‑бару.
-        После завершения квеста отмечается его выполнение в таблице (больше в него заходить не надо).
-        """
-        try:
+            progress = status.get("progress") or {}
+            clicks = progress.get("clicks", 0)
+            # Итог задачи полнее прогресса: он записан уже после последней попытки
+            results = (status.get("result") or {}).get(
+                "results") or progress.get("results") or []
+            self.last_quest_results = results
+            for result in results:
+                logger.debug(
+                    f"#{self.serial_number}: Quest attempt {result.get('attempt')}: {result.get('outcome')} at "
+                    f"{datetime.fromtimestamp(result.get('at', 0) / 1000).strftime('%H:%M:%S')}")
+            missed = sum(1 for result in results if result.get("outcome") != "clicked")
+            if missed:
+                logger.info(
+                    f"#{self.serial_number}: {missed} of {len(results)} quest attempt(s) missed.")
+            if status.get("error"):
+                logger.error(
+                    f"#{self.serial_number}: Quest job error: {status['error']}")
+            self.update_click_data(
+                serial_number_str, current_date, clicks=clicks)
             logger.info(
-                f"#{self.serial_number}: Starting one-time 'Quests' process.")
-
-            # (Если необходимо, обновляем данные квеста – для одноразового квеста больше лимит не нужен)
-            # Например, можно проверить, выполнен ли квест уже:
-            # if self.is_quest_completed():
-            #     logger.info(
-            #         f"#{self.serial_number}: Quest already completed. Exiting.")
-            #     return
-
-            # Переходим в окно поиска: жмем на кнопку в #ui-top-left
-            top_left_button = WebDriverWait(self.driver, 5).until(
-                EC.element_to_be_clickable(
-                    (By.CSS_SELECTOR, "div#ui-top-left a.ui-link.blur svg"))
+                f"#{self.serial_number}: Clicked 'Ёлки-иголки!' {clicks} time(s) in "
+                f"{progress.get('attempts', 0)} attempt(s). "
+                f"Total clicks today: {self.daily_click_data[serial_number_str]['clicks']}"
             )
-            top_left_button.click()
-            logger.debug(
-                f"#{self.serial_number}: Clicked top-left search button.")
-            time.sleep(2)  # Ждём, чтобы окно поиска полностью открылось
-
-            # Асинхронно запускаем наш JavaScript, который выполняет клики по progress‑бару
-            # и завершает работу, когда квест выполнен.
-            # Скрипт завершается вызовом arguments[0]("done").
-            js_code = r"""
-                        (function() {
-            let startTime = Date.now();
-            let filledCount = 0; // Количество кликов по заполнённому progress‑бару
-            const maxFilled = 10; // Остановиться после 10 кликов
-            const maxDuration = 15 * 60 * 1000; // 15 минут в миллисекундах
-            let stopScript = false;
-
-            window.addEventListener("keydown", function(e) {
-                if (e.key.toLowerCase() === "m") {
-                stopScript = true;
-                console.log("Скрипт остановлен по нажатию клавиши 'm'.");
-                }
-            });
-
-            function showClickIndicator(x, y) {
-                if (stopScript) return;
-                const indicator = document.createElement("div");
-                indicator.style.position = "absolute";
-                indicator.style.left = `${x - 10}px`;
-                indicator.style.top = `${y - 10}px`;
-                indicator.style.width = "20px";
-                indicator.style.height = "20px";
-                indicator.style.border = "2px solid red";
-                indicator.style.borderRadius = "50%";
-                indicator.style.pointerEvents = "none";
-                indicator.style.zIndex = 9999;
-                indicator.style.transition = "opacity 0.5s ease-out";
-                document.body.appendChild(indicator);
-                setTimeout(() => {
-                indicator.style.opacity = "0";
-                setTimeout(() => indicator.remove(), 500);
-                }, 100);
-            }
-
-            function clickWithDeviation() {
-                if (stopScript) return;
-                const app = document.getElementById("app");
-                if (!app) return;
-                const rect = app.getBoundingClientRect();
-                const centerX = rect.left + rect.width / 2;
-                const centerY = rect.top + rect.height / 2;
-                const deviationX = (Math.random() * 40) - 20;
-                const deviationY = (Math.random() * 40) - 20;
-                const x = centerX + deviationX;
-                const y = centerY + deviationY;
-                const target = document.elementFromPoint(x, y);
-                console.log("Клик по координатам:", x.toFixed(2), y.toFixed(2), "Целевой элемент:", target);
-                if (target) {
-                const opts = { bubbles: true, cancelable: true, clientX: x, clientY: y };
-                target.dispatchEvent(new MouseEvent("mousedown", opts));
-                target.dispatchEvent(new MouseEvent("mouseup", opts));
-                target.dispatchEvent(new MouseEvent("click", opts));
-                }
-                showClickIndicator(x, y);
-            }
-
-            function heartbeat() {
-                if (stopScript) return;
-                clickWithDeviation();
-                setTimeout(() => { if (!stopScript) clickWithDeviation(); }, 400);
-            }
-
-            function isProgressFilled() {
-                if (stopScript) return false;
-                const anchor = document.querySelector("#ui-bottom a.ui-link.blur");
-                if (!anchor) {
-                console.log("Элемент progress‑бара не найден в #ui-bottom.");
-                return false;
-                }
-                if (anchor.classList.contains("disabled") || anchor.querySelector(".progress-bar-container")) {
-                console.log("Progress‑бар пустой (есть disabled или .progress-bar-container).");
-                return false;
-                }
-                const path2 = anchor.querySelector("svg path:nth-of-type(2)");
-                if (path2 && path2.getAttribute("fill") === "currentColor") {
-                console.log("Progress‑бар заполнен.");
-                return true;
-                }
-                console.log("Progress‑бар не заполнен (нет второго path с fill='currentColor').");
-                return false;
-            }
-
-            function clickFilledProgressBar() {
-                if (stopScript) return;
-                const anchor = document.querySelector("#ui-bottom a.ui-link.blur");
-                if (anchor && isProgressFilled()) {
-                console.log("Кликаем по заполнённому progress‑бару:", anchor);
-                anchor.click();
-                }
-            }
-
-            function waitForReset(callback) {
-                if (stopScript) return;
-                const interval = setInterval(() => {
-                if (stopScript) { clearInterval(interval); return; }
-                if (!isProgressFilled()) {
-                    clearInterval(interval);
-                    console.log("Progress‑бар сбросился, продолжаем цикл.");
-                    callback();
-                }
-                }, 500);
-            }
-
-            function clickSearchButton() {
-                if (stopScript) return;
-                const btn = document.querySelector("#ui-top-left a.ui-link.blur");
-                if (btn) {
-                console.log("Нажимаем кнопку поиска (#ui-top‑left).");
-                btn.click();
-                } else {
-                console.log("Кнопка поиска не найдена.");
-                }
-            }
-
-            function monitorProgress(callback) {
-                if (stopScript) return;
-                // Проверяем таймаут выполнения:
-                if (Date.now() - startTime > maxDuration) {
-                console.log("Достигнут лимит по времени. Завершаем скрипт.");
-                callback("timeout");
-                return;
-                }
-                if (isProgressFilled()) {
-                callback();
-                } else {
-                heartbeat();
-                setTimeout(() => { monitorProgress(callback); }, 1200);
-                }
-            }
-
-            function mainLoop() {
-                if (stopScript) { console.log("Скрипт остановлен."); return; }
-                if (filledCount >= maxFilled) {
-                console.log("Выполнено 10 заполнённых progress‑баров. Цикл завершён.");
-                arguments[0]("done");
-                return;
-                }
-                const container = document.querySelector(".progress-bar-container");
-                if (!container) {
-                clickSearchButton();
-                setTimeout(mainLoop, 3000);
-                return;
-                }
-                monitorProgress((result) => {
-                if (result === "timeout") {
-                    arguments[0]("timeout");
-                    return;
-                }
-                clickFilledProgressBar();
-                filledCount++;
-                console.log("Заполнённых progress‑баров:", filledCount);
-                // Пауза 5 секунд после клика по заполнённому progress‑бару
-                setTimeout(mainLoop, 5000);
-                });
-            }
-            mainLoop(arguments[0]);
-            })();
-
+            if status.get("state") == "cancelled" and not stop_event.is_set():
+                logger.info(
+                    f"#{self.serial_number}: Farming work is waiting. Pausing 'Quests' process.")
+                return False
 
-            """
-            # Запускаем асинхронный скрипт (ожидаем, пока он вызовет callback)
-            # установит таймаут в 15 минут
-            self.driver.set_script_timeout(15*60)
-            try:
-                logger.info(f"Starting JS execution for quests.")
-                result = self.driver.execute_async_script(js_code)
-                logger.info(f"JS script finished with result: {result}")
-            except Exception as e:
-                logger.error(f"JS execution failed: {e}")
             logger.info(
-                f"#{self.serial_number}: Quest JS finished with result: {result}")
-            # Отмечаем квест как выполненный (однократно, без сброса через сутки)
-            # self.mark_quest_completed()
-            logger.info(f"#{self.serial_number}: Quest marked as completed.")
+                f"#{self.serial_number}: Returning home after quest creation.")
             self.preparing_account()
+            return True
 
         except Exception as e:
             logger.error(
                 f"#{self.serial_number}: Error in 'Quests' process: {str(e)}")
+            return True
@@ -0,0 +1,160 @@
+import os
+import json
+import functools
+import time
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from utils import get_int_setting
+import logging
+
+# Настройка логирования
+logger = logging.getLogger("application_logger")
+
+TRACE_FILE = os.path.join("log", "trace.json")
+DEFAULT_TRACE_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_TRACE_BACKUPS = 3
+
+_tracer = None
+
+
+class Tracer:
+    """
+    Запись интервалов (span) в формате Chrome trace-event (JSON Array Format).
+
+    Каждое событие пишется отдельной строкой, поэтому файл открывается в
+    chrome://tracing и Perfetto даже без закрывающей скобки. Интервалы одного
+    аккаунта выводятся на отдельной дорожке (tid = номер аккаунта).
+    При превышении max_bytes файл ротируется с сохранением backups копий.
+
+    :param path: Путь к файлу трассировки.
+    """
+
+    def __init__(self, path=TRACE_FILE, max_bytes=DEFAULT_TRACE_MAX_BYTES, backups=DEFAULT_TRACE_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.named_tracks = set()
+        self.file = None
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = open(self.path, "a", encoding="utf-8")
+        if self.file.tell() == 0:
+            self.file.write("[\n")
+        self.named_tracks = set()
+
+    def _rotate(self):
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def _write(self, event):
+        self.file.write(json.dumps(event, ensure_ascii=False) + ",\n")
+
+    def emit(self, name, start, duration, track, args):
+        """
+        Записывает завершённый интервал.
+
+        :param start: Время начала (time.time()).
+        :param duration: Длительность в секундах.
+        :param track: Дорожка (номер аккаунта или имя потока).
+        """
+        try:
+            with self.lock:
+                if self.file is None:
+                    self._open()
+                elif self.max_bytes and self.file.tell() > self.max_bytes:
+                    self._rotate()
+                tid = track if isinstance(track, int) else threading.get_ident()
+                if tid not in self.named_tracks:
+                    self.named_tracks.add(tid)
+                    self._write({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                                 "args": {"name": f"#{track}" if isinstance(track, int) else str(track)}})
+                self._write({
+                    "name": name, "cat": "run", "ph": "X",
+                    "ts": int(start * 1_000_000), "dur": int(duration * 1_000_000),
+                    "pid": self.pid, "tid": tid, "args": args,
+                })
+                self.file.flush()
+        except Exception as e:
+            logger.debug(f"Failed to write trace event '{name}': {e}")
+
+
+def configure_tracing(settings):
+    """
+    Включает трассировку, если TRACE_ENABLED=true.
+    Процессы воркеров пишут в отдельные файлы (trace-<pid>.json).
+    """
+    global _tracer
+    if settings.get("TRACE_ENABLED", "false").strip().lower() != "true":
+        _tracer = None
+        return None
+    path = TRACE_FILE
+    if multiprocessing.current_process().name != "MainProcess":
+        root, ext = os.path.splitext(TRACE_FILE)
+        path = f"{root}-{os.getpid()}{ext}"
+    _tracer = Tracer(
+        path,
+        max_bytes=get_int_setting(
+            settings, "TRACE_MAX_BYTES", DEFAULT_TRACE_MAX_BYTES),
+        backups=get_int_setting(settings, "TRACE_BACKUPS",
+                                DEFAULT_TRACE_BACKUPS),
+    )
+    logger.info(f"Tracing enabled: {path}")
+    return _tracer
+
+
+@contextmanager
+def span(name, account=None, **args):
+    """
+    Интервал трассировки. Вложенные интервалы одного аккаунта отображаются вложенными.
+    Результат (ok или имя класса исключения) записывается в args.outcome;
+    код внутри интервала может задать его сам через возвращаемый словарь args.
+
+    :param name: Имя интервала (шаг, метод).
+    :param account: Аккаунт (определяет дорожку).
+    """
+    if _tracer is None:
+        yield args
+        return
+    start = time.time()
+    started = time.perf_counter()
+    try:
+        yield args
+    except BaseException as e:
+        args["outcome"] = type(e).__name__
+        raise
+    finally:
+        args["account"] = account
+        args.setdefault("outcome", "ok")
+        track = int(account) if str(account).isdigit() else (
+            account or threading.current_thread().name)
+        _tracer.emit(name, start, time.perf_counter() - started, track, args)
+
+
+def traced(name, account_attr="serial_number"):
+    """
+    Декоратор метода: выполняет метод внутри интервала трассировки.
+    Аккаунт берётся из атрибута экземпляра account_attr; результат False
+    записывается как outcome=failed.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with span(name, getattr(self, account_attr, None)) as trace_args:
+                result = method(self, *args, **kwargs)
+                if result is False:
+                    trace_args["outcome"] = "failed"
+                return result
+        return wrapper
+    return decorator
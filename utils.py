@@ -11,6 +11,13 @@ import requests
 import importlib
 import time
 import glob
+from contextlib import contextmanager
+from metrics import adspower_requests_total
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
 
 # Инициализация colorama для Windows
 init(autoreset=True)
@@ -368,6 +375,7 @@ def get_all_profiles():
     while True:
         params = {"page": page, "page_size": 100}
         try:
+            adspower_requests_total.inc(endpoint="/user/list")
             response = requests.get(url, params=params)
             response.raise_for_status()
 
@@ -465,6 +473,58 @@ def get_max_games(settings):
     return None  # Если max_games не задано или указано некорректно, возвращаем None
 
 
+def get_int_setting(settings, key, default):
+    """
+    Возвращает целочисленное значение настройки.
+
+    :param settings: Словарь с настройками.
+    :param key: Имя настройки.
+    :param default: Значение по умолчанию, если настройка не задана или некорректна.
+    """
+    value = str(settings.get(key, "")).strip()
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(
+            f"Invalid value for '{key}': {value}. Using default {default}.")
+        return default
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Межпроцессная блокировка файла через соседний файл <path>.lock.
+    Нужна для общих файлов, которые изменяют процессы воркеров (WORKER_MODE=process):
+    блокировка threading.Lock действует только внутри одного процесса.
+
+    :param path: Путь к защищаемому файлу.
+    """
+    lock_path = f"{path}.lock"
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    with open(lock_path, "a+") as handle:
+        if os.name == "nt":
+            handle.seek(0)
+            while True:
+                try:
+                    # LK_LOCK ждёт около 10 секунд и выбрасывает OSError, если файл всё ещё занят
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
 def check_requirements(requirements_file="requirements.txt"):
     """
     Проверяет зависимости из файла requirements.txt.
@@ -0,0 +1,86 @@
+from errors import classify_error
+import logging
+
+# Модуль не выполняет действий при импорте: с ним стартуют процессы воркеров
+# (см. worker_pool._start_process), а зависимости сессии импортируются в worker_main.
+
+# Настройка логирования
+logger = logging.getLogger("application_logger")
+
+# Задачи, выполняемые в процессе воркера
+JOB_FARM = "farm"
+JOB_QUESTS = "quests"
+
+
+def worker_main(tasks, results, yield_event, settings, debug_mode, visible_mode):
+    """
+    Точка входа процесса воркера.
+
+    Процесс держит одну сессию браузера и выполняет команды родителя:
+    ("run", аккаунт, выполненные шаги, задача) и ("close", таймаут),
+    где задача — JOB_FARM или JOB_QUESTS.
+    Ход выполнения шагов передаётся родителю, чтобы контрольная точка
+    и сторож в родительском процессе оставались актуальными.
+    """
+    from utils import setup_logger, visible
+    from telegram_bot_automation import TelegramBotAutomation
+    from pipeline import RunCheckpoint, run_account_session, run_quest_session
+    from tracing import configure_tracing
+
+    setup_logger(debug_mode=debug_mode, log_dir="./log")
+    configure_tracing(settings)
+    if visible_mode:
+        visible.set()
+
+    class ReportingCheckpoint(RunCheckpoint):
+        """
+        Контрольная точка, сообщающая родителю о начале и завершении шагов.
+        """
+
+        def start_step(self, step):
+            super().start_step(step)
+            results.put(("step", step))
+
+        def mark_done(self, step, result=None):
+            super().mark_done(step, result)
+            results.put(("done", step, result))
+
+    bot = None
+    while True:
+        try:
+            command = tasks.get()
+        except (KeyboardInterrupt, EOFError):
+            break
+        if command is None:
+            break
+
+        if command[0] == "run":
+            _, account, completed, job = command
+            checkpoint = ReportingCheckpoint(account)
+            checkpoint.completed.update(completed)
+            try:
+                if bot is None:
+                    bot = TelegramBotAutomation(account, settings)
+                    results.put(
+                        ("launched", bot.browser_manager.launch_latency))
+                if job == JOB_QUESTS:
+                    result = run_quest_session(
+                        bot, account, checkpoint, should_yield=yield_event.is_set)
+                else:
+                    result = run_account_session(bot, account, checkpoint)
+                results.put(("result", result))
+            except KeyboardInterrupt:
+                break
+            except Exception as e:
+                error = classify_error(e)
+                message = str(e).splitlines()[0] if str(e) else ""
+                results.put(("error", type(error).__name__, message))
+
+        elif command[0] == "close":
+            if bot:
+                try:
+                    bot.browser_manager.close_browser(timeout=command[1])
+                except Exception as e:
+                    logger.debug(f"Failed to close browser in worker: {e}")
+            bot = None
+            results.put(("closed",))
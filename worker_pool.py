@@ -0,0 +1,261 @@
+import sys
+import time
+import multiprocessing
+from queue import Empty
+from threading import Lock
+import errors
+from errors import AutomationError, AdsPowerError
+from browser_manager import BrowserManager
+from worker import worker_main, JOB_FARM, JOB_QUESTS
+import logging
+
+# Настройка логирования
+logger = logging.getLogger("application_logger")
+
+DEFAULT_MAX_SESSIONS = 20  # Количество сессий, после которого процесс воркера перезапускается
+POLL_INTERVAL = 1  # Интервал проверки ответа и состояния процесса, сек
+
+def _start_process(process):
+    """
+    Запускает процесс воркера без повторного выполнения main.py.
+
+    При методе spawn дочерний процесс заново выполняет модуль __main__ родителя,
+    а main.py при импорте проверяет зависимости, читает настройки и переносит
+    файлы. На время запуска модулем __main__ считается worker.py.
+    """
+    main_module = sys.modules["__main__"]
+    sys.modules["__main__"] = sys.modules[worker_main.__module__]
+    try:
+        process.start()
+    finally:
+        sys.modules["__main__"] = main_module
+
+
+def _rebuild_error(name, message):
+    """
+    Восстанавливает исключение, классифицированное в процессе воркера.
+    """
+    error_class = getattr(errors, name, None)
+    if isinstance(error_class, type) and issubclass(error_class, AutomationError):
+        return error_class(message)
+    return RuntimeError(f"{name}: {message}")
+
+
+class WorkerProcess:
+    """
+    Процесс воркера с собственными очередями команд и результатов.
+    """
+
+    def __init__(self, context, settings, debug_mode, visible_mode):
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.yield_event = context.Event()  # Сигнал квестам уступить место фарму
+        self.sessions = 0
+        self.process = context.Process(
+            target=worker_main,
+            args=(self.tasks, self.results, self.yield_event, settings,
+                  debug_mode, visible_mode),
+            daemon=True,
+        )
+        _start_process(self.process)
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def receive(self, on_wait=None):
+        """
+        Ждёт сообщение от процесса. Если процесс завершился, выбрасывает AdsPowerError.
+
+        :param on_wait: Функция, вызываемая при каждом интервале ожидания.
+        """
+        while True:
+            try:
+                return self.results.get(timeout=POLL_INTERVAL)
+            except Empty:
+                if on_wait:
+                    on_wait()
+                if not self.process.is_alive():
+                    raise AdsPowerError(
+                        f"Worker process exited with code {self.process.exitcode}")
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=POLL_INTERVAL)
+
+    def request_stop(self):
+        """
+        Просит процесс завершиться после текущей команды.
+        """
+        try:
+            self.tasks.put(None)
+        except Exception:
+            pass
+
+    def stop(self, timeout):
+        """
+        Просит процесс завершиться и принудительно завершает его по истечении таймаута.
+        """
+        self.request_stop()
+        self.process.join(timeout=timeout)
+        self.kill()
+
+
+class WorkerSession:
+    """
+    Сессия аккаунта в процессе пула. Повторяет интерфейс, который планировщик
+    использует для сессии в потоке: browser_manager (остановка профиля через API)
+    и выполнение запуска с контрольной точкой.
+    """
+
+    def __init__(self, pool, worker, account):
+        self.pool = pool
+        self.worker = worker
+        self.account = account
+        # Менеджер без WebDriver: останавливает профиль через API при принудительном закрытии
+        self.browser_manager = BrowserManager(account)
+
+    def run(self, checkpoint):
+        """
+        Выполняет запуск аккаунта в процессе воркера.
+
+        :return: Кортеж (имя пользователя, баланс, замер прогресса до сбора, замер прогресса в конце).
+        """
+        return self._execute(JOB_FARM, checkpoint)
+
+    def run_quests(self, checkpoint, should_yield=None):
+        """
+        Выполняет квесты аккаунта в процессе воркера.
+        Пока выполняются квесты, родитель проверяет should_yield и передаёт сигнал процессу.
+
+        :return: True, если квесты завершены, False — если прерваны.
+        """
+        self.worker.yield_event.clear()
+
+        def check_yield():
+            if should_yield and should_yield():
+                self.worker.yield_event.set()
+
+        return self._execute(JOB_QUESTS, checkpoint, on_wait=check_yield)
+
+    def _execute(self, job, checkpoint, on_wait=None):
+        self.worker.tasks.put(
+            ("run", self.account, dict(checkpoint.completed), job))
+        while True:
+            message = self.worker.receive(on_wait)
+            kind = message[0]
+            if kind == "step":
+                checkpoint.start_step(message[1])
+            elif kind == "done":
+                checkpoint.finish_step()
+                checkpoint.mark_done(message[1], message[2])
+            elif kind == "launched":
+                if self.pool.on_launch and message[1] is not None:
+                    self.pool.on_launch(message[1])
+            elif kind == "result":
+                return message[1]
+            elif kind == "error":
+                checkpoint.finish_step()
+                raise _rebuild_error(message[1], message[2])
+
+    def kill(self):
+        """
+        Принудительно завершает процесс воркера (например, по сигналу сторожа).
+        """
+        logger.warning(f"#{self.account}: Killing worker process.")
+        self.worker.kill()
+
+    def close(self, timeout):
+        """
+        Закрывает браузер в процессе воркера и возвращает процесс в пул.
+        Если процесс не отвечает, он завершается, а профиль останавливается через API.
+        """
+        closed = False
+        if self.worker.is_alive():
+            self.worker.tasks.put(("close", timeout))
+            try:
+                while self.worker.results.get(timeout=timeout + POLL_INTERVAL)[0] != "closed":
+                    pass
+                closed = True
+            except Empty:
+                logger.warning(
+                    f"#{self.account}: Worker did not close the browser in time.")
+        if not closed:
+            self.worker.kill()
+            self.browser_manager.close_browser(timeout=timeout)
+        self.pool.release(self.worker)
+
+
+class WorkerPool:
+    """
+    Пул процессов воркеров для изоляции сессий браузера.
+
+    Зависший или разросшийся по памяти процесс можно завершить без перезапуска
+    планировщика: на его место при следующем запросе создаётся новый.
+    Процессы перезапускаются после max_sessions сессий.
+
+    :param settings: Настройки, передаваемые в процессы.
+    :param on_launch: Функция, получающая время запуска профиля (сек).
+    :param max_sessions: Количество сессий на один процесс.
+    """
+
+    def __init__(self, settings, on_launch=None, max_sessions=DEFAULT_MAX_SESSIONS, debug_mode=False, visible_mode=False):
+        self.context = multiprocessing.get_context("spawn")
+        self.settings = settings
+        self.on_launch = on_launch
+        self.max_sessions = max_sessions
+        self.debug_mode = debug_mode
+        self.visible_mode = visible_mode
+        self.lock = Lock()
+        self.idle = []
+        self.workers = []
+
+    def acquire(self, account):
+        """
+        Выделяет процесс воркера для сессии аккаунта.
+        """
+        with self.lock:
+            while self.idle:
+                worker = self.idle.pop()
+                if worker.is_alive():
+                    break
+                self.workers.remove(worker)
+            else:
+                worker = WorkerProcess(
+                    self.context, self.settings, self.debug_mode, self.visible_mode)
+                self.workers.append(worker)
+                logger.debug(
+                    f"Worker process {worker.process.pid} started for account {account}.")
+            worker.sessions += 1
+        return WorkerSession(self, worker, account)
+
+    def release(self, worker):
+        """
+        Возвращает процесс в пул. Завершённые и отработавшие лимит сессий процессы удаляются.
+        """
+        with self.lock:
+            if worker.is_alive() and worker.sessions < self.max_sessions:
+                self.idle.append(worker)
+                return
+            if worker in self.workers:
+                self.workers.remove(worker)
+        if worker.is_alive():
+            logger.debug(
+                f"Worker process {worker.process.pid} recycled after {worker.sessions} sessions.")
+            worker.stop(timeout=POLL_INTERVAL * 5)
+
+    def shutdown(self, timeout=5):
+        """
+        Завершает все процессы пула. Сигнал остановки отправляется всем процессам
+        сразу, и они завершаются параллельно в пределах общего таймаута.
+        """
+        with self.lock:
+            workers, self.workers, self.idle = self.workers, [], []
+        for worker in workers:
+            worker.request_stop()
+        deadline = time.monotonic() + timeout
+        for worker in workers:
+            worker.process.join(
+                timeout=max(0, deadline - time.monotonic()))
+        for worker in workers:
+            worker.kill()